@@ -0,0 +1,102 @@
+import bech32
+
+"""
+Shelley addresses (CIP-19)
+"""
+
+# Header type nibble of a base address with key hash payment and stake credentials
+BASE_ADDRESS_KEY_KEY = 0x0
+# Base addresses are types 0 to 3: bit 0 set for a script payment credential, bit 1 for a script stake credential
+BASE_ADDRESS_TYPES = range(0x0, 0x4)
+POINTER_ADDRESS_TYPES = range(0x4, 0x6)
+ENTERPRISE_ADDRESS_TYPES = range(0x6, 0x8)
+BYRON_ADDRESS_TYPE = 0x8
+# Reward (stake) addresses, 0xe for a key hash and 0xf for a script hash stake credential
+STAKE_ADDRESS_KEY = 0xe
+STAKE_ADDRESS_SCRIPT = 0xf
+
+CREDENTIAL_SIZE = 28
+
+NETWORK_IDS = {'mainnet': 1, 'testnet': 0}
+
+
+def address_hrp(network_id):
+    return 'addr' if network_id == 1 else 'addr_test'
+
+
+def stake_address_hrp(network_id):
+    return 'stake' if network_id == 1 else 'stake_test'
+
+
+def base_address(payment_key_hash, stake_key_hash, network):
+    """
+    Bech32 base address, what `cardano-cli address build` prints for a payment and a stake verification key
+    :param payment_key_hash: blake2b-224 of the payment verification key
+    :param stake_key_hash: blake2b-224 of the stake verification key
+    :param network: 'mainnet' or 'testnet'
+    :return: bech32 address
+    """
+    network_id = NETWORK_IDS[network]
+    header = bytes([(BASE_ADDRESS_KEY_KEY << 4) | network_id])
+    return bech32.encode(address_hrp(network_id), header + payment_key_hash + stake_key_hash)
+
+
+def address_from_bytes(address_bytes):
+    """
+    Bech32 form of a Shelley address as it appears in a transaction output
+    :return: bech32 address, None for Byron addresses
+    """
+    if address_bytes[0] >> 4 > 7:
+        return None
+    return bech32.encode(address_hrp(address_bytes[0] & 0x0f), address_bytes)
+
+
+def parse_address(address):
+    """
+    Split a bech32 Shelley address into its parts
+    :return: (header type, network id, payment credential bytes or None, stake credential bytes or None), the stake
+             credential of base addresses only, None for addresses that aren't bech32 (Byron) or are malformed
+    """
+    try:
+        _, address_bytes = bech32.decode(address)
+    except bech32.Bech32Error:
+        return None
+    if not address_bytes:
+        return None
+    address_type = address_bytes[0] >> 4
+    network_id = address_bytes[0] & 0x0f
+    body = address_bytes[1:]
+    if address_type in BASE_ADDRESS_TYPES:
+        if len(body) != 2 * CREDENTIAL_SIZE:
+            return None
+        return address_type, network_id, body[:CREDENTIAL_SIZE], body[CREDENTIAL_SIZE:]
+    if address_type in (STAKE_ADDRESS_KEY, STAKE_ADDRESS_SCRIPT):
+        return (address_type, network_id, None, body) if len(body) == CREDENTIAL_SIZE else None
+    if address_type in POINTER_ADDRESS_TYPES or address_type in ENTERPRISE_ADDRESS_TYPES:
+        # The stake part of a pointer address is a certificate pointer, only the chain can resolve it
+        return (address_type, network_id, body[:CREDENTIAL_SIZE], None) if len(body) >= CREDENTIAL_SIZE else None
+    return None
+
+
+def stake_address(stake_credential, network_id, script=False):
+    """
+    Bech32 stake address, what `cardano-cli stake-address build` prints
+    :param stake_credential: blake2b-224 of the stake verification key or of the script
+    :param network_id: 1 for mainnet, 0 for testnets
+    :param script: True for a script hash credential
+    :return: bech32 stake address
+    """
+    header = bytes([((STAKE_ADDRESS_SCRIPT if script else STAKE_ADDRESS_KEY) << 4) | network_id])
+    return bech32.encode(stake_address_hrp(network_id), header + stake_credential)
+
+
+def base_stake_address(address):
+    """
+    Stake address embedded in a base address, no lookup needed
+    :return: bech32 stake address, None for other addresses (pointer, enterprise, Byron) and malformed ones
+    """
+    parts = parse_address(address)
+    if parts is None or parts[0] not in BASE_ADDRESS_TYPES:
+        return None
+    address_type, network_id, _, stake_credential = parts
+    return stake_address(stake_credential, network_id, bool(address_type & 0x2))
@@ -0,0 +1,80 @@
+"""
+Bech32 (BIP-173) encoding used by Shelley addresses, without the 90 character limit
+"""
+
+CHARSET = 'qpzry9x8gf2tvdw0s3jn54khce6mua7l'
+_CHARSET_MAP = {c: i for i, c in enumerate(CHARSET)}
+_GENERATOR = [0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3]
+
+
+class Bech32Error(ValueError):
+    pass
+
+
+def _polymod(values):
+    checksum = 1
+    for value in values:
+        top = checksum >> 25
+        checksum = (checksum & 0x1ffffff) << 5 ^ value
+        for i in range(5):
+            if (top >> i) & 1:
+                checksum ^= _GENERATOR[i]
+    return checksum
+
+
+def _hrp_expand(hrp):
+    return [ord(c) >> 5 for c in hrp] + [0] + [ord(c) & 31 for c in hrp]
+
+
+def _convert_bits(data, from_bits, to_bits, pad):
+    accumulator = 0
+    bits = 0
+    result = []
+    max_value = (1 << to_bits) - 1
+    for value in data:
+        accumulator = (accumulator << from_bits) | value
+        bits += from_bits
+        while bits >= to_bits:
+            bits -= to_bits
+            result.append((accumulator >> bits) & max_value)
+    if pad:
+        if bits:
+            result.append((accumulator << (to_bits - bits)) & max_value)
+    elif bits >= from_bits or ((accumulator << (to_bits - bits)) & max_value):
+        raise Bech32Error('bech32: invalid padding')
+    return result
+
+
+def encode(hrp, data):
+    """
+    Encode bytes as bech32
+    :param hrp: human readable part, e.g. 'addr' or 'stake_test'
+    :param data: payload bytes
+    :return: bech32 string
+    """
+    words = _convert_bits(data, 8, 5, True)
+    polymod = _polymod(_hrp_expand(hrp) + words + [0] * 6) ^ 1
+    checksum = [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
+    return hrp + '1' + ''.join(CHARSET[w] for w in words + checksum)
+
+
+def decode(text):
+    """
+    Decode a bech32 string
+    :param text: bech32 string
+    :return: (hrp, payload bytes)
+    """
+    if text.lower() != text and text.upper() != text:
+        raise Bech32Error('bech32: mixed case')
+    text = text.lower()
+    separator = text.rfind('1')
+    if separator < 1 or separator + 7 > len(text):
+        raise Bech32Error('bech32: missing separator or checksum')
+    hrp = text[:separator]
+    try:
+        words = [_CHARSET_MAP[c] for c in text[separator + 1:]]
+    except KeyError:
+        raise Bech32Error('bech32: invalid character')
+    if _polymod(_hrp_expand(hrp) + words) != 1:
+        raise Bech32Error('bech32: invalid checksum')
+    return hrp, bytes(_convert_bits(words[:-6], 5, 8, False))
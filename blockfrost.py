@@ -0,0 +1,314 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from scheduler import *
+
+"""
+Blockfrost API client shared by every call
+"""
+
+logger = logging.getLogger("default")
+
+# Items of a full page, Blockfrost's default count
+PAGE_SIZE = 100
+# Longest backoff between two attempts of a rate limited call, unless Retry-After asks for more
+BACKOFF_CAP = 60
+# Body of a call the rate limiter gave up on, shaped like Blockfrost's own 429 answer
+THROTTLED = {'status_code': 429, 'error': 'Too Many Requests', 'message': 'Dropped by the local rate limiter'}
+
+
+class BlockfrostError(Exception):
+    """
+    A Blockfrost call whose answer can't be used: throttled, or an error where the caller needs the resource
+    """
+
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+        super().__init__(f'blockfrost: {status_code} {body.get("error")}: {body.get("message")}')
+
+
+class RateLimiter:
+    """
+    Token bucket shared by every Blockfrost call: burst calls at once, then rate calls per second. Callers wait on the
+    event loop, not on a thread, and are served by priority, then in arrival order, so settlement calls go before
+    polls however many polls are waiting
+    """
+
+    def __init__(self, rate, burst, max_wait):
+        """
+        :param rate: tokens added per second
+        :param burst: tokens the bucket holds
+        :param max_wait: seconds a caller waits for a token before it is dropped
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        # Set after a 429, nobody gets a token before
+        self.paused_until = 0.0
+        self._waiters = []
+        self._sequence = itertools.count()
+        # Wakes the head waiter once its token is there
+        self._timer = None
+        self.acquired = 0
+        self.throttled = 0
+        self.dropped = 0
+        self.pauses = 0
+        self.wait_seconds = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, priority):
+        """
+        Take a token, waiting without blocking the event loop until one is available
+        :param priority: PRIORITY_SETTLEMENT, PRIORITY_DEFAULT or PRIORITY_POLL
+        :return: False when the caller waited max_wait seconds without getting one
+        """
+        start = time.monotonic()
+        self._refill(start)
+        if not self._waiters and start >= self.paused_until and self.tokens >= 1:
+            self.tokens -= 1
+            self.acquired += 1
+            return True
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        self._dispatch()
+        try:
+            await asyncio.wait([future], timeout=self.max_wait)
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The token was handed over right before the cancellation
+                self.tokens += 1
+            future.cancel()
+            self._dispatch()
+            raise
+        if not future.done():
+            future.cancel()
+            self.dropped += 1
+            # The dropped caller may have been the head
+            self._dispatch()
+            return False
+        self.acquired += 1
+        self.throttled += 1
+        self.wait_seconds += time.monotonic() - start
+        return True
+
+    def _dispatch(self):
+        # Hand out the tokens that are there, by priority, and wake up again for the next one
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        self._refill(now)
+        while self._waiters:
+            _, _, future = self._waiters[0]
+            if future.done():
+                # Dropped or cancelled
+                heapq.heappop(self._waiters)
+                continue
+            delay = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            if delay > 0:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                return
+            heapq.heappop(self._waiters)
+            self.tokens -= 1
+            future.set_result(None)
+
+    def pause(self, seconds):
+        """
+        Blockfrost answered 429: hand out no token for seconds, then refill from empty
+        """
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+        self.pauses += 1
+        if self._timer is not None:
+            self._dispatch()
+
+    def stats(self):
+        return {
+            'rate': self.rate,
+            'burst': self.burst,
+            'tokens': round(self.tokens, 2),
+            'waiting': sum(1 for _, _, future in self._waiters if not future.done()),
+            'acquired': self.acquired,
+            'throttled': self.throttled,
+            'dropped': self.dropped,
+            'pauses': self.pauses,
+            'average_wait_seconds': round(self.wait_seconds / self.throttled, 4) if self.throttled else None,
+        }
+
+
+class BlockfrostClient:
+    """
+    One requests.Session for all Blockfrost calls: connections are pooled and kept alive across calls and threads,
+    the project_id header is set once and each response is decoded once. HTTP calls run on threads of its own, one
+    per pooled connection, so the event loop never waits on Blockfrost. With a rate limiter every call takes a token
+    on the event loop first, a thread is only taken once the call may go out, and calls answered 429 are retried
+    after a backoff
+    """
+
+    def __init__(self, network, api_key, pool_size, timeout, page_window=8, limiter=None, retries=3, backoff=1.0):
+        """
+        :param network: 'mainnet' or 'testnet'
+        :param api_key: Blockfrost project id
+        :param pool_size: connections kept open, calls beyond it wait for one
+        :param timeout: seconds to connect and between bytes of a response, per call
+        :param page_window: pages of a paged endpoint fetched at once after the first one
+        :param limiter: RateLimiter, None to call Blockfrost as fast as asked
+        :param retries: attempts after the first one for a call answered 429
+        :param backoff: seconds before the first retry, doubled for each next one
+        """
+        self.base_url = f'https://cardano-{network}.blockfrost.io/api/v0'
+        self.timeout = timeout
+        self.page_window = max(1, page_window)
+        self.limiter = limiter
+        self.retries = retries
+        self.backoff = backoff
+        self._executor = ThreadPoolExecutor(pool_size, thread_name_prefix='blockfrost')
+        self._session = requests.Session()
+        self._session.headers.update({'project_id': api_key})
+        self._session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True))
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.pages_fetched = 0
+        self.pages_wasted = 0
+        self.rate_limited = 0
+        self.retried = 0
+
+    async def request(self, path, params=None, timeout=None):
+        """
+        GET a Blockfrost endpoint. The token is waited for on the event loop with the priority of the calling
+        coroutine, only then the call takes one of the client's threads
+        :param path: path after /api/v0, e.g. '/txs/{hash}/utxos'
+        :param params: query string parameters, e.g. {'page': 2}
+        :param timeout: seconds, the client timeout when None
+        :return: (HTTP status code, decoded JSON body), a body that isn't JSON comes back as {'error': text}, a call
+                 the rate limiter dropped as (429, THROTTLED)
+        """
+        priority = get_command_priority()
+        attempt = 0
+        while True:
+            if self.limiter is not None and not await self.limiter.acquire(priority):
+                return 429, dict(THROTTLED)
+            status_code, data, retry_after = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._fetch, path, params, timeout)
+            if status_code != 429:
+                return status_code, data
+            with self._lock:
+                self.rate_limited += 1
+            if attempt == self.retries:
+                return status_code, data
+            delay = self._backoff(attempt, retry_after)
+            logger.warning('blockfrost: %s rate limited, retrying in %.2f seconds', path, delay)
+            with self._lock:
+                self.retried += 1
+            if self.limiter is not None:
+                # Every caller waits, not only this one
+                self.limiter.pause(delay)
+            else:
+                await asyncio.sleep(delay)
+            attempt += 1
+
+    def _fetch(self, path, params, timeout):
+        # One HTTP call, on a thread of the client: (status code, decoded body, Retry-After header)
+        start = time.monotonic()
+        try:
+            response = self._session.get(self.base_url + path, params=params,
+                                         timeout=self.timeout if timeout is None else timeout)
+        except requests.RequestException:
+            self._count(start, True)
+            raise
+        try:
+            data = response.json()
+        except ValueError:
+            data = {'error': response.text}
+        self._count(start, response.status_code >= 400)
+        return response.status_code, data, response.headers.get('Retry-After')
+
+    def _backoff(self, attempt, retry_after):
+        # Exponential with jitter, so calls throttled together don't all come back at the same moment
+        backoff = min(BACKOFF_CAP, self.backoff * 2 ** attempt)
+        delay = random.uniform(backoff / 2, backoff)
+        try:
+            return max(delay, float(retry_after))
+        except (TypeError, ValueError):
+            # Missing, or an HTTP date
+            return delay
+
+    async def get(self, path, params=None, timeout=None):
+        """
+        :return: decoded JSON body, Blockfrost errors are {'status_code', 'error', 'message'} bodies as before,
+                 except 429: raise BlockfrostError, a throttled call says nothing about the resource
+        """
+        status_code, data = await self.request(path, params, timeout)
+        if status_code == 429:
+            raise BlockfrostError(status_code, data)
+        return data
+
+    async def pages(self, path, params=None, max_pages=None):
+        """
+        Async iterator over the pages of a paged endpoint. The first page is fetched alone, most lists fit in it;
+        after a full page the next page_window pages are fetched in parallel. Iteration stops after the first page
+        that is short, empty or an error, pages fetched beyond it are dropped
+        :param params: query string parameters besides 'page'
+        :param max_pages: last page number to fetch, None for no limit
+        :return: async iterator of (HTTP status code, decoded page), in page order
+        """
+        params = dict(params or {})
+        first = 1
+        size = 1
+        while max_pages is None or first <= max_pages:
+            last = first + size - 1 if max_pages is None else min(first + size - 1, max_pages)
+            results = await asyncio.gather(*(self.request(path, {**params, 'page': number})
+                                             for number in range(first, last + 1)))
+            with self._lock:
+                self.pages_fetched += len(results)
+            for used, (status_code, page) in enumerate(results, 1):
+                final = not isinstance(page, list) or len(page) < PAGE_SIZE
+                if final:
+                    # Counted before yielding, the caller may stop iterating at this page
+                    with self._lock:
+                        self.pages_wasted += len(results) - used
+                yield status_code, page
+                if final:
+                    return
+            first = last + 1
+            size = self.page_window
+
+    def _count(self, start, failed):
+        with self._lock:
+            self.calls += 1
+            self.seconds += time.monotonic() - start
+            if failed:
+                self.errors += 1
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self._session.close()
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'average_seconds': round(self.seconds / self.calls, 4) if self.calls else None,
+            'pages_fetched': self.pages_fetched,
+            'pages_wasted': self.pages_wasted,
+            'rate_limited': self.rate_limited,
+            'retried': self.retried,
+            'limiter': self.limiter.stats() if self.limiter is not None else None,
+        }
@@ -0,0 +1,366 @@
+import struct
+
+"""
+Minimal CBOR (RFC 8949) encoder/decoder for node protocol messages and transactions
+"""
+
+
+class CBORTag:
+    def __init__(self, tag, value):
+        self.tag = tag
+        self.value = value
+
+    def __eq__(self, other):
+        return isinstance(other, CBORTag) and self.tag == other.tag and self.value == other.value
+
+    def __hash__(self):
+        return hash((self.tag, repr(self.value)))
+
+    def __repr__(self):
+        return f'CBORTag({self.tag}, {self.value!r})'
+
+
+class CBORRaw:
+    # Already encoded CBOR, written as is by dumps()
+    def __init__(self, data):
+        self.data = bytes(data)
+
+
+class CBORSimple:
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return isinstance(other, CBORSimple) and self.value == other.value
+
+    def __hash__(self):
+        return hash(('simple', self.value))
+
+
+class CBORDecodeError(ValueError):
+    pass
+
+
+class CBORDecodeEOF(CBORDecodeError):
+    # The buffer ends before the item does, more bytes are needed
+    pass
+
+
+"""
+Encoder
+"""
+
+
+def _head(major, value):
+    if value < 24:
+        return bytes([(major << 5) | value])
+    if value < 0x100:
+        return bytes([(major << 5) | 24, value])
+    if value < 0x10000:
+        return bytes([(major << 5) | 25]) + struct.pack('>H', value)
+    if value < 0x100000000:
+        return bytes([(major << 5) | 26]) + struct.pack('>I', value)
+    return bytes([(major << 5) | 27]) + struct.pack('>Q', value)
+
+
+def _encode(value, out):
+    if value is None:
+        out.append(b'\xf6')
+    elif value is True:
+        out.append(b'\xf5')
+    elif value is False:
+        out.append(b'\xf4')
+    elif isinstance(value, int):
+        if value >= 0:
+            if value < 0x10000000000000000:
+                out.append(_head(0, value))
+            else:
+                out.append(_head(6, 2))
+                _encode(value.to_bytes((value.bit_length() + 7) // 8, 'big'), out)
+        else:
+            n = -1 - value
+            if n < 0x10000000000000000:
+                out.append(_head(1, n))
+            else:
+                out.append(_head(6, 3))
+                _encode(n.to_bytes((n.bit_length() + 7) // 8, 'big'), out)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        out.append(_head(2, len(value)))
+        out.append(bytes(value))
+    elif isinstance(value, str):
+        data = value.encode('utf-8')
+        out.append(_head(3, len(data)))
+        out.append(data)
+    elif isinstance(value, (list, tuple)):
+        out.append(_head(4, len(value)))
+        for item in value:
+            _encode(item, out)
+    elif isinstance(value, dict):
+        out.append(_head(5, len(value)))
+        for key, item in value.items():
+            _encode(key, out)
+            _encode(item, out)
+    elif isinstance(value, CBORTag):
+        out.append(_head(6, value.tag))
+        _encode(value.value, out)
+    elif isinstance(value, CBORRaw):
+        out.append(value.data)
+    elif isinstance(value, CBORSimple):
+        out.append(_head(7, value.value))
+    elif isinstance(value, float):
+        out.append(b'\xfb' + struct.pack('>d', value))
+    else:
+        raise TypeError(f'cbor: cannot encode {type(value).__name__}')
+
+
+def dumps(value):
+    out = []
+    _encode(value, out)
+    return b''.join(out)
+
+
+"""
+Decoder
+"""
+
+
+def _read_head(data, offset):
+    # Return (major, additional info, argument, offset after the head); argument is None for indefinite length
+    if offset >= len(data):
+        raise CBORDecodeEOF('cbor: unexpected end of data')
+    initial = data[offset]
+    major = initial >> 5
+    info = initial & 0x1f
+    offset += 1
+    if info < 24:
+        return major, info, info, offset
+    if info == 31:
+        return major, info, None, offset
+    if info > 27:
+        raise CBORDecodeError(f'cbor: invalid additional information {info}')
+    size = 1 << (info - 24)
+    if offset + size > len(data):
+        raise CBORDecodeEOF('cbor: unexpected end of data')
+    return major, info, int.from_bytes(data[offset:offset + size], 'big'), offset + size
+
+
+def _hashable(value):
+    if isinstance(value, list):
+        return tuple(_hashable(item) for item in value)
+    if isinstance(value, dict):
+        return tuple((key, _hashable(item)) for key, item in value.items())
+    return value
+
+
+def decode_item(data, offset=0):
+    """
+    Decode one item
+    :param data: bytes
+    :param offset: position of the item
+    :return: (value, offset after the item)
+    """
+    major, info, argument, offset = _read_head(data, offset)
+    if major == 0:
+        return argument, offset
+    if major == 1:
+        return -1 - argument, offset
+    if major in (2, 3):
+        if argument is None:
+            chunks = []
+            while True:
+                if offset >= len(data):
+                    raise CBORDecodeEOF('cbor: unexpected end of data')
+                if data[offset] == 0xff:
+                    offset += 1
+                    break
+                chunk, offset = decode_item(data, offset)
+                chunks.append(chunk)
+            return (b''.join(chunks) if major == 2 else ''.join(chunks)), offset
+        end = offset + argument
+        if end > len(data):
+            raise CBORDecodeEOF('cbor: unexpected end of data')
+        value = bytes(data[offset:end])
+        return (value if major == 2 else value.decode('utf-8')), end
+    if major == 4:
+        items = []
+        if argument is None:
+            while True:
+                if offset >= len(data):
+                    raise CBORDecodeEOF('cbor: unexpected end of data')
+                if data[offset] == 0xff:
+                    return items, offset + 1
+                item, offset = decode_item(data, offset)
+                items.append(item)
+        for _ in range(argument):
+            item, offset = decode_item(data, offset)
+            items.append(item)
+        return items, offset
+    if major == 5:
+        items = {}
+        count = 0
+        while argument is None or count < argument:
+            if argument is None:
+                if offset >= len(data):
+                    raise CBORDecodeEOF('cbor: unexpected end of data')
+                if data[offset] == 0xff:
+                    return items, offset + 1
+            key, offset = decode_item(data, offset)
+            item, offset = decode_item(data, offset)
+            items[_hashable(key)] = item
+            count += 1
+        return items, offset
+    if major == 6:
+        value, offset = decode_item(data, offset)
+        if argument == 2:
+            return int.from_bytes(value, 'big'), offset
+        if argument == 3:
+            return -1 - int.from_bytes(value, 'big'), offset
+        if argument == 258:
+            # Sets are plain lists here
+            return value, offset
+        return CBORTag(argument, value), offset
+    # major 7
+    if info == 20:
+        return False, offset
+    if info == 21:
+        return True, offset
+    if info in (22, 23):
+        return None, offset
+    if info == 25:
+        return _half_to_float(argument), offset
+    if info == 26:
+        return struct.unpack('>f', argument.to_bytes(4, 'big'))[0], offset
+    if info == 27:
+        return struct.unpack('>d', argument.to_bytes(8, 'big'))[0], offset
+    if argument is None:
+        raise CBORDecodeError('cbor: unexpected break')
+    return CBORSimple(argument), offset
+
+
+def _half_to_float(half):
+    exponent = (half >> 10) & 0x1f
+    mantissa = half & 0x3ff
+    if exponent == 0:
+        value = mantissa * 2 ** -24
+    elif exponent == 0x1f:
+        value = float('inf') if mantissa == 0 else float('nan')
+    else:
+        value = (mantissa + 1024) * 2 ** (exponent - 25)
+    return -value if half & 0x8000 else value
+
+
+def loads(data):
+    value, offset = decode_item(data, 0)
+    if offset != len(data):
+        raise CBORDecodeError(f'cbor: {len(data) - offset} trailing bytes')
+    return value
+
+
+def read_head(data, offset=0):
+    """
+    Read the head of the item at offset, for callers walking raw CBOR themselves
+    :return: (major type, additional information, argument or None for indefinite length, offset after the head)
+    """
+    return _read_head(data, offset)
+
+
+def skip(data, offset=0):
+    """
+    Find the end of an item without building Python objects for it
+    :param data: bytes
+    :param offset: position of the item
+    :return: offset after the item
+    """
+    # Counts the items left instead of recursing, indefinite-length items go through _skip_nested
+    remaining = 1
+    try:
+        while remaining:
+            remaining -= 1
+            initial = data[offset]
+            major = initial >> 5
+            info = initial & 0x1f
+            if info < 24:
+                argument = info
+                offset += 1
+            elif info < 28:
+                size = 1 << (info - 24)
+                argument = int.from_bytes(data[offset + 1:offset + 1 + size], 'big')
+                offset += 1 + size
+            elif info == 31:
+                offset = _skip_nested(data, offset)
+                continue
+            else:
+                raise CBORDecodeError(f'cbor: invalid additional information {info}')
+            if major == 2 or major == 3:
+                offset += argument
+            elif major == 4:
+                remaining += argument
+            elif major == 5:
+                remaining += 2 * argument
+            elif major == 6:
+                remaining += 1
+    except IndexError:
+        raise CBORDecodeEOF('cbor: unexpected end of data')
+    if offset > len(data):
+        raise CBORDecodeEOF('cbor: unexpected end of data')
+    return offset
+
+
+def _skip_nested(data, offset):
+    # Recursive walk of an item, needed for the break byte ending indefinite-length items
+    major, info, argument, offset = _read_head(data, offset)
+    if major in (0, 1, 7):
+        return offset
+    if major in (2, 3):
+        if argument is None:
+            while True:
+                if offset >= len(data):
+                    raise CBORDecodeEOF('cbor: unexpected end of data')
+                if data[offset] == 0xff:
+                    return offset + 1
+                offset = skip(data, offset)
+        if offset + argument > len(data):
+            raise CBORDecodeEOF('cbor: unexpected end of data')
+        return offset + argument
+    if major == 6:
+        return skip(data, offset)
+    per_entry = 2 if major == 5 else 1
+    if argument is None:
+        while True:
+            if offset >= len(data):
+                raise CBORDecodeEOF('cbor: unexpected end of data')
+            if data[offset] == 0xff:
+                return offset + 1
+            for _ in range(per_entry):
+                offset = skip(data, offset)
+    for _ in range(argument * per_entry):
+        offset = skip(data, offset)
+    return offset
+
+
+def container_spans(data, offset=0):
+    """
+    Byte spans of the entries of the array or map at offset, keeping the original encoding
+    :param data: bytes
+    :param offset: position of the array or map (a leading tag is skipped)
+    :return: (list of (start, end) per array item or per map key and value, offset after the container)
+    """
+    major, info, argument, offset = _read_head(data, offset)
+    while major == 6:
+        major, info, argument, offset = _read_head(data, offset)
+    if major not in (4, 5):
+        raise CBORDecodeError('cbor: expected an array or a map')
+    per_entry = 2 if major == 5 else 1
+    spans = []
+    count = 0
+    while argument is None or count < argument * per_entry:
+        if argument is None:
+            if offset >= len(data):
+                raise CBORDecodeEOF('cbor: unexpected end of data')
+            if data[offset] == 0xff:
+                return spans, offset + 1
+        end = skip(data, offset)
+        spans.append((offset, end))
+        offset = end
+        count += 1
+    return spans, offset
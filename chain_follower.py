@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import time
+
+from ouroboros import *
+from scheduler import *
+from utxo_index import *
+
+"""
+Chain-sync client keeping a UTxOIndex of watched addresses up to date
+"""
+
+logger = logging.getLogger("default")
+
+
+class ChainFollower:
+    """
+    Follows the node's chain block by block on a connection of its own and applies every block and rollback to the
+    index. Addresses watched without being fresh are seeded with a state query at the index point
+    """
+
+    def __init__(self, pool, index, reconnect_after, max_lag, snapshot_interval=0):
+        """
+        :param pool: NodeClientPool, for the chain-sync connection and the seed queries
+        :param index: UTxOIndex
+        :param reconnect_after: seconds to wait after the connection failed
+        :param max_lag: seconds since the follower last reached the tip before it's considered behind
+        :param snapshot_interval: seconds between snapshots of the index, 0 disables them
+        """
+        self.pool = pool
+        self.index = index
+        self.reconnect_after = reconnect_after
+        self.max_lag = max_lag
+        self.snapshot_interval = snapshot_interval
+        self._snapshot_time = time.monotonic()
+        self.snapshots = 0
+        self._task = None
+        self._seed_task = None
+        self._connection = None
+        self._at_tip = False
+        self._reached_tip = None
+        self.errors = 0
+        self.last_error = None
+        self.seeds = 0
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    @property
+    def caught_up(self):
+        """
+        True while the index reflects the node's tip, give or take the block being applied
+        """
+        if self._at_tip:
+            return True
+        return self._reached_tip is not None and time.monotonic() - self._reached_tip < self.max_lag
+
+    def start(self):
+        if self._task is not None:
+            return
+        self.index.open()
+        self._task = asyncio.ensure_future(self._follow_loop())
+
+    async def close(self):
+        for task in (self._seed_task, self._task):
+            if task is not None:
+                await cancel_task(task)
+        self._seed_task = None
+        self._task = None
+        try:
+            await self._write_snapshot()
+        finally:
+            self.index.close()
+
+    async def _follow_loop(self):
+        while True:
+            try:
+                await self._follow()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                self.last_error = str(e)
+                logger.error('chain follower: %s, reconnecting in %s seconds', e, self.reconnect_after)
+            finally:
+                self._at_tip = False
+                self._reached_tip = None
+                if self._connection is not None:
+                    self._connection.close()
+                    self._connection = None
+            await asyncio.sleep(self.reconnect_after)
+
+    async def _follow(self):
+        self._connection = connection = await self.pool.open_connection()
+        points = [[slot, bytes.fromhex(block_hash)] for slot, block_hash, _ in reversed(self.index.points)]
+        found = None
+        if points:
+            found, _ = await connection.find_intersect(points)
+        if found is None:
+            # First start, or the node no longer has our recent blocks: start from its tip, everything is seeded again
+            _, tip = await connection.find_intersect([])
+            found, _ = await connection.find_intersect([tip[0]] if tip[0] else [])
+            if points:
+                logger.warning('chain follower: no intersection with the index, reindexing from the node tip')
+            self.index.reset()
+            if found:
+                self.index.rollback(found[0], found[1].hex())
+        logger.info('chain follower: following from %s', self.index.point)
+
+        while True:
+            direction, content, _ = await connection.request_next()
+            if direction == 'await':
+                # Nothing newer than our last block, the index is at the tip until the node sends one
+                self._at_tip = True
+                self._reached_tip = time.monotonic()
+                direction, content, _ = await connection.receive_next()
+                self._at_tip = False
+            if direction == 'forward':
+                slot, block_no, block_hash, txs = decode_block(content)
+                self.index.apply_block(slot, block_no, block_hash, txs)
+            elif direction == 'backward':
+                point = content
+                self.index.rollback(point[0] if point else None, point[1].hex() if point else None)
+            else:
+                raise NodeProtocolError(f'chain follower: unexpected {direction} while waiting for a block')
+            self._schedule_seed()
+            if self.snapshot_interval > 0 and time.monotonic() - self._snapshot_time >= self.snapshot_interval:
+                await self._write_snapshot()
+
+    async def _write_snapshot(self):
+        if self.index.snapshot_path is None or self.index.point is None:
+            return
+        self._snapshot_time = time.monotonic()
+        # Encoded between two blocks, written to disk off the event loop
+        try:
+            data = self.index.snapshot()
+        except Exception as e:
+            # A snapshot is only a restart shortcut, the follower keeps going without it
+            logger.error('chain follower: encoding snapshot failed: %s', e)
+            return
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, write_snapshot, data, self.index.snapshot_path)
+        except OSError as e:
+            logger.error('chain follower: writing snapshot %s failed: %s', self.index.snapshot_path, e)
+            return
+        self.snapshots += 1
+
+    def watch(self, address, fresh=False):
+        """
+        Index an address from now on, see UTxOIndex.watch
+        """
+        known = address in self.index.addresses
+        watched = self.index.watch(address, fresh)
+        if watched and not known and not fresh and self.running:
+            self._schedule_seed()
+        return watched
+
+    def unwatch(self, address):
+        self.index.unwatch(address)
+
+    def _schedule_seed(self):
+        if self.index.pending() and self.index.point is not None and \
+                (self._seed_task is None or self._seed_task.done()):
+            self._seed_task = asyncio.ensure_future(self._seed())
+
+    async def _seed(self):
+        point, addresses = self.index.begin_seed()
+        if not addresses:
+            return
+        try:
+            utxos = {}
+            for i in range(0, len(addresses), UTXO_QUERY_BATCH):
+                batch = addresses[i:i + UTXO_QUERY_BATCH]
+                utxos.update(await node_query_utxos_batch(batch, [point[0], bytes.fromhex(point[1])]))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Tried again after the next block
+            self.index.finish_seed({})
+            logger.warning('chain follower: seeding %s addresses failed: %s', len(addresses), e)
+            return
+        if self.index.finish_seed(utxos):
+            self.seeds += len(utxos)
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'caught_up': self.caught_up,
+            'errors': self.errors,
+            'last_error': self.last_error,
+            'seeded': self.seeds,
+            'snapshots': self.snapshots,
+            'index': self.index.stats(),
+        }
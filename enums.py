@@ -7,6 +7,15 @@ def tryGetEnv(envname, elset):
 
 
 CARDANO_CLI_PATH = tryGetEnv("CARDANO_CLI_PATH", "cardano-cli")
+# Seconds before a cardano-cli call is killed
+COMMAND_TIMEOUT = int(tryGetEnv("COMMAND_TIMEOUT", "120"))
+
+# Maximum concurrent cardano-cli processes per command class and in total
+SCHEDULER_QUERY_LIMIT = int(tryGetEnv("SCHEDULER_QUERY_LIMIT", "8"))
+SCHEDULER_BUILD_LIMIT = int(tryGetEnv("SCHEDULER_BUILD_LIMIT", "4"))
+SCHEDULER_SUBMIT_LIMIT = int(tryGetEnv("SCHEDULER_SUBMIT_LIMIT", "4"))
+SCHEDULER_LOCAL_LIMIT = int(tryGetEnv("SCHEDULER_LOCAL_LIMIT", "8"))
+SCHEDULER_TOTAL_LIMIT = int(tryGetEnv("SCHEDULER_TOTAL_LIMIT", "16"))
 """
 SET NETWORK
 """
@@ -25,10 +34,85 @@ elif NETWORK == 'testnet':
     api_blockfrost = api_blockfrost_testnet
 
 BLOCKFROST_API_KEY = tryGetEnv("BLOCKFROST_API_KEY", api_blockfrost)
+# Kept-alive connections to Blockfrost and seconds a call may wait on the network
+BLOCKFROST_POOL_SIZE = int(tryGetEnv("BLOCKFROST_POOL_SIZE", "10"))
+BLOCKFROST_TIMEOUT = float(tryGetEnv("BLOCKFROST_TIMEOUT", "30"))
+# Pages of a paged Blockfrost endpoint fetched in parallel once the first page comes back full
+BLOCKFROST_PAGE_WINDOW = int(tryGetEnv("BLOCKFROST_PAGE_WINDOW", "8"))
+# Calls per second and burst allowed by the Blockfrost plan, BLOCKFROST_RATE_LIMIT=0 disables the limiter
+BLOCKFROST_RATE_LIMIT = float(tryGetEnv("BLOCKFROST_RATE_LIMIT", "10"))
+BLOCKFROST_BURST = int(tryGetEnv("BLOCKFROST_BURST", "500"))
+# Seconds a call waits for the limiter before it is dropped as 429
+BLOCKFROST_MAX_WAIT = float(tryGetEnv("BLOCKFROST_MAX_WAIT", "10"))
+# Retries of a call answered 429, and seconds before the first one
+BLOCKFROST_RETRIES = int(tryGetEnv("BLOCKFROST_RETRIES", "3"))
+BLOCKFROST_BACKOFF = float(tryGetEnv("BLOCKFROST_BACKOFF", "1"))
+# Transaction contents cached once this many blocks deep, SQLite file of the cache ('memory' keeps it in memory only)
+TX_CACHE_CONFIRMATIONS = int(tryGetEnv("TX_CACHE_CONFIRMATIONS", "10"))
+TX_CACHE_PATH = tryGetEnv("TX_CACHE_PATH", "tx_cache.sqlite3")
+TX_CACHE_SIZE = int(tryGetEnv("TX_CACHE_SIZE", "10000"))
+# Stake addresses of pointer and enterprise addresses kept from Blockfrost, addresses per batch lookup
+STAKE_ADDRESS_CACHE_SIZE = int(tryGetEnv("STAKE_ADDRESS_CACHE_SIZE", "10000"))
+STAKE_ADDRESS_BATCH_MAX = int(tryGetEnv("STAKE_ADDRESS_BATCH_MAX", "1000"))
 
 # Set CARDANO_NODE_SOCKET_PATH
 SOCKET_PATH = "<NODE SOCKET PATH>"
 
+# Network magic sent in the node-to-client handshake
+NETWORK_MAGIC = 764824073 if NETWORK == 'mainnet' else int(TESTNET_MAGIC)
+# First Shelley slot, used to turn a slot into a time for syncProgress
+SHELLEY_START_SLOT = int(tryGetEnv("SHELLEY_START_SLOT", "4492800" if NETWORK == 'mainnet' else "1598400"))
+
+# 'native' talks to SOCKET_PATH directly for reads, 'cli' always forks cardano-cli
+NODE_CLIENT = tryGetEnv("NODE_CLIENT", "native")
+NODE_POOL_SIZE = int(tryGetEnv("NODE_POOL_SIZE", "4"))
+NODE_CLIENT_TIMEOUT = float(tryGetEnv("NODE_CLIENT_TIMEOUT", "10"))
+# Seconds to fall back to cardano-cli after the socket could not be reached
+NODE_CLIENT_RETRY_AFTER = float(tryGetEnv("NODE_CLIENT_RETRY_AFTER", "30"))
+
+# 'json' reads `cardano-cli query utxo --out-file /dev/stdout`, 'table' scrapes the text table (old cardano-cli)
+UTXO_OUTPUT = tryGetEnv("UTXO_OUTPUT", "json")
+# Addresses per node query or cardano-cli call when querying a whole stake account
+UTXO_QUERY_BATCH = int(tryGetEnv("UTXO_QUERY_BATCH", "100"))
+
+# Seconds between node tip polls, and without a successful poll before the tip is considered unknown
+TIP_POLL_INTERVAL = float(tryGetEnv("TIP_POLL_INTERVAL", "1"))
+TIP_STALE_AFTER = float(tryGetEnv("TIP_STALE_AFTER", "10"))
+# UTxOs cached per (address, tip), UTXO_CACHE_TTL=0 disables the cache
+UTXO_CACHE_TTL = float(tryGetEnv("UTXO_CACHE_TTL", "20"))
+UTXO_CACHE_MAX_ENTRIES = int(tryGetEnv("UTXO_CACHE_MAX_ENTRIES", "10000"))
+UTXO_CACHE_MAX_MB = int(tryGetEnv("UTXO_CACHE_MAX_MB", "64"))
+
+# 'on' follows the chain over the node socket and answers status polls of middle wallets from a UTxO index
+CHAIN_FOLLOWER = tryGetEnv("CHAIN_FOLLOWER", "off")
+# SQLite file of the index, 'memory' keeps it in memory only
+CHAIN_INDEX_PATH = tryGetEnv("CHAIN_INDEX_PATH", "chain_index.sqlite3")
+CHAIN_FOLLOWER_RECONNECT = float(tryGetEnv("CHAIN_FOLLOWER_RECONNECT", "5"))
+# Seconds since the follower last waited at the tip before polls go back to the node
+CHAIN_FOLLOWER_MAX_LAG = float(tryGetEnv("CHAIN_FOLLOWER_MAX_LAG", "60"))
+# Binary snapshot of the index for fast restarts, 'off' disables it
+CHAIN_SNAPSHOT_PATH = tryGetEnv("CHAIN_SNAPSHOT_PATH", "chain_index.snapshot")
+CHAIN_SNAPSHOT_INTERVAL = float(tryGetEnv("CHAIN_SNAPSHOT_INTERVAL", "300"))
+# Counting Bloom filter in front of the watched payment credentials, 0 checks the exact set only
+WATCH_BLOOM_BITS = int(tryGetEnv("WATCH_BLOOM_BITS", "0"))
+WATCH_BLOOM_HASHES = int(tryGetEnv("WATCH_BLOOM_HASHES", "3"))
+
+# Seconds between keepalive comments of an idle /v0/trade/events stream
+TRADE_EVENTS_KEEPALIVE = float(tryGetEnv("TRADE_EVENTS_KEEPALIVE", "15"))
+# Seconds a trade stays on the watchlist after its last /v0/trade/status poll or subscriber
+TRADE_SESSION_TTL = float(tryGetEnv("TRADE_SESSION_TTL", "600"))
+# Least seconds between two mempool snapshots (LocalTxMonitor, native node client), 0 reports confirmed deposits only
+MEMPOOL_POLL_INTERVAL = float(tryGetEnv("MEMPOOL_POLL_INTERVAL", "0"))
+
+# Pre-generated wallets for /v0/createwallet, WALLET_POOL_SIZE=0 generates every wallet on demand
+WALLET_POOL_SIZE = int(tryGetEnv("WALLET_POOL_SIZE", "200"))
+WALLET_POOL_LOW_WATER = int(tryGetEnv("WALLET_POOL_LOW_WATER", "50"))
+WALLET_POOL_REFILL_CONCURRENCY = int(tryGetEnv("WALLET_POOL_REFILL_CONCURRENCY", "2"))
+WALLET_POOL_BATCH = int(tryGetEnv("WALLET_POOL_BATCH", "25"))
+# Worker processes and largest count of POST /v0/createwallet/batch
+WALLET_BATCH_WORKERS = int(tryGetEnv("WALLET_BATCH_WORKERS", str(os.cpu_count() or 2)))
+WALLET_BATCH_MAX = int(tryGetEnv("WALLET_BATCH_MAX", "10000"))
+
 my_env = os.environ.copy()
 my_env["CARDANO_NODE_SOCKET_PATH"] = SOCKET_PATH
 my_env["NETWORK"] = NETWORK
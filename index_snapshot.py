@@ -0,0 +1,269 @@
+import array
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+from utxo import *
+
+"""
+Binary snapshot of the UTxO index: one little-endian column per field, read in place from an mmap through typed
+memoryviews, rows are only decoded when they are iterated
+"""
+
+SNAPSHOT_MAGIC = b'CMWI'
+SNAPSHOT_VERSION = 2
+
+# magic, version, reserved, point slot, point hash, point block number, points, addresses, utxos, assets,
+# blake2b-256 of everything after the header
+_HEADER = struct.Struct('<4sHHq32sqIIII32s')
+
+# Columns, in file order, each padded to 8 bytes:
+#   points:    slot q, block number q, block hash 32 bytes
+#   addresses: since q, raw address offsets I (count + 1) and bytes, bech32 offsets I (count + 1) and bytes
+#   utxos:     tx hash 32 bytes, index I, lovelace Q, address number I, slot created q, slot spent q,
+#              datum hash flag B, datum hash 32 bytes, first asset I, asset count I
+#   assets:    policy id 28 bytes, name offsets I (count + 1) and bytes, quantity Q
+_ALIGNMENT = 8
+
+# Stands for None in slot fields
+_NO_SLOT = -2 ** 63
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def _column(code, values):
+    column = array.array(code, values)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column.tobytes()
+
+
+def _blob(items):
+    # Variable length items as an offsets column and their concatenated bytes
+    offsets = [0]
+    for item in items:
+        offsets.append(offsets[-1] + len(item))
+    return [_column('I', offsets), b''.join(items)]
+
+
+def encode_snapshot(points, addresses, utxos):
+    """
+    :param points: [(slot, block hash hex, block number or None)], oldest first
+    :param addresses: [(address, address bytes, slot complete from or None)]
+    :param utxos: [(address, UTxO, slot created, slot spent or None)]
+    :return: bytes
+    """
+    numbers = {address: number for number, (address, _, _) in enumerate(addresses)}
+    asset_units = []
+    asset_first = []
+    for _, utxo, _, _ in utxos:
+        asset_first.append(len(asset_units))
+        asset_units.extend(utxo.assets.items())
+    policies = []
+    names = []
+    for unit, _ in asset_units:
+        policy_id, _, name = unit.partition('.')
+        policies.append(bytes.fromhex(policy_id))
+        names.append(bytes.fromhex(name))
+    columns = [
+        _column('q', [slot for slot, _, _ in points]),
+        _column('q', [_NO_SLOT if block_no is None else block_no for _, _, block_no in points]),
+        b''.join(bytes.fromhex(block_hash) for _, block_hash, _ in points),
+        _column('q', [_NO_SLOT if since is None else since for _, _, since in addresses]),
+        *_blob([address_bytes for _, address_bytes, _ in addresses]),
+        *_blob([address.encode() for address, _, _ in addresses]),
+        b''.join(bytes.fromhex(utxo.tx_hash) for _, utxo, _, _ in utxos),
+        _column('I', [utxo.index for _, utxo, _, _ in utxos]),
+        _column('Q', [utxo.lovelace for _, utxo, _, _ in utxos]),
+        _column('I', [numbers[address] for address, _, _, _ in utxos]),
+        _column('q', [created for _, _, created, _ in utxos]),
+        _column('q', [_NO_SLOT if spent is None else spent for _, _, _, spent in utxos]),
+        bytes(1 if utxo.datum_hash else 0 for _, utxo, _, _ in utxos),
+        b''.join(bytes.fromhex(utxo.datum_hash) if utxo.datum_hash else bytes(32) for _, utxo, _, _ in utxos),
+        _column('I', asset_first),
+        _column('I', [len(utxo.assets) for _, utxo, _, _ in utxos]),
+        b''.join(policies),
+        *_blob(names),
+        _column('Q', [quantity for _, quantity in asset_units]),
+    ]
+    body = b''.join(column + bytes(-len(column) % _ALIGNMENT) for column in columns)
+    last = points[-1] if points else None
+    header = _HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0,
+                          last[0] if last else _NO_SLOT, bytes.fromhex(last[1]) if last else bytes(32),
+                          last[2] if last and last[2] is not None else _NO_SLOT,
+                          len(points), len(addresses), len(utxos), len(asset_units),
+                          hashlib.blake2b(body, digest_size=32).digest())
+    return header + body
+
+
+def write_snapshot(data, path):
+    """
+    Replace the snapshot file atomically, a crash leaves either the old or the new file
+    """
+    # A file of its own per write, a write cancelled at shutdown may still be running in its thread
+    descriptor, temporary_path = tempfile.mkstemp(prefix=os.path.basename(path), suffix='.tmp',
+                                                  dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+
+def read_snapshot(path):
+    """
+    Map a snapshot file and check it
+    :return: Snapshot, to be closed by the caller, None when the file is missing
+    :raise SnapshotError: unknown version, truncated or corrupt file
+    """
+    try:
+        file = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    try:
+        size = os.fstat(file.fileno()).st_size
+        if size < _HEADER.size:
+            raise SnapshotError(f'read_snapshot: {path} is truncated')
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except BaseException:
+        file.close()
+        raise
+    snapshot = Snapshot(file, mapped)
+    try:
+        snapshot._map_columns(path)
+    except BaseException:
+        snapshot.close()
+        raise
+    return snapshot
+
+
+class Snapshot:
+    """
+    Columns of a mapped snapshot file. Nothing is copied out of the map up front, addresses() and utxos() decode
+    rows as they are iterated
+    """
+
+    def __init__(self, file, mapped):
+        self._file = file
+        self._mapped = mapped
+        self._view = memoryview(mapped)
+        # Every view of the map, released before it is closed
+        self._views = [self._view]
+        self.points = []
+        self.address_count = 0
+        self.utxo_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def _take(self, offset, size, code=None):
+        # View of the column at offset and the offset of the next one
+        if offset + size > len(self._view):
+            raise SnapshotError('read_snapshot: truncated column')
+        column = self._view[offset:offset + size]
+        self._views.append(column)
+        if code is not None:
+            if sys.byteorder == 'big':
+                column = array.array(code, column.tobytes())
+                column.byteswap()
+            else:
+                column = column.cast(code)
+                self._views.append(column)
+        return column, offset + size + (-size % _ALIGNMENT)
+
+    def _take_blob(self, offset, count):
+        offsets, offset = self._take(offset, 4 * (count + 1), 'I')
+        blob, offset = self._take(offset, offsets[count])
+        return offsets, blob, offset
+
+    def _map_columns(self, path):
+        magic, version, _, _, _, _, n_points, n_addresses, n_utxos, n_assets, checksum = \
+            _HEADER.unpack_from(self._view)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise SnapshotError(f'read_snapshot: {path} is not a version {SNAPSHOT_VERSION} snapshot')
+        offset = _HEADER.size
+        slots, offset = self._take(offset, 8 * n_points, 'q')
+        block_numbers, offset = self._take(offset, 8 * n_points, 'q')
+        block_hashes, offset = self._take(offset, 32 * n_points)
+        self._since, offset = self._take(offset, 8 * n_addresses, 'q')
+        self._raw_offsets, self._raw, offset = self._take_blob(offset, n_addresses)
+        self._text_offsets, self._text, offset = self._take_blob(offset, n_addresses)
+        self._tx_hashes, offset = self._take(offset, 32 * n_utxos)
+        self._indexes, offset = self._take(offset, 4 * n_utxos, 'I')
+        self._lovelace, offset = self._take(offset, 8 * n_utxos, 'Q')
+        self._owners, offset = self._take(offset, 4 * n_utxos, 'I')
+        self._created, offset = self._take(offset, 8 * n_utxos, 'q')
+        self._spent, offset = self._take(offset, 8 * n_utxos, 'q')
+        self._has_datum, offset = self._take(offset, n_utxos)
+        self._datum_hashes, offset = self._take(offset, 32 * n_utxos)
+        self._asset_first, offset = self._take(offset, 4 * n_utxos, 'I')
+        self._asset_counts, offset = self._take(offset, 4 * n_utxos, 'I')
+        self._policies, offset = self._take(offset, 28 * n_assets)
+        self._name_offsets, self._names, offset = self._take_blob(offset, n_assets)
+        self._quantities, offset = self._take(offset, 8 * n_assets, 'Q')
+        if offset != len(self._view):
+            raise SnapshotError(f'read_snapshot: {path} has the wrong size')
+        body = self._view[_HEADER.size:]
+        self._views.append(body)
+        if hashlib.blake2b(body, digest_size=32).digest() != checksum:
+            raise SnapshotError(f'read_snapshot: {path} is corrupt')
+        self.points = [(slot, block_hashes[32 * i:32 * i + 32].hex(), None if block_no == _NO_SLOT else block_no)
+                       for i, (slot, block_no) in enumerate(zip(slots, block_numbers))]
+        self.address_count = n_addresses
+        self.utxo_count = n_utxos
+        if n_addresses and max(self._owners) >= n_addresses:
+            raise SnapshotError(f'read_snapshot: {path} has utxos of unknown addresses')
+        if n_utxos and max(a + c for a, c in zip(self._asset_first, self._asset_counts)) > n_assets:
+            raise SnapshotError(f'read_snapshot: {path} has utxos of unknown assets')
+
+    def addresses(self):
+        """
+        :return: iterator of (address, address bytes, since) as encode_snapshot takes them
+        """
+        raw, raw_offsets, text, text_offsets = self._raw, self._raw_offsets, self._text, self._text_offsets
+        for i, since in enumerate(self._since):
+            yield (str(text[text_offsets[i]:text_offsets[i + 1]], 'ascii'),
+                   bytes(raw[raw_offsets[i]:raw_offsets[i + 1]]), None if since == _NO_SLOT else since)
+
+    def _address_names(self):
+        text, offsets = self._text, self._text_offsets
+        return [str(text[offsets[i]:offsets[i + 1]], 'ascii') for i in range(self.address_count)]
+
+    def utxos(self):
+        """
+        :return: iterator of (address, UTxO, slot created, slot spent or None) as encode_snapshot takes them
+        """
+        addresses = self._address_names()
+        tx_hashes = self._tx_hashes.hex()
+        datum_hashes = self._datum_hashes
+        policies, names, name_offsets, quantities = (self._policies.hex(), self._names.hex(), self._name_offsets,
+                                                     self._quantities)
+        for i, (index, lovelace, owner, created, spent, has_datum, first, count) in enumerate(zip(
+                self._indexes, self._lovelace, self._owners, self._created, self._spent, self._has_datum,
+                self._asset_first, self._asset_counts)):
+            assets = {asset_unit(policies[56 * j:56 * j + 56], names[2 * name_offsets[j]:2 * name_offsets[j + 1]]):
+                      quantities[j] for j in range(first, first + count)} if count else {}
+            utxo = UTxO(tx_hashes[64 * i:64 * i + 64], index, lovelace, assets,
+                        datum_hashes[32 * i:32 * i + 32].hex() if has_datum else None)
+            yield addresses[owner], utxo, created, None if spent == _NO_SLOT else spent
+
+    def close(self):
+        # The map can't be closed while views of it are alive
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._mapped.close()
+        self._file.close()
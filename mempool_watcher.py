@@ -0,0 +1,227 @@
+import asyncio
+import collections
+import logging
+
+from address import *
+from ouroboros import *
+from scheduler import *
+from watch_set import *
+
+"""
+Transactions waiting in the node's mempool that pay watched addresses
+"""
+
+logger = logging.getLogger("default")
+
+# Senders kept for transactions that left the mempool, settlement checks look them up after the block
+SENDER_CACHE_SIZE = 10000
+
+
+class MempoolWatcher:
+    """
+    Follows the node's mempool through LocalTxMonitor on a connection of its own. Outputs paying a watched address
+    are kept as pending until a block takes them, and the sender of their transaction is resolved against the node
+    right away, before anyone asks Blockfrost about it
+    """
+
+    def __init__(self, pool, interval, reconnect_after):
+        """
+        :param pool: NodeClientPool, for the monitor connection and the sender queries
+        :param interval: least seconds between two mempool snapshots, 0 disables the watcher
+        :param reconnect_after: seconds to wait after the connection failed
+        """
+        self.pool = pool
+        self.interval = interval
+        self.reconnect_after = reconnect_after
+        self.watch_set = WatchSet()
+        # address bytes -> [address, count of watchers]
+        self._addresses = {}
+        # tx id -> (first input or None, [(address, UTxO)] of its watched outputs), for the last snapshot
+        self._txs = {}
+        # address -> list of UTxO waiting for a block
+        self._pending = {}
+        # tx id -> sender address
+        self._senders = collections.OrderedDict()
+        self._listeners = []
+        self._task = None
+        self._connection = None
+        # Bumped each time the pending outputs change
+        self.version = 0
+        self.slot = None
+        self.snapshots = 0
+        self.errors = 0
+        self.last_error = None
+
+    def add_listener(self, callback):
+        # callback(addresses) runs in the event loop each time pending outputs of some addresses change
+        self._listeners.append(callback)
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    def start(self):
+        if self.interval <= 0 or self._task is not None:
+            return
+        self._task = asyncio.ensure_future(self._monitor_loop())
+
+    async def close(self):
+        if self._task is not None:
+            await cancel_task(self._task)
+            self._task = None
+
+    def watch(self, address):
+        """
+        Report pending outputs of an address from the next snapshot on
+        :return: False for addresses the watcher can't match (Byron)
+        """
+        try:
+            address_bytes = address_to_bytes(address)
+        except NodeClientError:
+            return False
+        entry = self._addresses.get(address_bytes)
+        if entry is not None:
+            entry[1] += 1
+            return True
+        if not self.watch_set.add(address_bytes):
+            return False
+        self._addresses[address_bytes] = [address, 1]
+        # Transactions already seen were only matched against the addresses watched then
+        self._txs = {}
+        return True
+
+    def unwatch(self, address):
+        try:
+            address_bytes = address_to_bytes(address)
+        except NodeClientError:
+            return
+        entry = self._addresses.get(address_bytes)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] > 0:
+            return
+        del self._addresses[address_bytes]
+        self.watch_set.discard(address_bytes)
+        if self._pending.pop(address, None) is not None:
+            self.version += 1
+
+    def pending(self, address):
+        """
+        :return: list of UTxO paying address in transactions of the mempool, empty when there are none or the watcher
+                 isn't running
+        """
+        return list(self._pending.get(address, []))
+
+    def sender(self, tx_id):
+        """
+        :return: address of the first input of a transaction seen in the mempool, None when unknown
+        """
+        return self._senders.get(tx_id)
+
+    async def _monitor_loop(self):
+        while True:
+            try:
+                await self._monitor()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                self.last_error = str(e)
+                logger.error('mempool watcher: %s, reconnecting in %s seconds', e, self.reconnect_after)
+            finally:
+                if self._connection is not None:
+                    self._connection.close()
+                    self._connection = None
+            # Nothing is known to be pending while the mempool can't be seen
+            self._txs = {}
+            self._update({})
+            await asyncio.sleep(self.reconnect_after)
+
+    async def _monitor(self):
+        self._connection = connection = await self.pool.open_connection()
+        while True:
+            # Returns at once the first time, then as soon as the mempool differs from the snapshot held
+            self.slot = await connection.monitor_acquire()
+            txs = []
+            while True:
+                tx = await connection.monitor_next_tx()
+                if tx is None:
+                    break
+                txs.append(tx)
+            self.snapshots += 1
+            await self._apply(txs)
+            await asyncio.sleep(self.interval)
+
+    async def _apply(self, txs):
+        known = self._txs
+        current = {}
+        for tx in txs:
+            tx_id, body, valid = decode_tx(tx)
+            if tx_id in known:
+                current[tx_id] = known[tx_id]
+                continue
+            paid = []
+            inputs = []
+            if len(self.watch_set):
+                inputs, outputs = scan_tx(body, valid, self.watch_set)
+                for index, tx_out, address_bytes in outputs:
+                    entry = self._addresses.get(bytes(address_bytes))
+                    if entry is None:
+                        # Same payment credential, another stake part
+                        continue
+                    _, lovelace, assets, datum_hash, _ = decode_tx_out(tx_out)
+                    units = {asset_unit(policy, name): quantity for (policy, name), quantity in assets.items()}
+                    paid.append((entry[0], UTxO(tx_id, index, lovelace, units, datum_hash)))
+            current[tx_id] = (inputs[0] if inputs else None, paid)
+        self._txs = current
+        await self._resolve_senders()
+        pending = {}
+        for _, paid in current.values():
+            for address, utxo in paid:
+                pending.setdefault(address, []).append(utxo)
+        self._update(pending)
+
+    async def _resolve_senders(self):
+        # The input a sender spent is still unspent on the ledger while its transaction waits in the mempool
+        txins = {first_input: tx_id for tx_id, (first_input, paid) in self._txs.items()
+                 if paid and first_input is not None and tx_id not in self._senders}
+        if not txins:
+            return
+        try:
+            tx_outs = await node_query_tx_outs(list(txins))
+        except NodeClientError as e:
+            logger.warning('mempool watcher: resolving %s senders failed: %s', len(txins), e)
+            return
+        for txin, tx_out in tx_outs.items():
+            address = address_from_bytes(tx_out[0])
+            if address is not None:
+                self._senders[txins[txin]] = address
+        while len(self._senders) > SENDER_CACHE_SIZE:
+            self._senders.popitem(last=False)
+
+    def _update(self, pending):
+        if pending == self._pending:
+            return
+        changed = {address for address in set(pending) | set(self._pending)
+                   if pending.get(address) != self._pending.get(address)}
+        self._pending = pending
+        self.version += 1
+        for callback in self._listeners:
+            try:
+                callback(changed)
+            except Exception as e:
+                logger.error('mempool watcher: listener failed: %s', e)
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'slot': self.slot,
+            'snapshots': self.snapshots,
+            'watched': len(self._addresses),
+            'transactions': len(self._txs),
+            'pending_outputs': sum(len(utxos) for utxos in self._pending.values()),
+            'senders': len(self._senders),
+            'errors': self.errors,
+            'last_error': self.last_error,
+        }
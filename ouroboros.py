@@ -0,0 +1,785 @@
+import asyncio
+import hashlib
+import logging
+import struct
+import time
+from datetime import datetime, timezone
+
+import bech32
+import cbor
+from cbor import CBORTag
+from enums import *
+from utxo import *
+
+"""
+Node-to-client mini-protocols over the node socket
+"""
+
+logger = logging.getLogger("default")
+
+PROTOCOL_HANDSHAKE = 0
+PROTOCOL_CHAIN_SYNC = 5
+PROTOCOL_TX_SUBMISSION = 6
+PROTOCOL_STATE_QUERY = 7
+PROTOCOL_TX_MONITOR = 9
+
+# First node-to-client version speaking LocalTxMonitor
+TX_MONITOR_MIN_VERSION = 12
+
+# Largest payload of one multiplexer segment
+MAX_SEGMENT_SIZE = 12288
+
+# Node-to-client versions are sent with bit 15 set
+NODE_TO_CLIENT_VERSION_BIT = 0x8000
+NODE_TO_CLIENT_VERSIONS = range(9, 17)
+
+ERA_NAMES = ['Byron', 'Shelley', 'Allegra', 'Mary', 'Alonzo', 'Babbage', 'Conway']
+
+QUERY_SYSTEM_START = [1]
+QUERY_CHAIN_BLOCK_NO = [2]
+QUERY_CHAIN_POINT = [3]
+QUERY_CURRENT_ERA = [0, [2, [1]]]
+
+SHELLEY_QUERY_EPOCH_NO = [1]
+SHELLEY_QUERY_CURRENT_PPARAMS = [3]
+
+
+def query_if_current(era, query):
+    # Wrap an era specific query for the hard fork combinator
+    return [0, [0, [era, query]]]
+
+
+def shelley_query_utxo_by_address(address_bytes_list):
+    return [6, list(address_bytes_list)]
+
+
+def shelley_query_utxo_by_txin(txins):
+    # txins as [tx hash bytes, index]
+    return [15, list(txins)]
+
+
+class NodeClientError(Exception):
+    pass
+
+
+class NodeProtocolError(NodeClientError):
+    pass
+
+
+class TxSubmitRejected(ValueError):
+    # The node refused the transaction, reason is the decoded ApplyTxErr in JSON friendly form
+    def __init__(self, era, reason):
+        super().__init__(f'transaction rejected by the node: {json_friendly(reason)}')
+        self.era = era
+        self.reason = json_friendly(reason)
+
+
+def json_friendly(value):
+    """
+    Make a decoded CBOR value serializable with json.dumps: bytes become hex, tags become {'tag', 'value'}
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value).hex()
+    if isinstance(value, (list, tuple)):
+        return [json_friendly(item) for item in value]
+    if isinstance(value, dict):
+        return [[json_friendly(key), json_friendly(item)] for key, item in value.items()]
+    if isinstance(value, CBORTag):
+        return {'tag': value.tag, 'value': json_friendly(value.value)}
+    if isinstance(value, cbor.CBORSimple):
+        return {'simple': value.value}
+    return value
+
+
+"""
+Multiplexer
+"""
+
+
+def encode_segments(protocol, payload, responder=False):
+    """
+    Split one mini-protocol message into multiplexer segments
+    :param protocol: mini-protocol number
+    :param payload: CBOR encoded message
+    :param responder: True when sent by the node side
+    :return: bytes ready to be written to the socket
+    """
+    mode = NODE_TO_CLIENT_VERSION_BIT if responder else 0
+    timestamp = int(time.monotonic() * 1000000) & 0xffffffff
+    segments = []
+    for start in range(0, max(len(payload), 1), MAX_SEGMENT_SIZE):
+        chunk = payload[start:start + MAX_SEGMENT_SIZE]
+        segments.append(struct.pack('>IHH', timestamp, mode | protocol, len(chunk)) + chunk)
+    return b''.join(segments)
+
+
+class MuxConnection:
+    """
+    One bearer carrying CBOR messages of several mini-protocols
+    """
+
+    def __init__(self, reader, writer, responder=False):
+        self.reader = reader
+        self.writer = writer
+        self.responder = responder
+        self._buffers = {}
+
+    async def send(self, protocol, message):
+        self.writer.write(encode_segments(protocol, cbor.dumps(message), self.responder))
+        await self.writer.drain()
+
+    async def _read_segment(self):
+        header = await self.reader.readexactly(8)
+        _, protocol_word, length = struct.unpack('>IHH', header)
+        payload = await self.reader.readexactly(length)
+        return protocol_word & 0x7fff, payload
+
+    def _pop_message(self, protocol):
+        buffer = self._buffers.get(protocol)
+        if not buffer:
+            return None
+        try:
+            message, end = cbor.decode_item(buffer, 0)
+        except cbor.CBORDecodeEOF:
+            return None
+        del buffer[:end]
+        return message
+
+    async def receive(self, protocol):
+        """
+        Next complete message of a mini-protocol, reassembled across segments
+        """
+        while True:
+            message = self._pop_message(protocol)
+            if message is not None:
+                return message
+            segment_protocol, payload = await self._read_segment()
+            self._buffers.setdefault(segment_protocol, bytearray()).extend(payload)
+
+    async def receive_any(self):
+        """
+        Next complete message of whichever mini-protocol finishes one first
+        :return: (protocol, message)
+        """
+        while True:
+            for protocol in list(self._buffers):
+                message = self._pop_message(protocol)
+                if message is not None:
+                    return protocol, message
+            segment_protocol, payload = await self._read_segment()
+            self._buffers.setdefault(segment_protocol, bytearray()).extend(payload)
+
+    def close(self):
+        self.writer.close()
+
+
+def version_params(version, magic):
+    if version >= 15:
+        return [magic, False]
+    return magic
+
+
+class NodeConnection(MuxConnection):
+    """
+    Client side of one node socket connection
+    """
+
+    def __init__(self, reader, writer):
+        super().__init__(reader, writer, responder=False)
+        self.version = None
+
+    async def handshake(self, magic):
+        versions = {NODE_TO_CLIENT_VERSION_BIT | v: version_params(v, magic) for v in NODE_TO_CLIENT_VERSIONS}
+        await self.send(PROTOCOL_HANDSHAKE, [0, versions])
+        reply = await self.receive(PROTOCOL_HANDSHAKE)
+        if reply[0] != 1:
+            raise NodeProtocolError(f'handshake refused: {reply}')
+        self.version = reply[1] & ~NODE_TO_CLIENT_VERSION_BIT
+        return self.version
+
+    """
+    LocalStateQuery
+    """
+
+    async def acquire(self, point=None):
+        # Acquire the volatile tip unless a point [slot, hash] is given
+        await self.send(PROTOCOL_STATE_QUERY, [8] if point is None else [0, point])
+        reply = await self.receive(PROTOCOL_STATE_QUERY)
+        if reply[0] != 1:
+            raise NodeProtocolError(f'acquire failed: {reply}')
+
+    async def query(self, query):
+        await self.send(PROTOCOL_STATE_QUERY, [3, query])
+        reply = await self.receive(PROTOCOL_STATE_QUERY)
+        if reply[0] != 4:
+            raise NodeProtocolError(f'unexpected reply to query: {reply}')
+        return reply[1]
+
+    async def query_current(self, era, query):
+        result = await self.query(query_if_current(era, query))
+        if not isinstance(result, list) or len(result) != 1:
+            raise NodeProtocolError(f'era mismatch: {result}')
+        return result[0]
+
+    async def release(self):
+        await self.send(PROTOCOL_STATE_QUERY, [5])
+
+    """
+    LocalTxSubmission
+    """
+
+    async def submit_tx(self, era, tx):
+        """
+        Submit a signed transaction
+        :param era: era index the transaction is serialised in
+        :param tx: signed transaction CBOR bytes
+        :return: None when accepted, raise TxSubmitRejected otherwise
+        """
+        await self.send(PROTOCOL_TX_SUBMISSION, [0, [era, CBORTag(24, tx)]])
+        reply = await self.receive(PROTOCOL_TX_SUBMISSION)
+        if reply[0] == 1:
+            return None
+        if reply[0] == 2:
+            raise TxSubmitRejected(era, reply[1])
+        raise NodeProtocolError(f'unexpected reply to submit: {reply}')
+
+    """
+    LocalTxMonitor
+    """
+
+    async def monitor_acquire(self):
+        """
+        Acquire a snapshot of the mempool. Once one is held, this waits until the mempool differs from it
+        :return: slot the snapshot was taken at
+        """
+        if self.version < TX_MONITOR_MIN_VERSION:
+            raise NodeClientError(f'node-to-client version {self.version} has no LocalTxMonitor')
+        await self.send(PROTOCOL_TX_MONITOR, [1])
+        reply = await self.receive(PROTOCOL_TX_MONITOR)
+        if reply[0] != 2:
+            raise NodeProtocolError(f'unexpected reply to acquire: {reply}')
+        return reply[1]
+
+    async def monitor_next_tx(self):
+        """
+        :return: next transaction of the snapshot as signed CBOR bytes, None after the last one
+        """
+        await self.send(PROTOCOL_TX_MONITOR, [5])
+        reply = await self.receive(PROTOCOL_TX_MONITOR)
+        if reply[0] != 6:
+            raise NodeProtocolError(f'unexpected reply to next tx: {reply}')
+        if len(reply) < 2:
+            return None
+        _, tx = reply[1]
+        return tx.value if isinstance(tx, CBORTag) else tx
+
+    async def monitor_release(self):
+        await self.send(PROTOCOL_TX_MONITOR, [3])
+
+    """
+    ChainSync
+    """
+
+    async def find_intersect(self, points):
+        """
+        Move the chain-sync cursor to the most recent of the points the node has on its chain
+        :param points: list of [slot, block hash bytes], newest first, an empty list only asks for the tip
+        :return: (point found or None, node tip [point, block number])
+        """
+        await self.send(PROTOCOL_CHAIN_SYNC, [4, points])
+        reply = await self.receive(PROTOCOL_CHAIN_SYNC)
+        if reply[0] == 5:
+            return reply[1], reply[2]
+        if reply[0] == 6:
+            return None, reply[1]
+        raise NodeProtocolError(f'unexpected reply to find intersect: {reply}')
+
+    async def request_next(self):
+        """
+        Ask for the chain update after the cursor
+        :return: ('forward', block, tip), ('backward', point, tip), or ('await', None, None) when the cursor is at
+                 the tip, receive_next() then waits for the next block
+        """
+        await self.send(PROTOCOL_CHAIN_SYNC, [0])
+        return await self.receive_next()
+
+    async def receive_next(self):
+        reply = await self.receive(PROTOCOL_CHAIN_SYNC)
+        if reply[0] == 1:
+            return 'await', None, None
+        if reply[0] == 2:
+            return 'forward', reply[1], reply[2]
+        if reply[0] == 3:
+            return 'backward', reply[1], reply[2]
+        raise NodeProtocolError(f'unexpected chain-sync message: {reply}')
+
+
+class NodeClientPool:
+    """
+    Persistent, handshaken node socket connections shared by all requests
+    """
+
+    def __init__(self, socket_path, magic, size, timeout, retry_after):
+        self.socket_path = socket_path
+        self.magic = magic
+        self.size = size
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._idle = []
+        self._semaphore = None
+        self._down_until = 0
+        self.connects = 0
+        self.reuses = 0
+        self.errors = 0
+
+    async def _connect(self):
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_unix_connection(self.socket_path), self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise NodeClientError(f'cannot connect to {self.socket_path}: {e}')
+        connection = NodeConnection(reader, writer)
+        try:
+            await asyncio.wait_for(connection.handshake(self.magic), self.timeout)
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, cbor.CBORDecodeError) as e:
+            connection.close()
+            raise NodeClientError(f'handshake with {self.socket_path} failed: {e!r}')
+        except BaseException:
+            connection.close()
+            raise
+        self.connects += 1
+        return connection
+
+    def connection(self):
+        return _PooledConnection(self)
+
+    async def open_connection(self):
+        # A connection of its own for a long running mini-protocol (chain-sync), the caller closes it
+        return await self._connect()
+
+    async def run(self, func):
+        """
+        Run func(connection) on a pooled connection within the pool timeout
+        :param func: coroutine function taking a NodeConnection
+        :return: result of func
+        """
+        async with self.connection() as connection:
+            return await asyncio.wait_for(func(connection), self.timeout)
+
+    def close(self):
+        while self._idle:
+            self._idle.pop().close()
+
+    def stats(self):
+        return {'size': self.size, 'idle': len(self._idle), 'connects': self.connects,
+                'reuses': self.reuses, 'errors': self.errors,
+                'available': time.monotonic() >= self._down_until}
+
+
+class _PooledConnection:
+    def __init__(self, pool):
+        self._pool = pool
+        self._connection = None
+
+    async def __aenter__(self):
+        pool = self._pool
+        if time.monotonic() < pool._down_until:
+            raise NodeClientError('node socket unavailable, using cardano-cli until retry')
+        if pool._semaphore is None:
+            pool._semaphore = asyncio.Semaphore(pool.size)
+        await pool._semaphore.acquire()
+        try:
+            if pool._idle:
+                self._connection = pool._idle.pop()
+                pool.reuses += 1
+            else:
+                self._connection = await pool._connect()
+        except BaseException as e:
+            pool._semaphore.release()
+            if isinstance(e, NodeClientError):
+                pool.errors += 1
+                pool._down_until = time.monotonic() + pool.retry_after
+            raise
+        return self._connection
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pool = self._pool
+        pool._semaphore.release()
+        if exc_type is None:
+            pool._idle.append(self._connection)
+            return False
+        if isinstance(exc, TxSubmitRejected):
+            # A rejection completes the exchange, the connection stays usable
+            pool._idle.append(self._connection)
+            return False
+        # A connection in an unknown protocol state is never reused
+        self._connection.close()
+        pool.errors += 1
+        if isinstance(exc, (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, cbor.CBORDecodeError)):
+            raise NodeClientError(f'node connection failed: {exc!r}') from exc
+        return False
+
+
+node_pool = NodeClientPool(SOCKET_PATH, NETWORK_MAGIC, NODE_POOL_SIZE, NODE_CLIENT_TIMEOUT, NODE_CLIENT_RETRY_AFTER)
+
+
+"""
+Ledger state queries in cardano-cli output shapes
+"""
+
+
+def address_to_bytes(address):
+    try:
+        return bech32.decode(address)[1]
+    except bech32.Bech32Error as e:
+        # Byron addresses are base58, cardano-cli handles them
+        raise NodeClientError(f'unsupported address {address}: {e}')
+
+
+def decode_value(value):
+    # Return (lovelace, {(policy hex, asset name hex): quantity})
+    if isinstance(value, int):
+        return value, {}
+    lovelace, multi_asset = value
+    assets = {}
+    for policy, names in multi_asset.items():
+        for name, quantity in names.items():
+            assets[(policy.hex(), name.hex())] = quantity
+    return lovelace, assets
+
+
+def decode_tx_out(tx_out):
+    """
+    Decode a legacy (array) or post-Alonzo (map) transaction output
+    :return: (address bytes, lovelace, assets, datum hash hex or None, inline datum CBOR hex or None)
+    """
+    datum_hash = None
+    inline_datum = None
+    if isinstance(tx_out, dict):
+        address = tx_out[0]
+        lovelace, assets = decode_value(tx_out[1])
+        datum = tx_out.get(2)
+        if datum is not None:
+            if datum[0] == 0:
+                datum_hash = datum[1].hex()
+            else:
+                inline = datum[1].value if isinstance(datum[1], CBORTag) else datum[1]
+                inline_datum = inline.hex()
+    else:
+        address = tx_out[0]
+        lovelace, assets = decode_value(tx_out[1])
+        if len(tx_out) > 2 and tx_out[2] is not None:
+            datum_hash = tx_out[2].hex()
+    return address, lovelace, assets, datum_hash, inline_datum
+
+
+def utxos_from_map(utxo_map):
+    """
+    Turn a UTxO map into UTxO tuples, in the order `cardano-cli query utxo` lists them
+    :param utxo_map: {(tx hash bytes, index): tx_out}
+    :return: list of UTxO
+    """
+    utxos = []
+    for (tx_hash, index), tx_out in sorted(utxo_map.items(), key=lambda item: (item[0][0], item[0][1])):
+        _, lovelace, assets, datum_hash, _ = decode_tx_out(tx_out)
+        units = {asset_unit(policy, name): quantity for (policy, name), quantity in assets.items()}
+        utxos.append(UTxO(tx_hash.hex(), index, lovelace, units, datum_hash))
+    return utxos
+
+
+def utxos_by_address_from_map(utxo_map, addresses):
+    """
+    Split a UTxO map queried for several addresses back per address
+    :param utxo_map: {(tx hash bytes, index): tx_out}
+    :param addresses: {address bytes: address as the caller wrote it}
+    :return: {address: list of UTxO}, an empty list for addresses without utxos
+    """
+    tx_outs = {address: {} for address in addresses}
+    for txin, tx_out in utxo_map.items():
+        # The address is item 0 of both legacy (array) and post-Alonzo (map) outputs
+        tx_outs[tx_out[0]][txin] = tx_out
+    return {addresses[address_bytes]: utxos_from_map(address_map) for address_bytes, address_map in tx_outs.items()}
+
+
+async def node_query_utxos(address):
+    # Description: UTxOs of one address through LocalStateQuery
+    return (await node_query_utxos_batch([address]))[address]
+
+
+async def node_query_utxos_batch(addresses, point=None):
+    # Description: UTxOs of several addresses in one LocalStateQuery round trip, as {address: list of UTxO}
+    #               At the tip, or at point [slot, block hash bytes] which must be one of the last k blocks
+    address_bytes = {address_to_bytes(address): address for address in addresses}
+
+    async def run(connection):
+        await connection.acquire(point)
+        era = await connection.query(QUERY_CURRENT_ERA)
+        result = await connection.query_current(era, shelley_query_utxo_by_address(address_bytes))
+        await connection.release()
+        return result
+
+    return utxos_by_address_from_map(await node_pool.run(run), address_bytes)
+
+
+async def node_query_tx_outs(txins):
+    # Description: Outputs still unspent at the tip, by txin, in one LocalStateQuery round trip
+    # Parameters: txins: list of 'hash#index'
+    # Return: {txin: tx_out}, spent or unknown txins are left out
+    keys = []
+    for txin in txins:
+        tx_hash, _, index = txin.partition('#')
+        keys.append([bytes.fromhex(tx_hash), int(index)])
+
+    async def run(connection):
+        await connection.acquire()
+        era = await connection.query(QUERY_CURRENT_ERA)
+        result = await connection.query_current(era, shelley_query_utxo_by_txin(keys))
+        await connection.release()
+        return result
+
+    return {f'{tx_hash.hex()}#{index}': tx_out for (tx_hash, index), tx_out in (await node_pool.run(run)).items()}
+
+
+def decode_block(wrapped_block):
+    """
+    Decode a block of a node-to-client chain-sync MsgRollForward
+    :param wrapped_block: CBORTag(24, CBOR of [era tag, block]), era tags 0 and 1 are Byron, 2 Shelley, ... 7 Conway
+    :return: (slot, block number, block hash hex, [(tx id hex, raw tx body, valid)]), bodies are left encoded for
+             scan_tx or cbor.loads
+    """
+    data = wrapped_block.value if isinstance(wrapped_block, CBORTag) else wrapped_block
+    outer, _ = cbor.container_spans(data)
+    era_tag = cbor.loads(data[outer[0][0]:outer[0][1]])
+    if era_tag < 2:
+        raise NodeProtocolError('decode_block: Byron blocks are not supported')
+    # [header, transaction bodies, witness sets, auxiliary data, invalid transactions (from Alonzo on)]
+    block, _ = cbor.container_spans(data, outer[1][0])
+    header = data[block[0][0]:block[0][1]]
+    header_body = cbor.loads(header)[0]
+    block_no, slot = header_body[0], header_body[1]
+    invalid = set(cbor.loads(data[block[4][0]:block[4][1]])) if len(block) > 4 else set()
+    bodies, _ = cbor.container_spans(data, block[1][0])
+    txs = []
+    for i, (start, end) in enumerate(bodies):
+        body = data[start:end]
+        txs.append((hashlib.blake2b(body, digest_size=32).hexdigest(), body, i not in invalid))
+    return slot, block_no, hashlib.blake2b(header, digest_size=32).hexdigest(), txs
+
+
+def decode_tx(tx):
+    """
+    Split a signed transaction, as LocalTxMonitor hands them out
+    :param tx: CBOR bytes of [body, witness set, valid (from Alonzo on), auxiliary data]
+    :return: (tx id hex, raw tx body, valid) like the transactions of decode_block
+    """
+    spans, _ = cbor.container_spans(tx)
+    body = tx[spans[0][0]:spans[0][1]]
+    # Mary and earlier transactions have no validity flag, false is 0xf4
+    valid = len(spans) < 4 or tx[spans[2][0]] != 0xf4
+    return hashlib.blake2b(body, digest_size=32).hexdigest(), body, valid
+
+
+def tx_changes(body, valid):
+    """
+    Inputs a transaction consumes and outputs it creates, collateral ones when it failed phase-2 validation
+    :return: (list of 'hash#index' inputs, list of (index, tx_out))
+    """
+    if valid:
+        inputs = body[0]
+        outputs = list(enumerate(body[1]))
+    else:
+        inputs = body.get(13, [])
+        # The collateral return output comes after the regular outputs
+        outputs = [(len(body[1]), body[16])] if 16 in body else []
+    if isinstance(inputs, CBORTag):
+        inputs = inputs.value
+    return [f'{tx_hash.hex()}#{index}' for tx_hash, index in inputs], outputs
+
+
+def scan_tx(body, valid, watch_set, with_inputs=True):
+    """
+    tx_changes of a raw transaction body, decoding only the outputs that pay a credential of the watch set. The
+    body is walked once, outputs are tested where they sit
+    :param watch_set: WatchSet
+    :param with_inputs: False leaves the inputs undecoded when no spent output can matter
+    :return: (list of 'hash#index' inputs, list of (index, tx_out, address bytes) of the watched outputs)
+    """
+    # {field key: (start, end)} of the body map
+    fields = {}
+    matches = []
+    output_count = 0
+    _, _, count, offset = cbor.read_head(body, 0)
+    while count is None or len(fields) < count:
+        if count is None and body[offset] == 0xff:
+            break
+        start = cbor.skip(body, offset)
+        key = body[offset] if body[offset] < 24 else cbor.loads(body[offset:start])
+        if key == 1 and len(watch_set):
+            outputs, output_count, end = watch_set.scan_outputs(body, start)
+            if valid:
+                matches = outputs
+        else:
+            end = cbor.skip(body, start)
+        fields[key] = (start, end)
+        offset = end
+
+    inputs = []
+    input_field = 0 if valid else 13
+    if with_inputs and input_field in fields:
+        start, end = fields[input_field]
+        inputs = [f'{tx_hash.hex()}#{index}' for tx_hash, index in cbor.loads(body[start:end])]
+    if not valid and 16 in fields and len(watch_set):
+        start, end = fields[16]
+        address_bytes = watch_set.match_output(body, start, end)
+        if address_bytes is not None:
+            # The collateral return output comes after the regular outputs
+            matches = [(output_count, start, end, address_bytes)]
+    return inputs, [(index, cbor.loads(body[start:end]), address_bytes)
+                    for index, start, end, address_bytes in matches]
+
+
+def _utc_time(value):
+    # UTCTime is encoded as [year, day of year, picoseconds of day]
+    year, day, picoseconds = value
+    start = datetime(year, 1, 1, tzinfo=timezone.utc).timestamp()
+    return start + (day - 1) * 86400 + picoseconds / 1e12
+
+
+def slot_to_time(slot, system_start):
+    # Byron slots last 20 seconds, Shelley and later 1 second
+    byron_slots = min(slot, SHELLEY_START_SLOT)
+    return system_start + byron_slots * 20 + (slot - byron_slots)
+
+
+async def node_query_tip():
+    # Description: Same JSON as `cardano-cli query tip`
+    async def run(connection):
+        await connection.acquire()
+        era = await connection.query(QUERY_CURRENT_ERA)
+        point = await connection.query(QUERY_CHAIN_POINT)
+        block_no = await connection.query(QUERY_CHAIN_BLOCK_NO)
+        system_start = await connection.query(QUERY_SYSTEM_START)
+        epoch = await connection.query_current(era, SHELLEY_QUERY_EPOCH_NO) if era > 0 else 0
+        await connection.release()
+        return era, point, block_no, system_start, epoch
+
+    era, point, block_no, system_start, epoch = await node_pool.run(run)
+    tip = {'era': ERA_NAMES[era] if era < len(ERA_NAMES) else str(era), 'epoch': epoch}
+    if len(point) == 0:
+        tip['syncProgress'] = '0.00'
+        return tip
+    slot, block_hash = point
+    tip['block'] = block_no[1] if len(block_no) > 1 else 0
+    tip['hash'] = block_hash.hex()
+    tip['slot'] = slot
+    start = _utc_time(system_start)
+    progress = (slot_to_time(slot, start) - start) / max(time.time() - start, 1) * 100
+    # Two decimals like cardano-cli, a synced node reports exactly 100.00
+    tip['syncProgress'] = '%.2f' % min(progress, 100)
+    return tip
+
+
+PPARAMS_FIELDS = {
+    # Alonzo
+    4: ['txFeePerByte', 'txFeeFixed', 'maxBlockBodySize', 'maxTxSize', 'maxBlockHeaderSize',
+        'stakeAddressDeposit', 'stakePoolDeposit', 'poolRetireMaxEpoch', 'stakePoolTargetNum',
+        'poolPledgeInfluence', 'monetaryExpansion', 'treasuryCut', 'decentralization', 'extraPraosEntropy',
+        'protocolVersion', 'minPoolCost', 'utxoCostPerWord', 'costModels', 'executionUnitPrices',
+        'maxTxExecutionUnits', 'maxBlockExecutionUnits', 'maxValueSize', 'collateralPercentage',
+        'maxCollateralInputs'],
+    # Babbage
+    5: ['txFeePerByte', 'txFeeFixed', 'maxBlockBodySize', 'maxTxSize', 'maxBlockHeaderSize',
+        'stakeAddressDeposit', 'stakePoolDeposit', 'poolRetireMaxEpoch', 'stakePoolTargetNum',
+        'poolPledgeInfluence', 'monetaryExpansion', 'treasuryCut', 'protocolVersion', 'minPoolCost',
+        'utxoCostPerByte', 'costModels', 'executionUnitPrices', 'maxTxExecutionUnits',
+        'maxBlockExecutionUnits', 'maxValueSize', 'collateralPercentage', 'maxCollateralInputs'],
+}
+
+COST_MODEL_NAMES = {0: 'PlutusV1', 1: 'PlutusV2', 2: 'PlutusV3'}
+
+
+def _rational(value):
+    if isinstance(value, CBORTag) and value.tag == 30:
+        numerator, denominator = value.value
+        return numerator / denominator
+    return value
+
+
+def protocol_parameters_json(era, values):
+    """
+    Convert the CBOR protocol parameters of an era to the JSON written by `cardano-cli query protocol-parameters`
+    :param era: era index
+    :param values: decoded GetCurrentPParams result
+    :return: dict
+    """
+    fields = PPARAMS_FIELDS.get(era)
+    if fields is None:
+        raise NodeClientError(f'protocol parameters of era {era} are not supported')
+    values = list(values)
+    position = fields.index('protocolVersion')
+    if len(values) == len(fields) + 1:
+        # Protocol version encoded as two flat fields
+        values[position:position + 2] = [values[position:position + 2]]
+    if len(values) != len(fields):
+        raise NodeProtocolError(f'unexpected protocol parameters length {len(values)}')
+    params = {}
+    for name, value in zip(fields, values):
+        if name == 'protocolVersion':
+            value = {'major': value[0], 'minor': value[1]}
+        elif name == 'extraPraosEntropy':
+            value = None if value == [0] else value[1].hex()
+        elif name == 'costModels':
+            value = {COST_MODEL_NAMES.get(language, str(language)): model for language, model in value.items()}
+        elif name == 'executionUnitPrices':
+            value = {'priceMemory': _rational(value[0]), 'priceSteps': _rational(value[1])}
+        elif name in ('maxTxExecutionUnits', 'maxBlockExecutionUnits'):
+            value = {'memory': value[0], 'steps': value[1]}
+        else:
+            value = _rational(value)
+        params[name] = value
+    return params
+
+
+async def node_query_protocol_parameters():
+    # Description: Same JSON as `cardano-cli query protocol-parameters`
+    async def run(connection):
+        await connection.acquire()
+        era = await connection.query(QUERY_CURRENT_ERA)
+        values = await connection.query_current(era, SHELLEY_QUERY_CURRENT_PPARAMS)
+        await connection.release()
+        return era, values
+
+    era, values = await node_pool.run(run)
+    return protocol_parameters_json(era, values)
+
+
+"""
+Transaction submission
+"""
+
+# Text envelope type of a signed transaction -> era index
+TX_ENVELOPE_ERAS = {
+    'Tx ShelleyEra': 1,
+    'Tx AllegraEra': 2,
+    'Tx MaryEra': 3,
+    'Tx AlonzoEra': 4,
+    'Tx BabbageEra': 5,
+    'Tx ConwayEra': 6,
+}
+
+
+def envelope_era(envelope_type):
+    era = TX_ENVELOPE_ERAS.get(envelope_type)
+    if era is None:
+        raise NodeClientError(f'unsupported transaction envelope {envelope_type}')
+    return era
+
+
+async def node_submit_tx(envelope_type, tx):
+    """
+    Submit a signed transaction through LocalTxSubmission
+    :param envelope_type: text envelope type, e.g. 'Tx AlonzoEra'
+    :param tx: signed transaction CBOR bytes
+    :return: None when accepted, raise TxSubmitRejected with the structured reason otherwise
+    """
+    era = envelope_era(envelope_type)
+    return await node_pool.run(lambda connection: connection.submit_tx(era, tx))
@@ -1,10 +1,43 @@
 from quart import Quart
+from quart import make_response
 from quart import request
+from quart import websocket
 from transactions import *
 
 app = Quart(__name__)
 
 
+@app.before_serving
+async def start_background_tasks():
+    wallet_pool.start()
+    tip_watcher.start()
+    if CHAIN_FOLLOWER == 'on':
+        chain_follower.start()
+    if NODE_CLIENT == 'native':
+        mempool_watcher.start()
+
+
+@app.after_serving
+async def stop_background_tasks():
+    await wallet_pool.close()
+    await tip_watcher.close()
+    await chain_follower.close()
+    await mempool_watcher.close()
+    blockfrost_client.close()
+    tx_cache.close()
+    await trade_watchlist.close()
+
+
+@app.errorhandler(BlockfrostError)
+async def blockfrost_error_handler(error):
+    # Blockfrost throttled or failed a call the answer depends on: 503 when throttled so clients retry later, 502
+    # otherwise
+    response = {'status': 'failed', 'error': error.body.get('error'), 'message': error.body.get('message')}
+    if error.status_code == 429:
+        return json.dumps(response), 503, {'Content-Type': 'application/json', 'Retry-After': '1'}
+    return json.dumps(response), 502, {'Content-Type': 'application/json'}
+
+
 @app.route('/v0/version', methods=['GET'])
 async def get_version():
     response = {'version': 'v0.97',
@@ -14,24 +47,16 @@ async def get_version():
 
 
 @app.route('/v0/nodestatus', methods=['GET'])
+@prioritized(PRIORITY_POLL)
 async def node_status_handler(network=NETWORK):
-    # Query tip
-    tip_parameters = [CARDANO_CLI_PATH, 'query', 'tip']
-    if network == 'mainnet':
-        tip_parameters += ['--mainnet']
-    else:
-        tip_parameters += ['--testnet-magic', TESTNET_MAGIC]
-
-    # Set status
-    output = run_command(tip_parameters, _env=my_env)
-    if type(output) is subprocess.CalledProcessError:
-        status = {'status': 'offline'}
-    else:
-        output = json.loads(output.decode('utf-8'))
-        if float(output["syncProgress"]) == 100:
-            status = {'status': 'online', 'tip': output}
-        else:
-            status = {'status': 'syncing', 'tip': output}
+    # Status and tip from the tip watcher's last poll, age_seconds is how old that poll is
+    if not tip_watcher.running:
+        await tip_watcher.poll()
+    snapshot = tip_watcher.status()
+    status = {'status': snapshot['status']}
+    if snapshot['tip'] is not None:
+        status['tip'] = snapshot['tip']
+    status['age_seconds'] = snapshot['age_seconds']
     status['network'] = network
     return json.dumps(status), {'Content-Type': 'application/json'}
 
@@ -39,108 +64,69 @@ async def node_status_handler(network=NETWORK):
 @app.route('/v0/createwallet', methods=['GET'])
 # Create a wallet
 async def create_wallet_handler():
-    response = create_wallet_address()
+    response = await wallet_pool.pop()
+    watch_new_wallet(response)
     return response, {'Content-Type': 'application/json'}
 
 
+@app.route('/v0/createwallet/batch', methods=['POST'])
+# Create {'count': N} wallets, streamed back as one JSON wallet per line (NDJSON)
+async def create_wallet_batch_handler():
+    data = await request.get_json()
+    count = data.get('count') if isinstance(data, dict) else None
+    if type(count) is not int or count < 1 or count > WALLET_BATCH_MAX:
+        response = {'error': f'count must be an integer between 1 and {WALLET_BATCH_MAX}'}
+        return json.dumps(response), 400, {'Content-Type': 'application/json'}
+
+    async def ndjson():
+        async for wallet in wallet_pool.stream(count):
+            watch_new_wallet(wallet)
+            yield (wallet + '\n').encode('utf-8')
+
+    return ndjson(), {'Content-Type': 'application/x-ndjson'}
+
+
 @app.route('/v0/wallets/<string:stake_address>/', methods=['GET'])
 # Get ADA and assets
 async def get_wallet_detail_handler(stake_address):
-    return json.dumps(get_balance_by_stake_address(stake_address)), {'Content-Type': 'application/json'}
+    return json.dumps(await get_balance_by_stake_address(stake_address)), {'Content-Type': 'application/json'}
 
 
 @app.route('/v0/addresses/<string:address>/utxos', methods=['GET'])
 # Query utxos available in the address
+@prioritized(PRIORITY_POLL)
 async def query_utxo_handler(address):
-    utxo_list = query_utxos(address)
+    utxo_list = await query_utxos(address)
     print(f'query_utxo_handler: {utxo_list}')
-    response = []
-    for utxo in utxo_list:
-        temp = {
-            'tx_hash': utxo[0],
-            'tx_index': utxo[1],
-            'amount': []
-        }
-        _dict = {}
-        datum_hash = None
-        pairs = [(i + 2, i + 3) for i in range(0, len(utxo) - 3, 3)]
-        for pair in pairs:
-            unit_pos = pair[1]
-            quantity_pos = pair[0]
-            unit = utxo[unit_pos]
-            quantity = utxo[quantity_pos]
-            if quantity == 'TxOutDatumHash':
-                datum_hash = utxo[-1].strip('"')
-                break
-            if unit in _dict:
-                _dict[unit] += int(quantity)
-            else:
-                _dict[unit] = int(quantity)
-        amount = []
-        for key in _dict:
-            amount.append({
-                'unit': key,
-                'quantity': str(_dict[key])
-            })
-        temp['amount'] = amount
-        temp['datum_hash'] = datum_hash
-        response.append(temp)
+    response = [utxo.as_dict() for utxo in utxo_list]
     print(f'query_utxo_handler response: {response}')
     return json.dumps(response), {'Content-Type': 'application/json'}
 
 
 @app.route('/v0/stake-addresses/<string:stake_address>/utxos', methods=['GET'])
 # Query utxos in the stake_address
+@prioritized(PRIORITY_POLL)
 async def query_utxo_by_stake_address_handler(stake_address):
-    utxo_list = query_utxos_by_stake_address(stake_address)
-    response = []
-    for utxo in utxo_list:
-        temp = {
-            'tx_hash': utxo[0],
-            'tx_index': utxo[1],
-            'amount': []
-        }
-        _dict = {}
-        datum_hash = None
-        pairs = [(i + 2, i + 3) for i in range(0, len(utxo) - 3, 3)]
-        for pair in pairs:
-            unit_pos = pair[1]
-            quantity_pos = pair[0]
-            unit = utxo[unit_pos]
-            quantity = utxo[quantity_pos]
-            if quantity == 'TxOutDatumHash':
-                datum_hash = utxo[-1].strip('"')
-                break
-            if unit in _dict:
-                _dict[unit] += int(quantity)
-            else:
-                _dict[unit] = int(quantity)
-        amount = []
-        for key in _dict:
-            amount.append({
-                'unit': key,
-                'quantity': str(_dict[key])
-            })
-        temp['amount'] = amount
-        temp['datum_hash'] = datum_hash
-        response.append(temp)
+    utxo_list = await query_utxos_by_stake_address(stake_address)
+    response = [utxo.as_dict() for utxo in utxo_list]
     return response, {'Content-Type': 'application/json'}
 
 
 @app.route('/v0/addresses/<string:address>/balance', methods=['GET'])
 # Query total ADA and assets in the payment address
+@prioritized(PRIORITY_POLL)
 async def query_balance_handler(address):
-    utxo_list = query_utxos(address)
+    utxo_list = await query_utxos(address)
     total_ada = 0
     asset_list = []
     temp_dict = {}
     for utxo in utxo_list:
-        total_ada += int(utxo[2])
-        if len(utxo) > 6:
-            if utxo[6] in temp_dict:
-                temp_dict[utxo[6]] += int(utxo[5])
+        total_ada += utxo.lovelace
+        for unit, quantity in utxo.assets.items():
+            if unit in temp_dict:
+                temp_dict[unit] += quantity
             else:
-                temp_dict[utxo[6]] = int(utxo[5])
+                temp_dict[unit] = quantity
     for key in temp_dict:
         asset_list.append({'unit': key, 'quantity': str(temp_dict[key])})
     response = {'lovelace': str(total_ada), 'asset': asset_list}
@@ -150,14 +136,31 @@ async def query_balance_handler(address):
 @app.route('/v0/addresses/<string:address>/stake_address', methods=['GET'])
 # Get stake address from address
 async def get_stake_address_handler(address):
-    stake_address = get_stake_address(address)
+    stake_address = await get_stake_address(address)
     response = {'stake_address': stake_address}
     return json.dumps(response), {'Content-Type': 'application/json'}
 
 
+@app.route('/v0/addresses/stake_address', methods=['POST'])
+# Get the stake addresses of {'addresses': [address]}, as [{'address', 'stake_address'}] in the same order
+@prioritized(PRIORITY_POLL)
+async def get_stake_address_batch_handler():
+    data = await request.get_json()
+    addresses = data.get('addresses') if isinstance(data, dict) else None
+    if type(addresses) is not list or not 0 < len(addresses) <= STAKE_ADDRESS_BATCH_MAX or \
+            not all(type(address) is str for address in addresses):
+        response = {'error': f'addresses must be a list of 1 to {STAKE_ADDRESS_BATCH_MAX} addresses'}
+        return json.dumps(response), 400, {'Content-Type': 'application/json'}
+    stake_addresses = await get_stake_addresses(addresses)
+    response = [{'address': address, 'stake_address': stake_address}
+                for address, stake_address in zip(addresses, stake_addresses)]
+    return json.dumps(response), {'Content-Type': 'application/json'}
+
+
 @app.route('/v0/trade/return', methods=['POST'])
 # Description: Return all registered ADA, assets back to registered owners
 # Note: stake address for buyers and sellers applies
+@prioritized(PRIORITY_SETTLEMENT)
 async def trade_return_all_utxos_handler():
     # Get data
     data = await request.get_json()
@@ -198,13 +201,14 @@ async def trade_return_all_utxos_handler():
     seller_check = False
 
     # Query utxos in address
-    utxo_list = query_utxos(address)
+    utxo_list = await query_utxos(address)
 
-    buyer_address, ada_tx, seller_address, asset_tx, utxo_mark, from_address = check_buyer_and_seller(utxo_list,
-                                                                                                      buyer_stake_list,
-                                                                                                      seller_stake_list,
-                                                                                                      buy_listing,
-                                                                                                      sell_listing)
+    buyer_address, ada_tx, seller_address, asset_tx, utxo_mark, from_address = await check_buyer_and_seller(
+        utxo_list,
+        buyer_stake_list,
+        seller_stake_list,
+        buy_listing,
+        sell_listing)
     if buyer_address != '':
         buyer_check = True
     if seller_address != '':
@@ -217,7 +221,6 @@ async def trade_return_all_utxos_handler():
     elif NETWORK == 'testnet':
         net = ['--testnet-magic', str(TESTNET_MAGIC)]
 
-    signed_path = ''
     _id = get_unique_id()
     draft_path = f'transactions/tx_{_id}.draft'
 
@@ -226,7 +229,7 @@ async def trade_return_all_utxos_handler():
     build_parameters = [CARDANO_CLI_PATH, 'transaction', 'build']
     for i, utxo in enumerate(utxo_list):
         if utxo_mark[i] == 1:
-            build_parameters += ['--tx-in', f'{utxo[0]}#{utxo[1]}']
+            build_parameters += ['--tx-in', utxo.txin]
 
     # If tx-in is empty, return fail
     response = {}
@@ -236,14 +239,10 @@ async def trade_return_all_utxos_handler():
 
     if buyer_check is True and seller_check is False:
         for i, utxo in enumerate(utxo_list):
-            if utxo[0] == ada_tx:
+            if utxo.tx_hash == ada_tx:
                 continue
             if utxo_mark[i] == 1:
-                if len(utxo) <= 6:
-                    build_parameters += ['--tx-out', f'{from_address[i]}+{utxo[2]}']
-                else:
-                    build_parameters += ['--tx-out', f'{from_address[i]}+{utxo[2]}'
-                                                     f'+{utxo[5]} {utxo[6]}']
+                build_parameters += ['--tx-out', f'{from_address[i]}+{utxo.value()}']
 
         # The buyer covers the refund's network fee when session fails
         build_parameters += ['--change-address', buyer_address]
@@ -252,14 +251,10 @@ async def trade_return_all_utxos_handler():
         cover_utxo_address = ''
         for i, utxo in enumerate(utxo_list):
             if utxo_mark[i] == 1:
-                if len(utxo) <= 6 and int(utxo[2]) >= 2000000 and cover_utxo_address == '':
+                if utxo.ada_only and utxo.lovelace >= 2000000 and cover_utxo_address == '':
                     cover_utxo_address = from_address[i]
                     continue
-                if len(utxo) <= 6:
-                    build_parameters += ['--tx-out', f'{from_address[i]}+{utxo[2]}']
-                else:
-                    build_parameters += ['--tx-out', f'{from_address[i]}+{utxo[2]}'
-                                                     f'+{utxo[5]} {utxo[6]}']
+                build_parameters += ['--tx-out', f'{from_address[i]}+{utxo.value()}']
 
         if cover_utxo_address == '':
             print('trade_return_all_utxos_handler: Not enough fund to cover network fee. Need at least 2 ADA')
@@ -281,46 +276,31 @@ async def trade_return_all_utxos_handler():
     build_parameters += ['--out-file', draft_path, '--alonzo-era']
 
     # Build transaction
-    output = run_command(build_parameters, my_env)
+    output = await coroutine_run_command(build_parameters, _env=my_env)
     if type(output) is subprocess.CalledProcessError:
         raise output
 
     # Sign the transaction draft
-    signed_path = f'transactions/tx_{_id}.signed'
-    sign_parameters = [CARDANO_CLI_PATH, 'transaction', 'sign',
-                       '--tx-body-file', draft_path,
-                       '--signing-key-file', signing_key_path]
-    sign_parameters += net
-    sign_parameters += ['--out-file', signed_path]
-
-    output = run_command(sign_parameters, my_env)
-    if type(output) is subprocess.CalledProcessError:
-        raise output
+    signed_tx = await sign_transaction(draft_path, signing_key_path)
+    if type(signed_tx) is subprocess.CalledProcessError:
+        raise signed_tx
 
     # Submit the transaction
-    submit_parameters = [CARDANO_CLI_PATH, 'transaction', 'submit',
-                         '--tx-file', signed_path]
-    submit_parameters += net
-
-    result = run_command(submit_parameters, _env=my_env)
+    result = await submit_tx(signed_tx)
     if type(result) is subprocess.CalledProcessError:
         raise result
 
     print(result.decode('utf-8'))
 
     # Record the txid
-    txid_parameters = [CARDANO_CLI_PATH, 'transaction', 'txid', '--tx-file', signed_path]
-
-    txid = run_command(txid_parameters, my_env)
-    if type(txid) is subprocess.CalledProcessError:
-        raise txid
+    txid = get_tx_id(signed_tx)
 
-    response['txids'] = [{'txid': txid.decode('utf-8').strip('\n')}]
+    response['txids'] = [{'txid': txid}]
+    unwatch_settled_wallet(address)
 
     # Clean transaction files
     try:
         os.remove(signing_key_path)
-        os.remove(signed_path)
         os.remove(draft_path)
     except FileNotFoundError as e:
         print(f'trade_return_all_utxos_handler: {e.errno}')
@@ -330,6 +310,7 @@ async def trade_return_all_utxos_handler():
 
 @app.route('/v1/trade/return', methods=['POST'])
 # Return all utxos regardless of coming from registered addresses or unregistered addresses
+@prioritized(PRIORITY_SETTLEMENT)
 async def v1_trade_return_all_utxos_handler():
     data = await request.get_json()
     address = data['address']
@@ -346,7 +327,7 @@ async def v1_trade_return_all_utxos_handler():
         json.dump(signing_key, file)
 
     # Return utxos
-    txid = return_all_utxos(address, signing_key_path)
+    txid = await return_all_utxos(address, signing_key_path)
     if len(txid) > 0:
         response = {'status': 'success'}
     else:
@@ -365,6 +346,7 @@ async def v1_trade_return_all_utxos_handler():
 @app.route('/v0/trade/finalize', methods=['POST'])
 # Send asset to buyer, ADA to seller and service fee to market account if all assets and ADA are confirmed
 # Note: Only registered utxos are processed, unregistered utxos stay in the middle wallet
+@prioritized(PRIORITY_SETTLEMENT)
 async def trade_finalize_handler():
     # Get data
     data = await request.get_json()
@@ -405,13 +387,14 @@ async def trade_finalize_handler():
     seller_check = False
 
     # Query utxos in address
-    utxo_list = query_utxos(address)
+    utxo_list = await query_utxos(address)
 
-    buyer_address, ada_tx, seller_address, asset_tx, utxo_mark, from_address = check_buyer_and_seller(utxo_list,
-                                                                                                      buyer_stake_list,
-                                                                                                      seller_stake_list,
-                                                                                                      buy_listing,
-                                                                                                      sell_listing)
+    buyer_address, ada_tx, seller_address, asset_tx, utxo_mark, from_address = await check_buyer_and_seller(
+        utxo_list,
+        buyer_stake_list,
+        seller_stake_list,
+        buy_listing,
+        sell_listing)
     if buyer_address != '':
         buyer_check = True
     if seller_address != '':
@@ -447,7 +430,7 @@ async def trade_finalize_handler():
     build_parameters = [CARDANO_CLI_PATH, 'transaction', 'build']
     for i, utxo in enumerate(utxo_list):
         if utxo_mark[i] == 1:
-            build_parameters += ['--tx-in', f'{utxo[0]}#{utxo[1]}']
+            build_parameters += ['--tx-in', utxo.txin]
 
     # If tx-in is empty, return fail
     if len(build_parameters) <= 3 or buyer_check is False or seller_check is False:
@@ -463,18 +446,14 @@ async def trade_finalize_handler():
     # tx-out
     if buyer_check is True and seller_check is True:
         for i, utxo in enumerate(utxo_list):
-            if utxo[0] == asset_tx:
+            if utxo.tx_hash == asset_tx:
                 # Send asset to the buyer
-                build_parameters += ['--tx-out', f'{buyer_address}+{utxo[2]}+{utxo[5]} {utxo[6]}']
-            elif utxo[0] == ada_tx:
+                build_parameters += ['--tx-out', f'{buyer_address}+{utxo.value()}']
+            elif utxo.tx_hash == ada_tx:
                 continue
             else:
                 if utxo_mark[i] == 1:
-                    if len(utxo) <= 6:
-                        build_parameters += ['--tx-out', f'{from_address[i]}+{utxo[2]}']
-                    else:
-                        build_parameters += ['--tx-out', f'{from_address[i]}+{utxo[2]}'
-                                                         f'+{utxo[5]} {utxo[6]}']
+                    build_parameters += ['--tx-out', f'{from_address[i]}+{utxo.value()}']
 
         # Send to market address the service fee
         # If listing price <= 20 ADA or service_rate == 0, service fee is waived
@@ -488,44 +467,29 @@ async def trade_finalize_handler():
     build_parameters += ['--out-file', draft_path, '--alonzo-era']
 
     # Build transaction
-    output = run_command(build_parameters, my_env)
+    output = await coroutine_run_command(build_parameters, _env=my_env)
     if type(output) is subprocess.CalledProcessError:
         raise output
 
     # Sign the transaction draft
-    signed_path = f'transactions/tx_{_id}.signed'
-    sign_parameters = [CARDANO_CLI_PATH, 'transaction', 'sign',
-                       '--tx-body-file', draft_path,
-                       '--signing-key-file', signing_key_path]
-    sign_parameters += net
-    sign_parameters += ['--out-file', signed_path]
-
-    output = run_command(sign_parameters, my_env)
-    if type(output) is subprocess.CalledProcessError:
-        raise output
+    signed_tx = await sign_transaction(draft_path, signing_key_path)
+    if type(signed_tx) is subprocess.CalledProcessError:
+        raise signed_tx
 
     # Submit the transaction
-    submit_parameters = [CARDANO_CLI_PATH, 'transaction', 'submit',
-                         '--tx-file', signed_path]
-    submit_parameters += net
-
-    result = run_command(submit_parameters, my_env)
+    result = await submit_tx(signed_tx)
     if type(result) is subprocess.CalledProcessError:
         raise result
 
     # Record the txid
-    txid_parameters = [CARDANO_CLI_PATH, 'transaction', 'txid', '--tx-file', signed_path]
-
-    txid = run_command(txid_parameters, my_env)
-    if type(txid) is subprocess.CalledProcessError:
-        raise txid
+    txid = get_tx_id(signed_tx)
 
-    response['txids'] = [{'txid': txid.decode('utf-8').strip('\n')}]
+    response['txids'] = [{'txid': txid}]
+    unwatch_settled_wallet(address)
 
     # Clean transaction files
     try:
         os.remove(signing_key_path)
-        os.remove(signed_path)
         os.remove(draft_path)
     except FileNotFoundError as e:
         print(f'trade_finalize_handler: clean transaction files {e.errno}')
@@ -536,6 +500,7 @@ async def trade_finalize_handler():
 @app.route('/v1/trade/finalize', methods=['POST'])
 # Send asset to buyer, ADA to seller and service fee to market account if all assets and ADA are confirmed
 # All transaction is recognized
+@prioritized(PRIORITY_SETTLEMENT)
 async def v1_trade_finalize_handler():
     # Get data
     data = await request.get_json()
@@ -565,9 +530,9 @@ async def v1_trade_finalize_handler():
     seller_check = False
 
     # Query utxos in address
-    utxo_list = query_utxos(address)
+    utxo_list = await query_utxos(address)
 
-    buyer_address, ada_tx, seller_address, asset_tx, from_address = check_buyer_and_seller_without_stake_address(
+    buyer_address, ada_tx, seller_address, asset_tx, from_address = await check_buyer_and_seller_without_stake_address(
         utxo_list,
         buy_listing,
         sell_listing)
@@ -603,7 +568,7 @@ async def v1_trade_finalize_handler():
     # tx-in
     build_parameters = [CARDANO_CLI_PATH, 'transaction', 'build']
     for i, utxo in enumerate(utxo_list):
-        build_parameters += ['--tx-in', f'{utxo[0]}#{utxo[1]}']
+        build_parameters += ['--tx-in', utxo.txin]
 
     # If tx-in is empty, return fail
     if len(build_parameters) <= 3 or buyer_check is False or seller_check is False:
@@ -619,17 +584,13 @@ async def v1_trade_finalize_handler():
     # tx-out
     if buyer_check is True and seller_check is True:
         for i, utxo in enumerate(utxo_list):
-            if utxo[0] == asset_tx:
+            if utxo.tx_hash == asset_tx:
                 # Send asset to the buyer
-                build_parameters += ['--tx-out', f'{buyer_address}+{utxo[2]}+{utxo[5]} {utxo[6]}']
-            elif utxo[0] == ada_tx:
+                build_parameters += ['--tx-out', f'{buyer_address}+{utxo.value()}']
+            elif utxo.tx_hash == ada_tx:
                 continue
             else:
-                if len(utxo) <= 6:
-                    build_parameters += ['--tx-out', f'{from_address[i]}+{utxo[2]}']
-                else:
-                    build_parameters += ['--tx-out', f'{from_address[i]}+{utxo[2]}'
-                                                     f'+{utxo[5]} {utxo[6]}']
+                build_parameters += ['--tx-out', f'{from_address[i]}+{utxo.value()}']
 
         # Send to market address the service fee
         # If listing price <= 20 ADA or service_rate == 0, service fee is waived
@@ -643,44 +604,29 @@ async def v1_trade_finalize_handler():
     build_parameters += ['--out-file', draft_path, '--alonzo-era']
 
     # Build transaction
-    output = run_command(build_parameters, my_env)
+    output = await coroutine_run_command(build_parameters, _env=my_env)
     if type(output) is subprocess.CalledProcessError:
         raise output
 
     # Sign the transaction draft
-    signed_path = f'transactions/tx_{_id}.signed'
-    sign_parameters = [CARDANO_CLI_PATH, 'transaction', 'sign',
-                       '--tx-body-file', draft_path,
-                       '--signing-key-file', signing_key_path]
-    sign_parameters += net
-    sign_parameters += ['--out-file', signed_path]
-
-    output = run_command(sign_parameters, my_env)
-    if type(output) is subprocess.CalledProcessError:
-        raise output
+    signed_tx = await sign_transaction(draft_path, signing_key_path)
+    if type(signed_tx) is subprocess.CalledProcessError:
+        raise signed_tx
 
     # Submit the transaction
-    submit_parameters = [CARDANO_CLI_PATH, 'transaction', 'submit',
-                         '--tx-file', signed_path]
-    submit_parameters += net
-
-    result = run_command(submit_parameters, my_env)
+    result = await submit_tx(signed_tx)
     if type(result) is subprocess.CalledProcessError:
         raise result
 
     # Record the txid
-    txid_parameters = [CARDANO_CLI_PATH, 'transaction', 'txid', '--tx-file', signed_path]
+    txid = get_tx_id(signed_tx)
 
-    txid = run_command(txid_parameters, my_env)
-    if type(txid) is subprocess.CalledProcessError:
-        raise txid
-
-    response['txids'] = [{'txid': txid.decode('utf-8').strip('\n')}]
+    response['txids'] = [{'txid': txid}]
+    unwatch_settled_wallet(address)
 
     # Clean transaction files
     try:
         os.remove(signing_key_path)
-        os.remove(signed_path)
         os.remove(draft_path)
     except FileNotFoundError as e:
         print(f'trade_finalize_handler: clean transaction files {e.errno}')
@@ -690,91 +636,89 @@ async def v1_trade_finalize_handler():
 
 @app.route('/v0/trade/status', methods=['POST'])
 # Check whether seller and buyer have sent their asset/ADA
+@prioritized(PRIORITY_POLL)
 async def trade_status_handler():
     # Get data
     data = await request.get_json()
-    address = data['address']
-    buy_listing = data['buy']
-    sell_listing = data['sell']
-    # buy_quantity = str(buy_listing['quantity'])
-    # sell_quantity = str(sell_listing['quantity'])
-
-    # Change stake list to list of strings for easier reading
-    buyer_stake_list = []
-    for stake_address in data['buyer_stake_list']:
-        buyer_stake_list.append(stake_address['stake_address'])
-    seller_stake_list = []
-    for stake_address in data['seller_stake_list']:
-        seller_stake_list.append(stake_address['stake_address'])
-
-    # Declare variables
-    utxos = []
-    buyer_check = False
-    seller_check = False
-
-    # Query utxos in address
-    utxo_list = query_utxos(address)
+    data['version'] = 'v0'
 
-    buyer_address, ada_tx, seller_address, asset_tx, utxo_mark, from_address = check_buyer_and_seller(utxo_list,
-                                                                                                      buyer_stake_list,
-                                                                                                      seller_stake_list,
-                                                                                                      buy_listing,
-                                                                                                      sell_listing)
-
-    if buyer_address != '':
-        buyer_check = True
-    if seller_address != '':
-        seller_check = True
-
-    for utxo in utxo_list:
-        utxos.append({'utxo': ' '.join(utxo)})
-
-    response = {
-        'buyer_sent': buyer_check,
-        'seller_sent': seller_check,
-        'utxos': utxos
-    }
+    # Evaluated once per block for every active trade, polls between blocks are answered from the watchlist
+    response = await trade_watchlist.status(data['address'], data)
     return json.dumps(response), {'Content-Type': 'application/json'}
 
 
 @app.route('/v1/trade/status', methods=['POST'])
 # Check whether seller and buyer have sent their asset/ADA, but don't check stake address
+@prioritized(PRIORITY_POLL)
 async def v1_trade_status_handler():
     # Get data
     data = await request.get_json()
-    address = data['address']
-    buy_listing = data['buy']
-    sell_listing = data['sell']
-    # buy_quantity = str(buy_listing['quantity'])
-    # sell_quantity = str(sell_listing['quantity'])
+    data['version'] = 'v1'
 
-    # Declare variables
-    utxos = []
-    buyer_check = False
-    seller_check = False
+    response = await trade_watchlist.status(data['address'], data)
+    return json.dumps(response), {'Content-Type': 'application/json'}
 
-    # Query utxos in address
-    utxo_list = query_utxos(address)
 
-    buyer_address, ada_tx, seller_address, asset_tx, from_address = check_buyer_and_seller_without_stake_address(
-        utxo_list,
-        buy_listing,
-        sell_listing)
+@app.route('/v0/trade/events', methods=['POST'])
+# Server-Sent Events of /v0/trade/status: a 'status' event now and each time buyer_sent, seller_sent or the utxos
+# change, checked every new block
+async def trade_events_handler():
+    data = await request.get_json()
+    data['version'] = 'v0'
+    return await trade_event_stream(data)
 
-    if buyer_address != '':
-        buyer_check = True
-    if seller_address != '':
-        seller_check = True
 
-    for utxo in utxo_list:
-        utxos.append({'utxo': ' '.join(utxo)})
+@app.route('/v1/trade/events', methods=['POST'])
+# Server-Sent Events of /v1/trade/status
+async def v1_trade_events_handler():
+    data = await request.get_json()
+    data['version'] = 'v1'
+    return await trade_event_stream(data)
 
-    response = {
-        'buyer_sent': buyer_check,
-        'seller_sent': seller_check,
-        'utxos': utxos
-    }
-    return json.dumps(response), {'Content-Type': 'application/json'}
+
+async def trade_event_stream(data):
+    key, queue = trade_watchlist.subscribe(data['address'], data)
+
+    async def stream():
+        try:
+            while True:
+                try:
+                    status = await asyncio.wait_for(queue.get(), TRADE_EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    # Comment line, keeps proxies from closing an idle stream
+                    yield b': keepalive\n\n'
+                    continue
+                yield f'event: status\ndata: {json.dumps(status)}\n\n'.encode()
+        finally:
+            trade_watchlist.unsubscribe(key, queue)
+
+    response = await make_response(stream(), {'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+    response.timeout = None
+    return response
+
+
+@app.websocket('/v0/trade/events/ws')
+# WebSocket variant of /v0/trade/events: send the /v0/trade/status request body, receive status messages
+async def trade_events_websocket():
+    data = json.loads(await websocket.receive())
+    data['version'] = 'v0'
+    await trade_event_socket(data)
+
+
+@app.websocket('/v1/trade/events/ws')
+async def v1_trade_events_websocket():
+    data = json.loads(await websocket.receive())
+    data['version'] = 'v1'
+    await trade_event_socket(data)
+
+
+async def trade_event_socket(data):
+    key, queue = trade_watchlist.subscribe(data['address'], data)
+    try:
+        while True:
+            await websocket.send(json.dumps(await queue.get()))
+    finally:
+        trade_watchlist.unsubscribe(key, queue)
 
 
 @app.route('/v0/trade/status-blockfrost', methods=['POST'])
@@ -802,9 +746,9 @@ async def trade_status_blockfrost_handler():
     seller_check = False
 
     # Query utxos in address
-    utxo_list = query_utxos_blockfrost(address)
+    utxo_list = await query_utxos_blockfrost(address)
 
-    buyer_address, ada_tx, seller_address, asset_tx, utxo_mark, from_address = check_buyer_and_seller_blockfrost(
+    buyer_address, ada_tx, seller_address, asset_tx, utxo_mark, from_address = await check_buyer_and_seller_blockfrost(
         utxo_list,
         buyer_stake_list,
         seller_stake_list,
@@ -850,12 +794,10 @@ async def v1_trade_status_blockfrost_handler():
     seller_check = False
 
     # Query utxos in address
-    utxo_list = query_utxos_blockfrost(address)
+    utxo_list = await query_utxos_blockfrost(address)
 
-    buyer_address, ada_tx, seller_address, asset_tx, from_address = check_buyer_and_seller_blockfrost_without_stake_address(
-        utxo_list,
-        buy_listing,
-        sell_listing)
+    buyer_address, ada_tx, seller_address, asset_tx, from_address = \
+        await check_buyer_and_seller_blockfrost_without_stake_address(utxo_list, buy_listing, sell_listing)
 
     if buyer_address != '':
         buyer_check = True
@@ -875,18 +817,19 @@ async def v1_trade_status_blockfrost_handler():
 
 @app.route('/v0/connectwallet/status', methods=['POST'])
 # Check whether the user has sent their verify lovelace to the address
+@prioritized(PRIORITY_POLL)
 async def connect_wallet_status_handler():
     data = await request.get_json()
     address = data['address']
     lovelace = str(data['verify_lovelace'])
 
     lovelace_found = False
-    utxo_list = query_utxos(address)
+    utxo_list = await query_watched_utxos(address)
     utxos = []
     for utxo in utxo_list:
-        if utxo[2] == lovelace:
+        if str(utxo.lovelace) == lovelace:
             lovelace_found = True
-        utxos.append({'utxo': ' '.join(utxo)})
+        utxos.append({'utxo': ' '.join(utxo.cells())})
 
     response = {'lovelace_found': lovelace_found, 'utxos': utxos}
 
@@ -895,6 +838,7 @@ async def connect_wallet_status_handler():
 
 @app.route('/v0/connectwallet/finalize', methods=['POST'])
 # Determine whether the user succeeds in adding a wallet and refund all utxos equal or larger than 2 ADA
+@prioritized(PRIORITY_SETTLEMENT)
 async def connect_wallet_finalize_handler():
     if not os.path.isdir('request'):
         os.makedirs('request')
@@ -908,11 +852,12 @@ async def connect_wallet_finalize_handler():
     with open(signing_key_path, 'w') as file:
         json.dump(signing_key, file)
 
-    stake_address, sender_utxo_address = get_user_addresses(address, lovelace)
-    txid = return_all_utxos(address, signing_key_path)
+    stake_address, sender_utxo_address = await get_user_addresses(address, lovelace)
+    txid = await return_all_utxos(address, signing_key_path)
     # print(txid)
     if stake_address is not None:
         response = {'status': 'success', 'stake_address': stake_address, 'txids': txid}
+        unwatch_settled_wallet(address)
     else:
         response = {'status': 'failed', 'stake_address': stake_address, 'txids': txid}
 
@@ -925,6 +870,7 @@ async def connect_wallet_finalize_handler():
 
 @app.route('/v0/return/ada_only', methods=['POST'])
 # Return all utxos which have only ADA and equal or more than 2 ADA
+@prioritized(PRIORITY_SETTLEMENT)
 async def return_ada_only_handler():
     data = await request.get_json()
     address = data['address']
@@ -936,7 +882,7 @@ async def return_ada_only_handler():
     with open(signing_key_path, 'w') as file:
         json.dump(signing_key, file)
 
-    txid = refund_all_ada_utxos(address, signing_key_path)
+    txid = await refund_all_ada_utxos(address, signing_key_path)
     response = {'txids': txid}
 
     try:
@@ -950,6 +896,7 @@ async def return_ada_only_handler():
 
 @app.route('/v0/return/all', methods=['POST'])
 # Return all utxos regardless of coming from registered addresses or unregistered addresses
+@prioritized(PRIORITY_SETTLEMENT)
 async def return_all_utxos_handler():
     data = await request.get_json()
     address = data['address']
@@ -966,7 +913,7 @@ async def return_all_utxos_handler():
         json.dump(signing_key, file)
 
     # Return utxos
-    txid = return_all_utxos(address, signing_key_path)
+    txid = await return_all_utxos(address, signing_key_path)
     if len(txid) > 0:
         response = {'status': 'success'}
     else:
@@ -984,6 +931,7 @@ async def return_all_utxos_handler():
 
 @app.route('/v0/return/registered', methods=['POST'])
 # Return all utxos which send from registered addresses
+@prioritized(PRIORITY_SETTLEMENT)
 async def return_all_registered_utxos_handler():
     data = await request.get_json()
     address = data['address']
@@ -1003,7 +951,7 @@ async def return_all_registered_utxos_handler():
         json.dump(signing_key, file)
 
     # Return utxos
-    txid = return_all_registered_utxos(address, signing_key_path, stake_list)
+    txid = await return_all_registered_utxos(address, signing_key_path, stake_list)
     if len(txid) > 0:
         response = {'status': 'success'}
     else:
@@ -1020,6 +968,7 @@ async def return_all_registered_utxos_handler():
 
 
 @app.route('/v0/support/reclaim/status', methods=['POST'])
+@prioritized(PRIORITY_POLL)
 async def reclaim_status_handler():
     # TODO need more testing
     data = await request.get_json()
@@ -1030,22 +979,23 @@ async def reclaim_status_handler():
         stake_list.append(stake_address['stake_address'])
 
     lovelace_found = False
-    utxo_list = query_utxos(address)
+    utxo_list = await query_watched_utxos(address)
     utxos = []
     for utxo in utxo_list:
-        if utxo[2] == lovelace:
-            tx = get_transaction_content(utxo[0])
+        if str(utxo.lovelace) == lovelace:
+            tx = await get_transaction_content(utxo.tx_hash)
             sender_utxo_address = tx['inputs'][0]['address']
-            sender_stake_address = get_stake_address(sender_utxo_address)
+            sender_stake_address = await get_stake_address(sender_utxo_address)
             if sender_stake_address in stake_list:
                 lovelace_found = True
-        utxos.append({'utxo': ' '.join(utxo)})
+        utxos.append({'utxo': ' '.join(utxo.cells())})
 
     response = {'lovelace_found': lovelace_found, 'utxos': utxos}
     return json.dumps(response), {'Content-Type': 'application/json'}
 
 
 @app.route('/v0/support/reclaim/finalize', methods=['POST'])
+@prioritized(PRIORITY_SETTLEMENT)
 async def reclaim_finalize_handler():
     # TODO need more testing
     data = await request.get_json()
@@ -1071,7 +1021,7 @@ async def reclaim_finalize_handler():
         os.makedirs('transactions')
 
     # Query utxos in address
-    utxo_list = query_utxos(address)
+    utxo_list = await query_utxos(address)
 
     check = False
     response = {'status': 'failed', 'txids': []}
@@ -1081,13 +1031,13 @@ async def reclaim_finalize_handler():
     cover_utxo_address = ''
     # Mark registered utxos, buyer and seller address
     for i, utxo in enumerate(utxo_list):
-        tx = get_transaction_content(utxo[0])
+        tx = await get_transaction_content(utxo.tx_hash)
         sender_utxo_address = tx['inputs'][0]['address']
-        sender_stake_address = get_stake_address(sender_utxo_address)
+        sender_stake_address = await get_stake_address(sender_utxo_address)
         if sender_stake_address in stake_list:
             utxo_mark[i] = 1
             from_address[i] = sender_utxo_address
-            if int(utxo[2]) >= 3000000:
+            if utxo.lovelace >= 3000000:
                 cover_utxo_address = from_address[i]
                 check = True
 
@@ -1104,7 +1054,6 @@ async def reclaim_finalize_handler():
     elif NETWORK == 'testnet':
         net = ['--testnet-magic', str(TESTNET_MAGIC)]
 
-    signed_path = ''
     _id = get_unique_id()
     draft_path = f'transactions/tx_{_id}.draft'
 
@@ -1113,7 +1062,7 @@ async def reclaim_finalize_handler():
     build_parameters = [CARDANO_CLI_PATH, 'transaction', 'build']
     for i, utxo in enumerate(utxo_list):
         if utxo_mark[i] == 1:
-            build_parameters += ['--tx-in', f'{utxo[0]}#{utxo[1]}']
+            build_parameters += ['--tx-in', utxo.txin]
 
     # If tx-in is empty, return fail
     if len(build_parameters) <= 3:
@@ -1124,13 +1073,9 @@ async def reclaim_finalize_handler():
     build_parameters += ['--tx-out', f'{market_address}+{service_fee}']  # service fee
     for i, utxo in enumerate(utxo_list):
         if utxo_mark[i] == 1:
-            if utxo[0] == cover_utxo_address:
+            if utxo.tx_hash == cover_utxo_address:
                 continue
-            if len(utxo) <= 6:
-                build_parameters += ['--tx-out', f'{from_address[i]}+{utxo[2]}']
-            elif len(utxo) > 6:
-                build_parameters += ['--tx-out', f'{from_address[i]}+{utxo[2]}'
-                                                 f'+{utxo[5]} {utxo[6]}']
+            build_parameters += ['--tx-out', f'{from_address[i]}+{utxo.value()}']
     if cover_utxo_address == '':
         raise ValueError(f'reclaim_finalize_handler: Not enough fund to cover network fee.'
                          f'Need at least 1 ADA-only utxo containing equal or more than 3 ADA.')
@@ -1142,44 +1087,29 @@ async def reclaim_finalize_handler():
 
     # Build transaction
 
-    output = run_command(build_parameters, my_env)
+    output = await coroutine_run_command(build_parameters, _env=my_env)
     if type(output) is subprocess.CalledProcessError:
         raise output
 
     # Sign the transaction draft
-    signed_path = f'transactions/tx_{_id}.signed'
-    sign_parameters = [CARDANO_CLI_PATH, 'transaction', 'sign',
-                       '--tx-body-file', draft_path,
-                       '--signing-key-file', signing_key_path]
-    sign_parameters += net
-    sign_parameters += ['--out-file', signed_path]
-
-    output = run_command(sign_parameters, my_env)
-    if type(output) is subprocess.CalledProcessError:
-        raise output
+    signed_tx = await sign_transaction(draft_path, signing_key_path)
+    if type(signed_tx) is subprocess.CalledProcessError:
+        raise signed_tx
 
     # Submit the transaction
-    submit_parameters = [CARDANO_CLI_PATH, 'transaction', 'submit',
-                         '--tx-file', signed_path]
-    submit_parameters += net
-
-    result = run_command(submit_parameters, my_env)
+    result = await submit_tx(signed_tx)
     if type(result) is subprocess.CalledProcessError:
         raise result
 
     # Record the txid
-    txid_parameters = [CARDANO_CLI_PATH, 'transaction', 'txid', '--tx-file', signed_path]
-
-    txid = run_command(txid_parameters, my_env)
-    if type(txid) is subprocess.CalledProcessError:
-        raise txid
+    txid = get_tx_id(signed_tx)
 
-    response['txids'] = [{'txid': txid.decode('utf-8').strip('\n')}]
+    response['txids'] = [{'txid': txid}]
+    unwatch_settled_wallet(address)
 
     # Clean transaction files
     try:
         os.remove(signing_key_path)
-        os.remove(signed_path)
         os.remove(draft_path)
     except FileNotFoundError as e:
         print(f'reclaim_finalize_handler: {e.errno}')
@@ -1202,17 +1132,17 @@ async def confirm_outgoing_transaction_handler():
     response = {'status': 'failed'}
 
     # Sort transaction history with descending order by block_height
-    transaction_list = get_transaction_history(address)
+    transaction_list = await get_transaction_history(address)
     transaction_list = sorted(transaction_list, key=(lambda x: int(x['block_height'])), reverse=True)
 
     # Find outgoing transaction which matches stake_list
     for transaction in transaction_list:
-        tx = get_transaction_content(transaction['tx_hash'])
+        tx = await get_transaction_content(transaction['tx_hash'])
         if tx['inputs'][0]['address'] == address:
             check = True
             for receive in tx['outputs']:
                 receive_address = receive['address']
-                receive_stake_address = get_stake_address(receive_address)
+                receive_stake_address = await get_stake_address(receive_address)
                 if receive_stake_address not in stake_list:
                     check = False
                     break
@@ -1229,7 +1159,7 @@ async def confirm_outgoing_transaction_handler():
 # Description: check whether there's an outgoing transaction which sends to the addresses in the stake_list
 async def confirm_transaction_handler(txid):
     print(txid)
-    response = get_specific_transaction(txid)
+    response = await get_specific_transaction(txid)
     print(response)
     if 'error' in response:
         response = {'status': 'failed', 'message': 'Not found'}
@@ -1239,26 +1169,37 @@ async def confirm_transaction_handler(txid):
 
 
 @app.route('/v0/server/status', methods=['GET'])
+@prioritized(PRIORITY_POLL)
 async def server_status_handler(network=NETWORK):
-    # Query tip
-    tip_parameters = [CARDANO_CLI_PATH, 'query', 'tip']
-    if network == 'mainnet':
-        tip_parameters += ['--mainnet']
+    # Health check answered from the tip watcher's last poll, never waits on the node while the watcher runs
+    if not tip_watcher.running:
+        await tip_watcher.poll()
+    snapshot = tip_watcher.status()
+    response = {'status': snapshot['status'], 'age_seconds': snapshot['age_seconds']}
+    if snapshot['status'] == 'online':
+        return json.dumps(response), 200, {'Content-Type': 'application/json'}
     else:
-        tip_parameters += ['--testnet-magic', TESTNET_MAGIC]
-
-    check = False
-    # Set status
-
-    output = run_command(tip_parameters, my_env)
-    if output is not subprocess.CalledProcessError:
-        output = json.loads(output.decode('utf-8'))
-        if float(output["syncProgress"]) == 100:
-            check = True
-    if check is True:
-        return json.dumps({'status': 'online'}), 200, {'Content-Type': 'application/json'}
-    else:
-        return json.dumps({'status': 'offline'}), 503, {'Content-Type': 'application/json'}
+        return json.dumps(response), 503, {'Content-Type': 'application/json'}
+
+
+@app.route('/v0/server/metrics', methods=['GET'])
+# Queue depth and wait time of the cardano-cli scheduler, shared utxo queries, node socket pool, wallet pool,
+# tip watcher, utxo cache, chain follower, trade watchlist, mempool watcher, Blockfrost client, transaction cache and
+# stake address cache
+async def server_metrics_handler():
+    response = {'scheduler': scheduler.stats(), 'query_utxos_single_flight': query_flight.stats(),
+                'node_pool': node_pool.stats(),
+                'wallet_pool': wallet_pool.stats(),
+                'tip_watcher': tip_watcher.stats(),
+                'utxo_cache': utxo_cache.stats(),
+                'chain_follower': chain_follower.stats(),
+                'trade_watchlist': trade_watchlist.stats(),
+                'mempool_watcher': mempool_watcher.stats(),
+                'blockfrost': blockfrost_client.stats(),
+                'tx_cache': tx_cache.stats(),
+                'stake_address_cache': {'entries': len(blockfrost_stake_addresses),
+                                        'max_entries': STAKE_ADDRESS_CACHE_SIZE}}
+    return json.dumps(response), {'Content-Type': 'application/json'}
 
 
 @app.route('/v0/transactions/body', methods=['POST'])
@@ -1284,7 +1225,7 @@ async def transaction_body_handler():
         }
     ]
 
-    response = get_transaction_body(sender_stake_address, package)
+    response = await get_transaction_body(sender_stake_address, package)
     if 'error' not in response:
         for out in response['output']:
             for a in out['amount']:
@@ -1301,62 +1242,37 @@ async def get_transaction_id_handler():
     data = await request.get_json()
     cbor_hex = data['cborHex']
 
-    # Write signing key to file
-    if not os.path.isdir('request'):
-        os.makedirs('request')
-
-    _id = get_unique_id()
-    signed_path = f'request/tx_{_id}.signed'
     text = {
         "type": "Tx AlonzoEra",
         "description": "",
         "cborHex": cbor_hex
     }
 
-    with open(signed_path, 'w') as file:
-        json.dump(text, file)
-
-    txid = get_txid(signed_path)
+    txid = get_tx_id(text)
     response = {'txid': txid}
 
-    # Clean transaction files
-    try:
-        os.remove(signed_path)
-    except FileNotFoundError as e:
-        print(f'submit_transaction_handler: {e.errno}')
-
     return json.dumps(response), {'Content-Type': 'application/json'}
 
 
 @app.route('/v0/transactions/submit', methods=['POST'])
+@prioritized(PRIORITY_SETTLEMENT)
 async def submit_transaction_handler():
     # Get data
     data = await request.get_json()
     cbor_hex = data['cborHex']
 
-    # Write signing key to file
-    if not os.path.isdir('request'):
-        os.makedirs('request')
-
-    _id = get_unique_id()
-    signed_path = f'request/tx_{_id}.signed'
     text = {
         "type": "Tx AlonzoEra",
         "description": "",
         "cborHex": cbor_hex
     }
 
-    with open(signed_path, 'w') as file:
-        json.dump(text, file)
-
-    txid = submit_transaction(signed_path)
-    response = {"txid": txid}
-
-    # Clean transaction files
     try:
-        os.remove(signed_path)
-    except FileNotFoundError as e:
-        print(f'submit_transaction_handler: {e.errno}')
+        txid = await submit_transaction(None, envelope=text)
+        response = {"txid": txid}
+    except TxSubmitRejected as e:
+        # Structured ApplyTxErr from the node
+        response = {'error': 'transaction rejected', 'era': e.era, 'reason': e.reason}
 
     return json.dumps(response), {'Content-Type': 'application/json'}
 
@@ -0,0 +1,243 @@
+import asyncio
+import contextvars
+import functools
+import heapq
+import itertools
+import time
+
+from enums import *
+
+"""
+cardano-cli scheduler
+"""
+
+# Lower value runs first
+PRIORITY_SETTLEMENT = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_POLL = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_SETTLEMENT: 'settlement',
+    PRIORITY_DEFAULT: 'default',
+    PRIORITY_POLL: 'poll',
+}
+
+_command_priority = contextvars.ContextVar('command_priority', default=PRIORITY_DEFAULT)
+
+
+def get_command_priority():
+    return _command_priority.get()
+
+
+def prioritized(priority):
+    """
+    Run every cardano-cli call made while handling the decorated coroutine with the given priority
+    :param priority: PRIORITY_SETTLEMENT, PRIORITY_DEFAULT or PRIORITY_POLL
+    :return: decorator
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            token = _command_priority.set(priority)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                _command_priority.reset(token)
+
+        return wrapper
+
+    return decorator
+
+
+def command_class(command):
+    """
+    Classify a cardano-cli argv into the lane it is scheduled on
+    :param command: argv list, command[0] is the cardano-cli path
+    :return: 'query', 'build', 'submit' or 'local'
+    """
+    args = command[1:3]
+    if len(args) == 0:
+        return 'local'
+    if args[0] == 'query':
+        return 'query'
+    if args[0] == 'transaction' and len(args) > 1:
+        if args[1] == 'submit':
+            return 'submit'
+        if args[1] in ('build', 'build-raw'):
+            return 'build'
+    return 'local'
+
+
+class Lane:
+    """
+    Counting semaphore whose waiters are woken by priority, then in arrival order
+    """
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self.active = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self.waiting = 0
+        self.max_waiting = 0
+        self.acquired = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.acquired_by_priority = {name: 0 for name in PRIORITY_NAMES.values()}
+
+    async def acquire(self, priority):
+        start = time.monotonic()
+        if self.active < self.limit and self.waiting == 0:
+            self.active += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # The slot was handed over right before the cancellation
+                    self.release()
+                else:
+                    self.waiting -= 1
+                raise
+        wait = time.monotonic() - start
+        self.acquired += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        key = PRIORITY_NAMES.get(priority, str(priority))
+        self.acquired_by_priority[key] = self.acquired_by_priority.get(key, 0) + 1
+        return wait
+
+    def release(self):
+        # Hand the slot straight to the best waiter so a newcomer can't overtake it
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.waiting -= 1
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self):
+        return {
+            'limit': self.limit,
+            'active': self.active,
+            'queue_depth': self.waiting,
+            'max_queue_depth': self.max_waiting,
+            'acquired': self.acquired,
+            'acquired_by_priority': dict(self.acquired_by_priority),
+            'avg_wait_ms': round(self.total_wait / self.acquired * 1000, 3) if self.acquired else 0.0,
+            'max_wait_ms': round(self.max_wait * 1000, 3),
+        }
+
+
+class CommandScheduler:
+    """
+    Bounds concurrent cardano-cli processes per command class and in total
+    """
+
+    def __init__(self, limits, total_limit):
+        self.lanes = {name: Lane(name, limit) for name, limit in limits.items()}
+        self.total = Lane('total', total_limit)
+
+    async def acquire(self, command, priority=None):
+        if priority is None:
+            priority = get_command_priority()
+        lane = self.lanes[command_class(command)]
+        await lane.acquire(priority)
+        try:
+            await self.total.acquire(priority)
+        except asyncio.CancelledError:
+            lane.release()
+            raise
+        return lane
+
+    def release(self, lane):
+        self.total.release()
+        lane.release()
+
+    def slot(self, command, priority=None):
+        return _Slot(self, command, priority)
+
+    def stats(self):
+        stats = {name: lane.stats() for name, lane in self.lanes.items()}
+        stats['total'] = self.total.stats()
+        return stats
+
+
+class _Slot:
+    def __init__(self, scheduler, command, priority):
+        self._scheduler = scheduler
+        self._command = command
+        self._priority = priority
+        self._lane = None
+
+    async def __aenter__(self):
+        self._lane = await self._scheduler.acquire(self._command, self._priority)
+        return self._lane
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._scheduler.release(self._lane)
+        return False
+
+
+scheduler = CommandScheduler({
+    'query': SCHEDULER_QUERY_LIMIT,
+    'build': SCHEDULER_BUILD_LIMIT,
+    'submit': SCHEDULER_SUBMIT_LIMIT,
+    'local': SCHEDULER_LOCAL_LIMIT,
+}, SCHEDULER_TOTAL_LIMIT)
+
+
+class SingleFlight:
+    """
+    Share one in-flight call between concurrent callers asking for the same key
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.started = 0
+        self.shared = 0
+
+    async def do(self, key, func):
+        """
+        Await func() unless an identical call is already running, in which case await that one
+        :param key: hashable key identifying the call, e.g. the command argv as a tuple
+        :param func: coroutine function without arguments
+        :return: result of func()
+        """
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func())
+            self._calls[key] = future
+            future.add_done_callback(functools.partial(self._forget, key))
+            self.started += 1
+        else:
+            self.shared += 1
+        # Shield so one caller being cancelled doesn't cancel the call for the others
+        return await asyncio.shield(future)
+
+    def _forget(self, key, future):
+        if self._calls.get(key) is future:
+            del self._calls[key]
+
+    def stats(self):
+        return {'in_flight': len(self._calls), 'started': self.started, 'shared': self.shared}
+
+
+async def cancel_task(task):
+    """
+    Cancel a background task and wait until it has ended
+    """
+    # asyncio.wait_for can swallow a cancellation that arrives together with the result it waits for (bpo-42130),
+    # the node pool's timeouts would then keep a loop running, so the task is cancelled until it ends
+    while not task.done():
+        task.cancel()
+        await asyncio.wait([task], timeout=0.1)
+    if not task.cancelled():
+        task.exception()
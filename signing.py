@@ -0,0 +1,175 @@
+import hashlib
+import json
+
+import nacl.bindings
+import nacl.signing
+
+import cbor
+from cbor import CBORRaw
+
+"""
+In-process `cardano-cli transaction sign` and `cardano-cli transaction txid`
+"""
+
+
+class UnsupportedTransaction(ValueError):
+    # The transaction needs witnesses this module doesn't build (scripts, datums, redeemers)
+    pass
+
+
+def blake2b_224(data):
+    return hashlib.blake2b(data, digest_size=28).digest()
+
+
+def blake2b_256(data):
+    return hashlib.blake2b(data, digest_size=32).digest()
+
+
+class SigningKey:
+    """
+    Normal (32 byte seed) or extended (BIP32-Ed25519) signing key as written by cardano-cli, signing through libsodium
+    """
+
+    def __init__(self, secret):
+        if len(secret) == 32:
+            self.extended = False
+            self._key = nacl.signing.SigningKey(secret)
+            self.verification_key = self._key.verify_key.encode()
+        elif len(secret) in (64, 128):
+            # xprv (kL || kR), followed by the public key and the chain code in cardano-cli files
+            self.extended = True
+            self._key = None
+            self.verification_key = secret[64:96] if len(secret) == 128 else \
+                nacl.bindings.crypto_scalarmult_ed25519_base_noclamp(secret[:32])
+            secret = secret[:64]
+        else:
+            raise ValueError(f'signing key: unexpected key length {len(secret)}')
+        self.secret = secret
+
+    def sign(self, message):
+        if self.extended:
+            return self._sign_extended(message)
+        return self._key.sign(message).signature
+
+    def _sign_extended(self, message):
+        # RFC 8032 signing with kL used as the scalar as is (already clamped at derivation) and kR as the nonce
+        # prefix. libsodium's no-clamp scalar operations keep every step constant time
+        scalar = nacl.bindings.crypto_core_ed25519_scalar_reduce(self.secret[:32] + bytes(32))
+        r = nacl.bindings.crypto_core_ed25519_scalar_reduce(hashlib.sha512(self.secret[32:] + message).digest())
+        encoded_r = nacl.bindings.crypto_scalarmult_ed25519_base_noclamp(r)
+        h = nacl.bindings.crypto_core_ed25519_scalar_reduce(
+            hashlib.sha512(encoded_r + self.verification_key + message).digest())
+        s = nacl.bindings.crypto_core_ed25519_scalar_add(r, nacl.bindings.crypto_core_ed25519_scalar_mul(h, scalar))
+        return encoded_r + s
+
+    def key_hash(self):
+        return blake2b_224(self.verification_key)
+
+
+def load_signing_key(key_json):
+    """
+    Signing key from the text envelope JSON {'type': ..., 'cborHex': ...}
+    :param key_json: dict or JSON string
+    :return: SigningKey
+    """
+    if isinstance(key_json, str):
+        key_json = json.loads(key_json)
+    secret = cbor.loads(bytes.fromhex(key_json['cborHex']))
+    if not isinstance(secret, bytes):
+        raise ValueError('signing key: cborHex is not a byte string')
+    return SigningKey(secret)
+
+
+def read_signing_key(signing_key_path):
+    with open(signing_key_path, 'r') as file:
+        return load_signing_key(json.load(file))
+
+
+def generate_signing_key():
+    # Same as `cardano-cli address key-gen`, a random 32 byte seed, generated and derived by libsodium
+    return SigningKey(bytes(nacl.signing.SigningKey.generate()))
+
+
+def key_envelope(key_type, description, key):
+    # Text envelope cardano-cli writes for a key, e.g. ('PaymentSigningKeyShelley_ed25519', 'Payment Signing Key')
+    return {'type': key_type, 'description': description, 'cborHex': cbor.dumps(key).hex()}
+
+
+def tx_id(tx):
+    """
+    Transaction id, the blake2b-256 of the body exactly as it is encoded
+    :param tx: CBOR of a body envelope, an unsigned or signed transaction, or a bare body map
+    :return: hex string
+    """
+    if tx[0] >> 5 == 5:
+        return blake2b_256(tx).hex()
+    spans, _ = cbor.container_spans(tx)
+    start, end = spans[0]
+    return blake2b_256(tx[start:end]).hex()
+
+
+def envelope_tx_id(envelope):
+    return tx_id(bytes.fromhex(envelope['cborHex']))
+
+
+def _era(envelope_type):
+    # 'TxBodyAlonzo', 'Unwitnessed Tx AlonzoEra' and 'Tx AlonzoEra' all give 'Alonzo'
+    if envelope_type.startswith('TxBody'):
+        return envelope_type[len('TxBody'):]
+    if envelope_type.endswith('Era'):
+        return envelope_type.split(' ')[-1][:-len('Era')]
+    raise UnsupportedTransaction(f'unsupported transaction envelope {envelope_type}')
+
+
+def _raw(data, span):
+    return CBORRaw(data[span[0]:span[1]])
+
+
+def sign_tx(envelope, signing_keys):
+    """
+    Witness a transaction with vkey signatures, byte for byte what `cardano-cli transaction sign` writes
+    :param envelope: text envelope of a body ('TxBodyAlonzo') or of an unwitnessed or partially signed transaction
+    :param signing_keys: list of SigningKey
+    :return: signed text envelope {'type': 'Tx AlonzoEra', 'description': '', 'cborHex': ...}
+    """
+    era = _era(envelope['type'])
+    data = bytes.fromhex(envelope['cborHex'])
+    spans, _ = cbor.container_spans(data)
+    witnesses = {}
+    if envelope['type'].startswith('TxBody'):
+        # [body, scripts, script data, auxiliary data, validity] from Alonzo on, [body, scripts, auxiliary data] before
+        if cbor.loads(data[spans[1][0]:spans[1][1]]) != []:
+            raise UnsupportedTransaction('sign_tx: transaction body carries scripts')
+        if len(spans) == 5:
+            if data[spans[2][0]:spans[2][1]] != b'\xf6':
+                raise UnsupportedTransaction('sign_tx: transaction body carries script data')
+            validity, auxiliary = spans[4], spans[3]
+        elif len(spans) == 3:
+            validity, auxiliary = None, spans[2]
+        else:
+            raise UnsupportedTransaction(f'sign_tx: unexpected transaction body layout ({len(spans)} items)')
+    else:
+        # [body, witness set, is valid, auxiliary data] from Alonzo on, [body, witness set, auxiliary data] before
+        witnesses = cbor.loads(data[spans[1][0]:spans[1][1]])
+        if set(witnesses) - {0}:
+            raise UnsupportedTransaction('sign_tx: transaction carries script witnesses')
+        if len(spans) == 4:
+            validity, auxiliary = spans[2], spans[3]
+        elif len(spans) == 3:
+            validity, auxiliary = None, spans[2]
+        else:
+            raise UnsupportedTransaction(f'sign_tx: unexpected transaction layout ({len(spans)} items)')
+
+    body = data[spans[0][0]:spans[0][1]]
+    body_hash = blake2b_256(body)
+    # The ledger keeps vkey witnesses in a set ordered by key hash
+    vkey_witnesses = {blake2b_224(vkey): [vkey, signature] for vkey, signature in witnesses.get(0, [])}
+    for signing_key in signing_keys:
+        vkey_witnesses[signing_key.key_hash()] = [signing_key.verification_key, signing_key.sign(body_hash)]
+
+    witness_set = {0: [vkey_witnesses[key_hash] for key_hash in sorted(vkey_witnesses)]} if vkey_witnesses else {}
+    tx = [CBORRaw(body), witness_set]
+    if validity is not None:
+        tx.append(_raw(data, validity))
+    tx.append(_raw(data, auxiliary))
+    return {'type': f'Tx {era}Era', 'description': '', 'cborHex': cbor.dumps(tx).hex()}
@@ -0,0 +1,391 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sys
+
+import bech32
+import cbor
+from cbor import CBORRaw
+from ouroboros import *
+
+"""
+Stand-in cardano-node speaking the node-to-client mini-protocols over a unix socket.
+It serves an in-memory ledger so the native clients can be exercised without a node.
+
+Usage: python standin_node.py <socket path> [address ...]
+"""
+
+logger = logging.getLogger("default")
+
+
+class StandInLedger:
+    def __init__(self, era=5, epoch=300):
+        self.era = era
+        self.epoch = epoch
+        # UTCTime of the mainnet system start
+        self.system_start = [2017, 266, 78291000000000000]
+        self.slot = 0
+        self.block_no = 0
+        self.block_hash = bytes(32)
+        # {(tx hash bytes, index): tx_out}
+        self.utxos = {}
+        # Accepted transactions waiting for the next block: [(tx id, tx, body CBOR)]
+        self.mempool = []
+        # Blocks rolled forward: [{'slot', 'block_no', 'hash', 'cbor' (of [era tag, block]), 'spent', 'created'}]
+        self.blocks = []
+        # Called without arguments after every new block, rollback or mempool change
+        self.listeners = []
+        self.pparams = [44, 155381, 90112, 16384, 1100, 2000000, 500000000, 18, 500,
+                        CBORTag(30, [3, 10]), CBORTag(30, [3, 1000]), CBORTag(30, [1, 5]),
+                        [7, 0], 340000000, 4310, {0: [0] * 166}, [CBORTag(30, [577, 10000]),
+                                                                  CBORTag(30, [721, 10000000])],
+                        [14000000, 10000000000], [62000000, 20000000000], 5000, 150, 3]
+
+    def add_utxo(self, address, lovelace, assets=None, tx_hash=None, index=0):
+        """
+        Add an output to the ledger
+        :param address: bech32 address
+        :param lovelace: int
+        :param assets: {policy hex: {asset name hex: quantity}}
+        :return: (tx hash bytes, index)
+        """
+        if tx_hash is None:
+            tx_hash = os.urandom(32)
+        value = lovelace
+        if assets:
+            value = [lovelace, {bytes.fromhex(policy): {bytes.fromhex(name): quantity
+                                                       for name, quantity in names.items()}
+                                for policy, names in assets.items()}]
+        self.utxos[(tx_hash, index)] = {0: bech32.decode(address)[1], 1: value}
+        return tx_hash, index
+
+    def pay(self, address, lovelace, assets=None, inputs=()):
+        """
+        Queue a transaction paying an address, it lands in the next block
+        :param inputs: [(tx hash bytes, index)] it spends, none by default
+        :return: (tx hash bytes, index)
+        """
+        tx_out = {0: bech32.decode(address)[1], 1: lovelace}
+        if assets:
+            tx_out[1] = [lovelace, {bytes.fromhex(policy): {bytes.fromhex(name): quantity
+                                                           for name, quantity in names.items()}
+                                    for policy, names in assets.items()}]
+        body = cbor.dumps({0: [list(tx_in) for tx_in in inputs], 1: [tx_out], 2: 0})
+        tx_id = hashlib.blake2b(body, digest_size=32).digest()
+        self.mempool.append((tx_id, [cbor.loads(body), {}, True, None], body))
+        self._changed()
+        return tx_id, 0
+
+    def spent_in_mempool(self):
+        return {tuple(tx_in) for _, tx, _ in self.mempool for tx_in in tx[0][0]}
+
+    def submit(self, tx_bytes):
+        """
+        Validate a signed transaction against the ledger and the mempool
+        :param tx_bytes: signed transaction CBOR
+        :return: None when accepted, otherwise the rejection reason
+        """
+        try:
+            tx = cbor.loads(tx_bytes)
+            body = tx[0]
+            inputs = [tuple(tx_in) for tx_in in body[0]]
+        except (cbor.CBORDecodeError, TypeError, KeyError, IndexError) as e:
+            return [0, f'cannot decode transaction: {e}']
+        spent = self.spent_in_mempool()
+        missing = [list(tx_in) for tx_in in inputs if tx_in not in self.utxos or tx_in in spent]
+        if missing:
+            # Shaped like BadInputsUTxO inside a Shelley ledger predicate failure
+            return [[0, [1, [0, missing]]]]
+        spans, _ = cbor.container_spans(tx_bytes)
+        body_start, body_end = spans[0]
+        body = tx_bytes[body_start:body_end]
+        tx_id = hashlib.blake2b(body, digest_size=32).digest()
+        self.mempool.append((tx_id, tx, body))
+        self._changed()
+        return None
+
+    def roll_forward(self, slots=20):
+        # Settle the mempool into a new block
+        spent = {}
+        created = []
+        for tx_id, tx, _ in self.mempool:
+            for tx_in in tx[0][0]:
+                tx_in = tuple(tx_in)
+                if tx_in in self.utxos:
+                    spent[tx_in] = self.utxos.pop(tx_in)
+            for index, tx_out in enumerate(tx[0][1]):
+                self.utxos[(tx_id, index)] = tx_out
+                created.append((tx_id, index))
+        self.slot += slots
+        self.block_no += 1
+        header_body = [self.block_no, self.slot, self.block_hash if len(self.blocks) else None, bytes(32), bytes(32),
+                       [b'', b''], 0, bytes(32), [bytes(32), 0, 0, bytes(64)], [8, 0]]
+        header = cbor.dumps([header_body, bytes(64)])
+        self.block_hash = hashlib.blake2b(header, digest_size=32).digest()
+        block = [CBORRaw(header), [CBORRaw(body) for _, _, body in self.mempool],
+                 [tx[1] for _, tx, _ in self.mempool], {}, []]
+        self.blocks.append({'slot': self.slot, 'block_no': self.block_no, 'hash': self.block_hash,
+                            'cbor': cbor.dumps([self.era + 1, block]), 'spent': spent, 'created': created})
+        self.mempool = []
+        self._changed()
+
+    def rollback(self, blocks=1):
+        # Drop the last blocks and their transactions, as a fork switch would
+        for _ in range(min(blocks, len(self.blocks))):
+            block = self.blocks.pop()
+            for tx_in in block['created']:
+                self.utxos.pop(tx_in, None)
+            self.utxos.update(block['spent'])
+        if self.blocks:
+            self.slot, self.block_no, self.block_hash = (self.blocks[-1]['slot'], self.blocks[-1]['block_no'],
+                                                         self.blocks[-1]['hash'])
+        else:
+            self.block_no, self.block_hash = 0, bytes(32)
+        self._changed()
+
+    def _changed(self):
+        for listener in self.listeners:
+            listener()
+
+    def chain_tip(self):
+        # Tip as chain-sync sends it, [point, block number]
+        if not self.blocks:
+            return [[], 0]
+        return [[self.slot, self.block_hash], self.block_no]
+
+    def tip(self):
+        return [self.slot, self.block_hash]
+
+    def mempool_txs(self):
+        # Signed transactions of the mempool as LocalTxMonitor hands them out, bodies as they were submitted
+        return [(tx_id, cbor.dumps([CBORRaw(body)] + list(tx[1:]))) for tx_id, tx, body in self.mempool]
+
+
+class StandInNode:
+    def __init__(self, socket_path, ledger=None, magic=NETWORK_MAGIC):
+        self.socket_path = socket_path
+        self.ledger = ledger if ledger is not None else StandInLedger()
+        self.magic = magic
+        self.connections = 0
+        self._server = None
+        self._writers = set()
+        # Chain-sync clients waiting for the next block
+        self._waiting = []
+        # Tx monitor clients waiting for the mempool to change
+        self._monitor_waiting = []
+        self.ledger.listeners.append(self._chain_changed)
+
+    async def start(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self._server = await asyncio.start_unix_server(self._serve, path=self.socket_path)
+        return self
+
+    async def close(self):
+        self._server.close()
+        for writer in list(self._writers):
+            writer.close()
+        await self._server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        self._writers.add(writer)
+        connection = MuxConnection(reader, writer, responder=True)
+        # Per connection protocol state
+        session = {'connection': connection}
+        try:
+            while True:
+                protocol, message = await connection.receive_any()
+                handler = getattr(self, f'_protocol_{protocol}', None)
+                if handler is None:
+                    logger.error('stand-in node: unsupported mini-protocol %s', protocol)
+                    break
+                reply = handler(message, session)
+                if reply is not None:
+                    await connection.send(protocol, reply)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if session in self._waiting:
+                self._waiting.remove(session)
+            if session in self._monitor_waiting:
+                self._monitor_waiting.remove(session)
+            self._writers.discard(writer)
+            writer.close()
+
+    def _protocol_0(self, message, session):
+        # Handshake: accept the highest proposed version
+        versions = message[1]
+        version = max(versions)
+        params = versions[version]
+        magic = params[0] if isinstance(params, list) else params
+        if magic != self.magic:
+            return [2, [1, version, f'network magic mismatch {magic} != {self.magic}']]
+        return [1, version, params]
+
+    def _protocol_5(self, message, session):
+        # ChainSync, serving the ledger's blocks
+        tag = message[0]
+        blocks = self.ledger.blocks
+        if tag == 4:
+            for point in message[1]:
+                if point == []:
+                    length = 0
+                else:
+                    length = next((i + 1 for i, block in enumerate(blocks)
+                                   if block['slot'] == point[0] and block['hash'] == point[1]), None)
+                    if length is None:
+                        continue
+                session['sent'] = [block['hash'] for block in blocks[:length]]
+                # The first reply after an intersection rolls back to it
+                session['rollback'] = True
+                return [5, point, self.ledger.chain_tip()]
+            return [6, self.ledger.chain_tip()]
+        if tag == 0:
+            reply = self._chain_next(session)
+            if reply is None:
+                self._waiting.append(session)
+                return [1]
+            return reply
+        return None
+
+    def _chain_next(self, session):
+        blocks = self.ledger.blocks
+        sent = session.setdefault('sent', [])
+        common = len(sent)
+        if common > len(blocks) or (common and blocks[common - 1]['hash'] != sent[-1]):
+            # The blocks we sent were rolled back
+            common = 0
+            while common < min(len(sent), len(blocks)) and blocks[common]['hash'] == sent[common]:
+                common += 1
+            del sent[common:]
+            session['rollback'] = True
+        if session.pop('rollback', False):
+            point = [blocks[common - 1]['slot'], blocks[common - 1]['hash']] if common else []
+            return [3, point, self.ledger.chain_tip()]
+        if common < len(blocks):
+            block = blocks[common]
+            sent.append(block['hash'])
+            return [2, CBORTag(24, block['cbor']), self.ledger.chain_tip()]
+        return None
+
+    def _chain_changed(self):
+        for session in list(self._waiting):
+            reply = self._chain_next(session)
+            if reply is not None:
+                self._waiting.remove(session)
+                asyncio.ensure_future(self._push(session['connection'], PROTOCOL_CHAIN_SYNC, reply))
+        for session in list(self._monitor_waiting):
+            reply = self._monitor_acquire(session)
+            if reply is not None:
+                self._monitor_waiting.remove(session)
+                asyncio.ensure_future(self._push(session['connection'], PROTOCOL_TX_MONITOR, reply))
+
+    @staticmethod
+    async def _push(connection, protocol, reply):
+        try:
+            await connection.send(protocol, reply)
+        except ConnectionError:
+            # The client went away while waiting
+            pass
+
+    def _protocol_6(self, message, session):
+        # LocalTxSubmission
+        tag = message[0]
+        if tag == 0:
+            era, wrapped = message[1]
+            reason = self.ledger.submit(wrapped.value)
+            if reason is None:
+                return [1]
+            return [2, reason]
+        return None
+
+    def _protocol_9(self, message, session):
+        # LocalTxMonitor, snapshots of the ledger's mempool
+        tag = message[0]
+        if tag == 1:
+            reply = self._monitor_acquire(session)
+            if reply is None:
+                self._monitor_waiting.append(session)
+            return reply
+        if tag == 3:
+            session.pop('monitor', None)
+            return None
+        snapshot = session.get('monitor')
+        if tag == 5:
+            if not snapshot['txs']:
+                return [6]
+            _, tx = snapshot['txs'].pop(0)
+            return [6, [self.ledger.era, CBORTag(24, tx)]]
+        if tag == 7:
+            return [8, message[1].hex() in snapshot['ids']]
+        if tag == 9:
+            size = sum(len(tx) for _, tx in snapshot['all'])
+            return [10, [2 * 90112, size, len(snapshot['all'])]]
+        return None
+
+    def _monitor_acquire(self, session):
+        # A fresh snapshot, None while the one held is still the mempool
+        txs = self.ledger.mempool_txs()
+        ids = {tx_id.hex() for tx_id, _ in txs}
+        held = session.get('monitor')
+        if held is not None and held['ids'] == ids:
+            return None
+        session['monitor'] = {'ids': ids, 'all': txs, 'txs': list(txs)}
+        return [2, self.ledger.slot]
+
+    def _protocol_7(self, message, session):
+        # LocalStateQuery
+        tag = message[0]
+        if tag in (0, 8, 10):
+            return [1]
+        if tag == 3:
+            return [4, self.answer(message[1])]
+        if tag in (5, 7):
+            return None
+        return [2, 0]
+
+    def answer(self, query):
+        ledger = self.ledger
+        if query == QUERY_SYSTEM_START:
+            return ledger.system_start
+        if query == QUERY_CHAIN_BLOCK_NO:
+            return [1, ledger.block_no]
+        if query == QUERY_CHAIN_POINT:
+            return ledger.tip() if ledger.block_no else []
+        if query == QUERY_CURRENT_ERA:
+            return ledger.era
+        era, era_query = query[1][1]
+        if era != ledger.era:
+            return [ERA_NAMES[era], ERA_NAMES[ledger.era]]
+        if era_query == SHELLEY_QUERY_EPOCH_NO:
+            return [ledger.epoch]
+        if era_query == SHELLEY_QUERY_CURRENT_PPARAMS:
+            return [ledger.pparams]
+        if era_query[0] == 6:
+            addresses = set(era_query[1])
+            return [{key: tx_out for key, tx_out in ledger.utxos.items() if tx_out[0] in addresses}]
+        if era_query[0] == 15:
+            txins = [tuple(txin) for txin in era_query[1]]
+            return [{txin: ledger.utxos[txin] for txin in txins if txin in ledger.utxos}]
+        raise NodeProtocolError(f'stand-in node: unsupported query {query}')
+
+
+async def main(socket_path, addresses):
+    ledger = StandInLedger()
+    for address in addresses:
+        ledger.add_utxo(address, 5000000)
+    ledger.roll_forward()
+    node = await StandInNode(socket_path, ledger).start()
+    print(f'stand-in node listening on {socket_path}')
+    try:
+        while True:
+            await asyncio.sleep(20)
+            ledger.roll_forward()
+    finally:
+        await node.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(sys.argv[1], sys.argv[2:]))
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The modules live at the top of the repository and import each other by name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Read by enums when rest-api is imported: no background wallet generation, tip polling or cache file in tests
+os.environ.setdefault('WALLET_POOL_SIZE', '0')
+os.environ.setdefault('TIP_POLL_INTERVAL', '0')
+os.environ.setdefault('TX_CACHE_PATH', 'memory')
@@ -0,0 +1,53 @@
+import pytest
+
+import bech32
+from address import *
+from signing import blake2b_224
+
+# Test vectors of CIP-19
+PAYMENT_KEY = 'addr_vk1w0l2sr2zgfm26ztc6nl9xy8ghsk5sh6ldwemlpmp9xylzy4dtf7st80zhd'
+STAKE_KEY = 'stake_vk1px4j0r2fk7ux5p23shz8f3y5y2qam7s954rgf3lg5merqcj6aetsft99wu'
+PAYMENT_KEY_HASH = bytes.fromhex('9493315cd92eb5d8c4304e67b7e16ae36d61d34502694657811a2c8e')
+STAKE_KEY_HASH = bytes.fromhex('337b62cfff6403a06a3acbc34f8c46003c69fe79a3628cefa9c47251')
+SCRIPT_HASH = bytes.fromhex('c37b1b5dc0669f1d3c61a6fddb2e8fde96be87b881c60bce8e8d542f')
+
+BASE_ADDRESS = 'addr1qx2fxv2umyhttkxyxp8x0dlpdt3k6cwng5pxj3jhsydzer3n0d3vllmyqwsx5wktcd8cc3sq835lu7drv2xwl2wywfgse35a3x'
+BASE_ADDRESS_TESTNET = ('addr_test1qz2fxv2umyhttkxyxp8x0dlpdt3k6cwng5pxj3jhsydzer3n0d3vllmyqwsx5wktcd8cc3sq835lu7drv2xw'
+                        'l2wywfgs68faae')
+SCRIPT_STAKE_ADDRESS = ('addr1yx2fxv2umyhttkxyxp8x0dlpdt3k6cwng5pxj3jhsydzerkr0vd4msrxnuwnccdxlhdjar77j6lg0wypcc9uar5d2'
+                        'shs2z78ve')
+STAKE_ADDRESS = 'stake1uyehkck0lajq8gr28t9uxnuvgcqrc6070x3k9r8048z8y5gh6ffgw'
+SCRIPT_STAKE = 'stake178phkx6acpnf78fuvxn0mkew3l0fd058hzquvz7w36x4gtcccycj5'
+
+
+def test_key_hashes():
+    assert blake2b_224(bech32.decode(PAYMENT_KEY)[1]) == PAYMENT_KEY_HASH
+    assert blake2b_224(bech32.decode(STAKE_KEY)[1]) == STAKE_KEY_HASH
+
+
+def test_base_address():
+    assert base_address(PAYMENT_KEY_HASH, STAKE_KEY_HASH, 'mainnet') == BASE_ADDRESS
+    assert base_address(PAYMENT_KEY_HASH, STAKE_KEY_HASH, 'testnet') == BASE_ADDRESS_TESTNET
+
+
+def test_parse_base_address():
+    assert parse_address(BASE_ADDRESS) == (0, 1, PAYMENT_KEY_HASH, STAKE_KEY_HASH)
+    assert parse_address(SCRIPT_STAKE_ADDRESS) == (2, 1, PAYMENT_KEY_HASH, SCRIPT_HASH)
+
+
+def test_stake_address():
+    assert stake_address(STAKE_KEY_HASH, 1) == STAKE_ADDRESS
+    assert stake_address(SCRIPT_HASH, 1, script=True) == SCRIPT_STAKE
+    assert base_stake_address(BASE_ADDRESS) == STAKE_ADDRESS
+    assert base_stake_address(SCRIPT_STAKE_ADDRESS) == SCRIPT_STAKE
+
+
+@pytest.mark.parametrize('address', [
+    # Pointer, enterprise and Byron addresses carry no stake credential to derive from
+    'addr1gx2fxv2umyhttkxyxp8x0dlpdt3k6cwng5pxj3jhsydzer5pnz75xxcrzqf96k',
+    'addr1vx2fxv2umyhttkxyxp8x0dlpdt3k6cwng5pxj3jhsydzers66hrl8',
+    'Ae2tdPwUPEZFRbyhz3cpfC2CumGzNkFBN2L42rcUc2yjQpEkxDbkPodpMAi',
+    'not an address',
+])
+def test_no_stake_address(address):
+    assert base_stake_address(address) is None
@@ -0,0 +1,239 @@
+import asyncio
+import importlib.util
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from blockfrost import BlockfrostClient, BlockfrostError, RateLimiter
+from scheduler import PRIORITY_POLL, PRIORITY_SETTLEMENT, prioritized
+
+ENTERPRISE_ADDRESS = 'addr1vx2fxv2umyhttkxyxp8x0dlpdt3k6cwng5pxj3jhsydzers66hrl8'
+
+
+@pytest.fixture
+def blockfrost_server():
+    """
+    Local HTTP server answering like Blockfrost, the first `throttle` calls get 429 with Retry-After
+    """
+    state = {'throttle': 0, 'paths': []}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            state['paths'].append(self.path)
+            if state['throttle']:
+                state['throttle'] -= 1
+                data = json.dumps({'status_code': 429, 'error': 'Project Over Limit'}).encode()
+                self.send_response(429)
+                self.send_header('Retry-After', '0.2')
+            else:
+                data = json.dumps({'path': self.path}).encode()
+                self.send_response(200)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    state['url'] = f'http://127.0.0.1:{server.server_port}/api/v0'
+    yield state
+    server.shutdown()
+
+
+def client_for(server, limiter=None, retries=3):
+    client = BlockfrostClient('mainnet', 'key', 4, 5, limiter=limiter, retries=retries, backoff=0.05)
+    client.base_url = server['url']
+    return client
+
+
+def test_limiter_allows_the_burst_then_the_rate():
+    limiter = RateLimiter(50, 5, 5)
+
+    async def main():
+        for _ in range(15):
+            assert await limiter.acquire(PRIORITY_POLL)
+
+    start = time.monotonic()
+    asyncio.run(main())
+    elapsed = time.monotonic() - start
+    # 5 tokens right away, 10 more at 50 per second
+    assert 0.15 < elapsed < 0.6
+    assert limiter.stats()['throttled'] == 10
+
+
+def test_limiter_serves_settlement_before_polls():
+    limiter = RateLimiter(20, 1, 5)
+    order = []
+
+    async def take(priority, name):
+        await limiter.acquire(priority)
+        order.append(name)
+
+    async def main():
+        limiter.pause(0.2)
+        polls = [asyncio.ensure_future(take(PRIORITY_POLL, 'poll')) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        settlements = [asyncio.ensure_future(take(PRIORITY_SETTLEMENT, 'settlement')) for _ in range(2)]
+        await asyncio.gather(*polls, *settlements)
+
+    asyncio.run(main())
+    assert order == ['settlement', 'settlement', 'poll', 'poll', 'poll']
+
+
+def test_limiter_drops_after_max_wait():
+    limiter = RateLimiter(10, 10, 0.05)
+
+    async def main():
+        limiter.pause(1)
+        return await limiter.acquire(PRIORITY_SETTLEMENT)
+
+    assert not asyncio.run(main())
+    assert limiter.stats()['dropped'] == 1
+    assert limiter.stats()['waiting'] == 0
+
+
+def test_cancelled_waiter_leaves_its_token():
+    limiter = RateLimiter(20, 1, 5)
+
+    async def main():
+        limiter.pause(0.05)
+        cancelled = asyncio.ensure_future(limiter.acquire(PRIORITY_SETTLEMENT))
+        waiting = asyncio.ensure_future(limiter.acquire(PRIORITY_POLL))
+        await asyncio.sleep(0.01)
+        cancelled.cancel()
+        start = time.monotonic()
+        assert await waiting
+        return time.monotonic() - start
+
+    # The poll gets the first token after the pause, not the second one
+    assert asyncio.run(main()) < 0.09
+
+
+def test_retries_429_after_retry_after(blockfrost_server):
+    client = client_for(blockfrost_server, RateLimiter(100, 10, 5))
+    blockfrost_server['throttle'] = 2
+    start = time.monotonic()
+    status_code, data = asyncio.run(client.request('/txs/aa'))
+    assert status_code == 200
+    assert data == {'path': '/api/v0/txs/aa'}
+    assert time.monotonic() - start >= 0.4
+    assert client.stats()['rate_limited'] == 2
+    assert client.stats()['retried'] == 2
+    client.close()
+
+
+def test_gives_up_after_the_retries(blockfrost_server):
+    client = client_for(blockfrost_server, retries=1)
+    blockfrost_server['throttle'] = 5
+    with pytest.raises(BlockfrostError) as error:
+        asyncio.run(client.get('/txs/aa'))
+    assert error.value.status_code == 429
+    assert len(blockfrost_server['paths']) == 2
+    client.close()
+
+
+def test_async_calls_keep_the_priority_of_their_coroutine(blockfrost_server):
+    limiter = RateLimiter(100, 10, 5)
+    client = client_for(blockfrost_server, limiter)
+    priorities = []
+    acquire = limiter.acquire
+
+    async def recording_acquire(priority):
+        priorities.append(priority)
+        return await acquire(priority)
+
+    limiter.acquire = recording_acquire
+
+    @prioritized(PRIORITY_SETTLEMENT)
+    async def settle():
+        return await client.get('/txs/aa')
+
+    asyncio.run(settle())
+    assert priorities == [PRIORITY_SETTLEMENT]
+    client.close()
+
+
+def test_waiting_for_the_limiter_does_not_block_the_event_loop(blockfrost_server):
+    limiter = RateLimiter(100, 10, 5)
+    client = client_for(blockfrost_server, limiter)
+
+    async def main():
+        limiter.pause(0.3)
+        ticks = 0
+        call = asyncio.ensure_future(client.get('/txs/aa'))
+        while not call.done():
+            await asyncio.sleep(0.01)
+            ticks += 1
+        return ticks, call.result()
+
+    ticks, data = asyncio.run(main())
+    assert ticks >= 20
+    assert data == {'path': '/api/v0/txs/aa'}
+    client.close()
+
+
+def test_saturated_polls_do_not_delay_settlement(blockfrost_server):
+    # More polls waiting for a token than the client has threads
+    client = client_for(blockfrost_server, RateLimiter(20, 2, 5))
+
+    async def main():
+        polls = [asyncio.ensure_future(prioritized(PRIORITY_POLL)(client.get)('/polls')) for _ in range(30)]
+        await asyncio.sleep(0.05)
+        start = time.monotonic()
+        await prioritized(PRIORITY_SETTLEMENT)(client.get)('/settlement')
+        elapsed = time.monotonic() - start
+        done = sum(poll.done() for poll in polls)
+        for poll in polls:
+            poll.cancel()
+        await asyncio.gather(*polls, return_exceptions=True)
+        return elapsed, done
+
+    elapsed, done = asyncio.run(main())
+    # The next token, a poll would wait for 28 of them
+    assert elapsed < 0.3
+    assert done < 10
+    client.close()
+
+
+@pytest.fixture(scope='module')
+def rest_api_module():
+    spec = importlib.util.spec_from_file_location('rest_api', os.path.join(os.path.dirname(__file__), '..',
+                                                                           'rest-api.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def rest_api(rest_api_module, monkeypatch):
+    # Every call is dropped by the limiter before it reaches the network
+    limiter = RateLimiter(10, 10, 0.05)
+    limiter.pause(60)
+    monkeypatch.setattr(rest_api_module.blockfrost_client, 'limiter', limiter)
+    return rest_api_module
+
+
+def test_dropped_call_is_an_error_not_a_transaction(rest_api):
+    with pytest.raises(BlockfrostError):
+        asyncio.run(rest_api.get_sender_address('aa' * 32))
+    assert rest_api.blockfrost_client.limiter.stats()['dropped'] == 1
+
+
+def test_dropped_call_answers_503(rest_api):
+    async def get():
+        response = await rest_api.app.test_client().get(f'/v0/addresses/{ENTERPRISE_ADDRESS}/stake_address')
+        return response.status_code, response.headers.get('Retry-After'), json.loads(await response.get_data())
+
+    status_code, retry_after, body = asyncio.run(get())
+    assert status_code == 503
+    assert retry_after == '1'
+    assert body['status'] == 'failed'
+    assert ENTERPRISE_ADDRESS not in rest_api.blockfrost_stake_addresses
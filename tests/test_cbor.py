@@ -0,0 +1,73 @@
+import pytest
+
+import cbor
+from cbor import CBORDecodeEOF, CBORDecodeError, CBORRaw, CBORTag
+
+# Examples of RFC 8949 appendix A that the encoder writes in exactly this form
+ROUND_TRIP = [
+    (0, '00'),
+    (23, '17'),
+    (24, '1818'),
+    (1000000, '1a000f4240'),
+    (18446744073709551615, '1bffffffffffffffff'),
+    (-1, '20'),
+    (-1000, '3903e7'),
+    (b'', '40'),
+    (bytes.fromhex('01020304'), '4401020304'),
+    ('', '60'),
+    ('IETF', '6449455446'),
+    ('ü', '62c3bc'),
+    ([], '80'),
+    ([1, [2, 3], [4, 5]], '8301820203820405'),
+    (list(range(1, 26)), '98190102030405060708090a0b0c0d0e0f101112131415161718181819'),
+    ({1: 2, 3: 4}, 'a201020304'),
+    ({'a': 1, 'b': [2, 3]}, 'a26161016162820203'),
+    (CBORTag(24, bytes.fromhex('6449455446')), 'd818456449455446'),
+    (False, 'f4'),
+    (True, 'f5'),
+    (None, 'f6'),
+    (1.1, 'fb3ff199999999999a'),
+]
+
+
+@pytest.mark.parametrize('value, encoded', ROUND_TRIP)
+def test_round_trip(value, encoded):
+    assert cbor.dumps(value).hex() == encoded
+    assert cbor.loads(bytes.fromhex(encoded)) == value
+
+
+@pytest.mark.parametrize('encoded, value', [
+    # Indefinite lengths and short floats, which the encoder never writes
+    ('9fff', []),
+    ('9f018202039f0405ffff', [1, [2, 3], [4, 5]]),
+    ('5f42010243030405ff', bytes.fromhex('0102030405')),
+    ('7f657374726561646d696e67ff', 'streaming'),
+    ('bf6346756ef563416d7421ff', {'Fun': True, 'Amt': -2}),
+    ('f93c00', 1.0),
+    ('fa47c35000', 100000.0),
+])
+def test_decodes_other_encodings(encoded, value):
+    assert cbor.loads(bytes.fromhex(encoded)) == value
+
+
+def test_array_keys_decode_hashable():
+    # Like the (tx hash, index) keys of a UTxO query result
+    assert cbor.loads(cbor.dumps({CBORRaw(cbor.dumps([b'\x01', 0])): 5})) == {(b'\x01', 0): 5}
+
+
+def test_container_spans_keep_the_original_encoding():
+    data = bytes.fromhex('d8189f1818a10102ff')
+    spans, end = cbor.container_spans(data)
+    assert [data[start:stop].hex() for start, stop in spans] == ['1818', 'a10102']
+    assert end == len(data)
+
+
+@pytest.mark.parametrize('encoded, error', [
+    ('1a000f', CBORDecodeEOF),
+    ('8301020304', CBORDecodeError),
+    ('830102', CBORDecodeEOF),
+    ('1c', CBORDecodeError),
+])
+def test_rejects_malformed_data(encoded, error):
+    with pytest.raises(error):
+        cbor.loads(bytes.fromhex(encoded))
@@ -0,0 +1,62 @@
+import pytest
+
+from address import base_address
+from index_snapshot import *
+
+WALLET = base_address(bytes([1]) * 28, bytes([101]) * 28, 'mainnet')
+BUYER = base_address(bytes([2]) * 28, bytes([102]) * 28, 'mainnet')
+
+POINTS = [(100, 'aa' * 32, 10), (120, 'bb' * 32, None)]
+ADDRESSES = [(WALLET, b'\x01' * 57, 80), (BUYER, b'\x02' * 57, None)]
+UTXOS = [
+    (WALLET, UTxO('cc' * 32, 0, 5000000, {}, None), 100, None),
+    (WALLET, UTxO('dd' * 32, 3, 1500000, {'ee' * 28 + '.4d494c4b': 3, 'ff' * 28: 1}, '11' * 32), 100, 120),
+    (BUYER, UTxO('dd' * 32, 1, 2000000, {'ee' * 28 + '.4d494c4b': 7}, None), 120, None),
+]
+
+
+def read_all(path):
+    with read_snapshot(path) as snapshot:
+        return snapshot.points, list(snapshot.addresses()), list(snapshot.utxos())
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'index.snapshot')
+    write_snapshot(encode_snapshot(POINTS, ADDRESSES, UTXOS), path)
+    assert read_all(path) == (POINTS, ADDRESSES, UTXOS)
+
+
+def test_empty_index(tmp_path):
+    path = str(tmp_path / 'index.snapshot')
+    write_snapshot(encode_snapshot([], [], []), path)
+    assert read_all(path) == ([], [], [])
+
+
+def test_columns_are_read_in_place(tmp_path):
+    path = str(tmp_path / 'index.snapshot')
+    write_snapshot(encode_snapshot(POINTS, ADDRESSES, UTXOS), path)
+    snapshot = read_snapshot(path)
+    assert (snapshot.address_count, snapshot.utxo_count) == (2, 3)
+    # Typed views of the map, no row is decoded before it is iterated
+    assert isinstance(snapshot._lovelace, memoryview)
+    assert list(snapshot._lovelace) == [5000000, 1500000, 2000000]
+    assert next(snapshot.utxos()) == UTXOS[0]
+    snapshot.close()
+    assert snapshot._mapped.closed
+
+
+def test_missing_file(tmp_path):
+    assert read_snapshot(str(tmp_path / 'index.snapshot')) is None
+
+
+@pytest.mark.parametrize('damage', [
+    lambda data: data[:-1],
+    lambda data: data[:20],
+    lambda data: data[:-1] + bytes([data[-1] ^ 1]),
+    lambda data: b'XXXX' + data[4:],
+])
+def test_damaged_file(tmp_path, damage):
+    path = tmp_path / 'index.snapshot'
+    path.write_bytes(damage(encode_snapshot(POINTS, ADDRESSES, UTXOS)))
+    with pytest.raises(SnapshotError):
+        read_snapshot(str(path))
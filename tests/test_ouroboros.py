@@ -0,0 +1,164 @@
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+import bech32
+import cbor
+import ouroboros
+from address import base_address
+from ouroboros import *
+from standin_node import StandInLedger, StandInNode
+
+WALLET = base_address(bytes([1]) * 28, bytes([101]) * 28, 'mainnet')
+BUYER = base_address(bytes([2]) * 28, bytes([102]) * 28, 'mainnet')
+
+
+@pytest.fixture
+def socket_path():
+    # tmp_path can be longer than a unix socket path may be
+    with tempfile.TemporaryDirectory() as directory:
+        yield os.path.join(directory, 'node.socket')
+
+
+def run_against(socket_path, ledger, test):
+    """
+    Serve the ledger on the socket and run test(pool) with a node client pool connected to it
+    """
+    async def main():
+        node = await StandInNode(socket_path, ledger).start()
+        pool = NodeClientPool(socket_path, NETWORK_MAGIC, 2, 5, 1)
+        try:
+            return await test(pool)
+        finally:
+            pool.close()
+            await node.close()
+
+    return asyncio.run(main())
+
+
+def payment(tx_in, address, lovelace):
+    body = {0: [list(tx_in)], 1: [[bech32.decode(address)[1], lovelace]], 2: 200000}
+    return cbor.dumps([body, {}, True, None])
+
+
+def test_handshake_agrees_on_the_highest_version(socket_path):
+    async def test(pool):
+        connection = await pool.open_connection()
+        connection.close()
+        return connection.version
+
+    assert run_against(socket_path, StandInLedger(), test) == max(NODE_TO_CLIENT_VERSIONS)
+
+
+def test_handshake_refused_for_another_network(socket_path):
+    async def test(pool):
+        pool.magic = NETWORK_MAGIC + 1
+        with pytest.raises(NodeClientError):
+            await pool.run(lambda connection: connection.acquire())
+
+    run_against(socket_path, StandInLedger(), test)
+
+
+def test_state_query_utxos_and_tip(socket_path, monkeypatch):
+    ledger = StandInLedger()
+    tx_hash, _ = ledger.add_utxo(WALLET, 5000000, {'aa' * 28: {'4d494c4b': 3}})
+    ledger.roll_forward()
+
+    async def test(pool):
+        monkeypatch.setattr(ouroboros, 'node_pool', pool)
+        utxos = await node_query_utxos_batch([WALLET, BUYER])
+        tx_outs = await node_query_tx_outs([f'{tx_hash.hex()}#0', f'{tx_hash.hex()}#1'])
+        return utxos, tx_outs, await node_query_tip()
+
+    utxos, tx_outs, tip = run_against(socket_path, ledger, test)
+    assert utxos[BUYER] == []
+    [utxo] = utxos[WALLET]
+    assert (utxo.tx_hash, utxo.index, utxo.lovelace) == (tx_hash.hex(), 0, 5000000)
+    assert utxo.assets == {'aa' * 28 + '.4d494c4b': 3}
+    assert list(tx_outs) == [f'{tx_hash.hex()}#0']
+    assert tip['era'] == ERA_NAMES[ledger.era]
+    assert (tip['slot'], tip['block'], tip['hash']) == (ledger.slot, 1, ledger.block_hash.hex())
+    assert tip['epoch'] == ledger.epoch
+
+
+def test_tx_submission_accepts_then_rejects_a_double_spend(socket_path):
+    ledger = StandInLedger()
+    tx_in = ledger.add_utxo(WALLET, 5000000)
+    ledger.roll_forward()
+    tx = payment(tx_in, BUYER, 4800000)
+
+    async def test(pool):
+        accepted = await pool.run(lambda connection: connection.submit_tx(5, tx))
+        with pytest.raises(TxSubmitRejected) as rejected:
+            await pool.run(lambda connection: connection.submit_tx(5, tx))
+        return accepted, rejected.value
+
+    accepted, rejected = run_against(socket_path, ledger, test)
+    assert accepted is None
+    assert rejected.reason == [[0, [1, [0, [[tx_in[0].hex(), 0]]]]]]
+    assert len(ledger.mempool) == 1
+
+
+def test_chain_sync_follows_a_rollback(socket_path):
+    ledger = StandInLedger()
+    ledger.roll_forward()
+    ledger.roll_forward()
+
+    async def test(pool):
+        connection = await pool.open_connection()
+        try:
+            point, tip = await connection.find_intersect([[]])
+            assert point == []
+            assert await connection.request_next() == ('backward', [], ledger.chain_tip())
+            slots = []
+            for _ in range(2):
+                kind, block, _ = await connection.request_next()
+                assert kind == 'forward'
+                slots.append(decode_block(block)[0])
+            assert await connection.request_next() == ('await', None, None)
+
+            first = ledger.blocks[0]
+            ledger.rollback()
+            kind, point, tip = await asyncio.wait_for(connection.receive_next(), 5)
+            return slots, kind, point, tip, [first['slot'], first['hash']]
+        finally:
+            connection.close()
+
+    slots, kind, point, tip, first = run_against(socket_path, ledger, test)
+    assert slots == [20, 40]
+    assert kind == 'backward'
+    assert point == first
+    assert tip == [first, 1]
+
+
+def test_tx_monitor_hands_out_the_mempool(socket_path):
+    ledger = StandInLedger()
+    tx_in = ledger.add_utxo(WALLET, 5000000)
+    ledger.roll_forward()
+    tx = payment(tx_in, BUYER, 4800000)
+
+    async def test(pool):
+        connection = await pool.open_connection()
+        try:
+            await connection.monitor_acquire()
+            assert await connection.monitor_next_tx() is None
+            # Held on to, the next snapshot comes once the mempool changes
+            waiting = asyncio.ensure_future(connection.monitor_acquire())
+            await asyncio.sleep(0.05)
+            assert not waiting.done()
+            assert ledger.submit(tx) is None
+            await asyncio.wait_for(waiting, 5)
+            txs = [await connection.monitor_next_tx(), await connection.monitor_next_tx()]
+            await connection.monitor_release()
+            return txs
+        finally:
+            connection.close()
+
+    first, last = run_against(socket_path, ledger, test)
+    assert last is None
+    tx_id, body, valid = decode_tx(first)
+    assert valid
+    assert tx_id == ledger.mempool[0][0].hex()
+    assert cbor.loads(body)[1] == [[bech32.decode(BUYER)[1], 4800000]]
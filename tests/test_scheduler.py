@@ -0,0 +1,153 @@
+import asyncio
+
+from scheduler import *
+
+QUERY = ['cardano-cli', 'query', 'utxo']
+BUILD = ['cardano-cli', 'transaction', 'build']
+SUBMIT = ['cardano-cli', 'transaction', 'submit']
+
+
+def test_command_class():
+    assert command_class(QUERY) == 'query'
+    assert command_class(BUILD) == 'build'
+    assert command_class(['cardano-cli', 'transaction', 'build-raw']) == 'build'
+    assert command_class(SUBMIT) == 'submit'
+    assert command_class(['cardano-cli', 'transaction', 'txid']) == 'local'
+    assert command_class(['cardano-cli']) == 'local'
+
+
+def test_lane_serves_waiters_by_priority_then_arrival():
+    lane = Lane('query', 1)
+    order = []
+
+    async def take(priority, name):
+        await lane.acquire(priority)
+        order.append(name)
+        await asyncio.sleep(0.01)
+        lane.release()
+
+    async def main():
+        await lane.acquire(PRIORITY_DEFAULT)
+        tasks = [asyncio.ensure_future(take(priority, name)) for priority, name in [
+            (PRIORITY_POLL, 'poll 1'), (PRIORITY_DEFAULT, 'default'), (PRIORITY_POLL, 'poll 2'),
+            (PRIORITY_SETTLEMENT, 'settlement')]]
+        await asyncio.sleep(0.01)
+        assert lane.stats()['queue_depth'] == 4
+        lane.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert order == ['settlement', 'default', 'poll 1', 'poll 2']
+    assert lane.stats()['active'] == 0
+    assert lane.stats()['acquired_by_priority'] == {'settlement': 1, 'default': 2, 'poll': 2}
+
+
+def test_cancelled_waiter_gives_its_slot_on():
+    lane = Lane('query', 1)
+
+    async def main():
+        await lane.acquire(PRIORITY_DEFAULT)
+        cancelled = asyncio.ensure_future(lane.acquire(PRIORITY_SETTLEMENT))
+        waiting = asyncio.ensure_future(lane.acquire(PRIORITY_POLL))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        lane.release()
+        await asyncio.wait_for(waiting, 1)
+        lane.release()
+        return cancelled.cancelled()
+
+    assert asyncio.run(main())
+    assert (lane.active, lane.waiting) == (0, 0)
+
+
+def test_scheduler_limits_per_class_and_in_total():
+    scheduler = CommandScheduler({'query': 2, 'build': 1, 'submit': 1, 'local': 4}, 3)
+    running = {'query': 0, 'build': 0, 'total': 0}
+    peaks = {'query': 0, 'build': 0, 'total': 0}
+
+    async def run(command):
+        async with scheduler.slot(command, PRIORITY_DEFAULT):
+            name = command_class(command)
+            for key in (name, 'total'):
+                running[key] += 1
+                peaks[key] = max(peaks[key], running[key])
+            await asyncio.sleep(0.01)
+            for key in (name, 'total'):
+                running[key] -= 1
+
+    async def main():
+        await asyncio.gather(*([run(QUERY) for _ in range(6)] + [run(BUILD) for _ in range(3)]))
+
+    asyncio.run(main())
+    assert peaks == {'query': 2, 'build': 1, 'total': 3}
+    stats = scheduler.stats()
+    assert (stats['query']['acquired'], stats['build']['acquired'], stats['total']['acquired']) == (6, 3, 9)
+    assert stats['total']['active'] == 0
+
+
+def test_slot_takes_the_priority_of_the_coroutine():
+    scheduler = CommandScheduler({'query': 1, 'build': 1, 'submit': 1, 'local': 1}, 1)
+
+    @prioritized(PRIORITY_SETTLEMENT)
+    async def settle():
+        async with scheduler.slot(SUBMIT):
+            pass
+
+    asyncio.run(settle())
+    assert scheduler.stats()['submit']['acquired_by_priority']['settlement'] == 1
+
+
+def test_single_flight_shares_one_call():
+    flight = SingleFlight()
+    calls = []
+
+    async def query():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return ['utxo']
+
+    async def main():
+        results = await asyncio.gather(*(flight.do(('addr1',), query) for _ in range(5)))
+        # A call after the first one ended starts a new one
+        await flight.do(('addr1',), query)
+        return results
+
+    results = asyncio.run(main())
+    assert results == [['utxo']] * 5
+    assert len(calls) == 2
+    assert flight.stats() == {'in_flight': 0, 'started': 2, 'shared': 4}
+
+
+def test_single_flight_survives_a_cancelled_waiter():
+    flight = SingleFlight()
+
+    async def query():
+        await asyncio.sleep(0.02)
+        return 'result'
+
+    async def main():
+        first = asyncio.ensure_future(flight.do('key', query))
+        second = asyncio.ensure_future(flight.do('key', query))
+        await asyncio.sleep(0)
+        # The caller that started the call goes away, the other one still gets the result
+        first.cancel()
+        return await second, first
+
+    result, first = asyncio.run(main())
+    assert result == 'result'
+    assert first.cancelled()
+
+
+def test_single_flight_shares_errors():
+    flight = SingleFlight()
+
+    async def query():
+        await asyncio.sleep(0.01)
+        raise RuntimeError('node down')
+
+    async def main():
+        return await asyncio.gather(*(flight.do('key', query) for _ in range(2)), return_exceptions=True)
+
+    errors = asyncio.run(main())
+    assert [str(error) for error in errors] == ['node down', 'node down']
+    assert flight.stats()['in_flight'] == 0
@@ -0,0 +1,70 @@
+import json
+
+import nacl.exceptions
+import nacl.signing
+import pytest
+
+import cbor
+from address import parse_address
+from signing import *
+from utils import create_wallet_address
+
+# Test vectors 1 to 3 of RFC 8032 section 7.1: secret key, public key, message, signature
+RFC8032 = [
+    ('9d61b19deffd5a60ba844af492ec2cc44449c5697b326919703bac031cae7f60',
+     'd75a980182b10ab7d54bfed3c964073a0ee172f3daa62325af021a68f707511a',
+     '',
+     'e5564300c360ac729086e2cc806e828a84877f1eb8e5d974d873e065224901555fb8821590a33bacc61e39701cf9b46b'
+     'd25bf5f0595bbe24655141438e7a100b'),
+    ('4ccd089b28ff96da9db6c346ec114e0f5b8a319f35aba624da8cf6ed4fb8a6fb',
+     '3d4017c3e843895a92b70aa74d1b7ebc9c982ccf2ec4968cc0cd55f12af4660c',
+     '72',
+     '92a009a9f0d4cab8720e820b5f642540a2b27b5416503f8fb3762223ebdb69da085ac1e43e15996e458f3613d0f11d8c'
+     '387b2eaeb4302aeeb00d291612bb0c00'),
+    ('c5aa8df43f9f837bedb7442f31dcb7b166d38535076f094b85ce3a2e0b4458f7',
+     'fc51cd8e6218a1a38da47ed00230f0580816ed13ba3303ac5deb911548908025',
+     'af82',
+     '6291d657deec24024827e69c3abe01a30ce548a284743a445e3680d7db5ac3ac18ff9b538d16f290ae67f760984dc659'
+     '4a7c15e9716ed28dc027beceea1ec40a'),
+]
+
+
+def verify(verification_key, message, signature):
+    try:
+        nacl.signing.VerifyKey(verification_key).verify(message, signature)
+    except nacl.exceptions.BadSignatureError:
+        return False
+    return True
+
+
+@pytest.mark.parametrize('secret, public, message, signature', RFC8032)
+def test_rfc8032(secret, public, message, signature):
+    secret, public, message, signature = map(bytes.fromhex, (secret, public, message, signature))
+    key = SigningKey(secret)
+    assert not key.extended
+    assert key.verification_key == public
+    assert key.sign(message) == signature
+
+
+def test_extended_key_signatures_verify():
+    secret = bytearray(range(64))
+    # kL clamped as BIP32-Ed25519 derivation leaves it
+    secret[0] &= 0xf8
+    secret[31] = secret[31] & 0x1f | 0x40
+    key = SigningKey(bytes(secret))
+    assert key.extended
+    signature = key.sign(b'body hash')
+    assert signature == key.sign(b'body hash')
+    assert verify(key.verification_key, b'body hash', signature)
+    assert not verify(key.verification_key, b'other hash', signature)
+    # cardano-cli files carry the public key after kL || kR
+    assert SigningKey(bytes(secret) + key.verification_key + bytes(32)).sign(b'body hash') == signature
+
+
+def test_new_wallet_keys_come_from_libsodium():
+    wallet = json.loads(create_wallet_address('mainnet'))
+    seed = cbor.loads(bytes.fromhex(wallet['signing_key']['cborHex']))
+    verification_key = cbor.loads(bytes.fromhex(wallet['verification_key']['cborHex']))
+    assert verification_key == nacl.signing.SigningKey(seed).verify_key.encode()
+    assert parse_address(wallet['address'])[2] == blake2b_224(verification_key)
+    assert generate_signing_key().secret != generate_signing_key().secret
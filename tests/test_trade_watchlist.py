@@ -0,0 +1,206 @@
+import asyncio
+
+from address import base_address
+from trade_watchlist import *
+from utxo import UTxO
+
+WALLET = base_address(bytes([1]) * 28, bytes([101]) * 28, 'mainnet')
+POLICY = 'ee' * 28
+BUYER_STAKE = 'stake1buyer'
+SELLER_STAKE = 'stake1seller'
+
+
+def terms(version='v0'):
+    return {
+        'address': WALLET,
+        'version': version,
+        'buy': {'unit': 'lovelace', 'quantity': '5000000'},
+        'sell': {'unit': POLICY + '4d494c4b', 'quantity': 3},
+        'buyer_stake_list': [{'stake_address': BUYER_STAKE}],
+        'seller_stake_list': [{'stake_address': SELLER_STAKE}],
+    }
+
+
+def ada_deposit(tx_hash, lovelace=5000000):
+    return UTxO(tx_hash * 32, 0, lovelace, {}, None)
+
+
+def token_deposit(tx_hash, quantity=3):
+    return UTxO(tx_hash * 32, 0, 1500000, {f'{POLICY}.4d494c4b': quantity}, None)
+
+
+class FakeChain:
+    """
+    query, sender and tip of a TradeWatchlist
+    """
+
+    def __init__(self):
+        self.slot = 100
+        self.utxos = {}
+        self.senders = {}
+        self.queries = 0
+        self.lookups = []
+
+    def tip(self):
+        return self.slot, 'aa' * 32
+
+    def add_block(self, *utxos):
+        self.utxos.setdefault(WALLET, []).extend(utxos)
+        self.slot += 20
+
+    async def query(self, addresses):
+        self.queries += 1
+        return {address: list(self.utxos.get(address, [])) for address in addresses}
+
+    async def sender(self, tx_hash):
+        self.lookups.append(tx_hash)
+        return self.senders.get(tx_hash)
+
+
+class FakeMempool:
+    running = True
+
+    def __init__(self):
+        self.version = 0
+        self.utxos = []
+        self.senders = {}
+
+    def watch(self, address):
+        pass
+
+    def unwatch(self, address):
+        pass
+
+    def pending(self, address):
+        return list(self.utxos) if address == WALLET else []
+
+    def sender(self, tx_hash):
+        return self.senders.get(tx_hash)
+
+
+def test_deposits_count_only_from_the_listed_stake_addresses():
+    chain = FakeChain()
+    watchlist = TradeWatchlist(chain.query, chain.sender, chain.tip, 60)
+    chain.senders = {'01' * 32: BUYER_STAKE, '02' * 32: 'stake1someone_else'}
+
+    async def main():
+        first = await watchlist.status(WALLET, terms())
+        chain.add_block(ada_deposit('01'), token_deposit('02'))
+        return first, await watchlist.status(WALLET, terms())
+
+    first, second = asyncio.run(main())
+    assert (first['buyer_sent'], first['seller_sent'], first['utxos']) == (False, False, [])
+    assert second['buyer_sent']
+    # Right token, wrong sender
+    assert not second['seller_sent']
+    assert len(second['utxos']) == 2
+    assert sorted(chain.lookups) == ['01' * 32, '02' * 32]
+
+
+def test_deposits_without_the_stake_check():
+    chain = FakeChain()
+    watchlist = TradeWatchlist(chain.query, chain.sender, chain.tip, 60)
+    # An amount that isn't the listing's settles nothing
+    chain.add_block(ada_deposit('01'), token_deposit('02'), ada_deposit('03', 4000000))
+
+    status = asyncio.run(watchlist.status(WALLET, terms('v1')))
+    assert status['buyer_sent'] and status['seller_sent']
+    assert len(status['utxos']) == 3
+    assert chain.lookups == []
+
+
+def test_status_is_cached_until_the_tip_moves():
+    chain = FakeChain()
+    watchlist = TradeWatchlist(chain.query, chain.sender, chain.tip, 60)
+
+    async def main():
+        await watchlist.status(WALLET, terms())
+        await watchlist.status(WALLET, terms())
+        chain.add_block()
+        await watchlist.status(WALLET, terms())
+
+    asyncio.run(main())
+    assert chain.queries == 2
+    assert watchlist.stats()['cache_hits'] == 1
+
+
+def test_pending_deposit_carries_over_when_confirmed():
+    chain = FakeChain()
+    mempool = FakeMempool()
+    watchlist = TradeWatchlist(chain.query, chain.sender, chain.tip, 60, mempool)
+    buy, sell = ada_deposit('01'), token_deposit('02')
+    chain.senders = {buy.tx_hash: BUYER_STAKE, sell.tx_hash: SELLER_STAKE}
+
+    async def main():
+        # The mempool watcher resolved the buyer's sender, not the seller's
+        mempool.utxos = [buy, sell]
+        mempool.senders = {buy.tx_hash: BUYER_STAKE}
+        mempool.version += 1
+        pending = await watchlist.status(WALLET, terms())
+        lookups = list(chain.lookups)
+        # The block lands and empties the mempool
+        mempool.utxos = []
+        mempool.version += 1
+        chain.add_block(buy, sell)
+        return pending, lookups, await watchlist.status(WALLET, terms())
+
+    pending, lookups, confirmed = asyncio.run(main())
+    assert not pending['buyer_sent'] and not pending['seller_sent']
+    assert pending['pending']['buyer_sent'] and not pending['pending']['seller_sent']
+    assert len(pending['pending']['utxos']) == 2
+    assert lookups == [buy.tx_hash]
+    assert confirmed['buyer_sent'] and confirmed['seller_sent']
+    assert confirmed['pending'] == {'buyer_sent': False, 'seller_sent': False, 'utxos': []}
+    # Each sender looked up once
+    assert chain.lookups == [buy.tx_hash, sell.tx_hash]
+
+
+def test_sessions_expire_after_the_ttl_unless_subscribed():
+    chain = FakeChain()
+
+    async def main(ttl, subscribe):
+        watchlist = TradeWatchlist(chain.query, chain.sender, chain.tip, ttl)
+        await watchlist.status(WALLET, terms())
+        if subscribe:
+            watchlist.subscribe(WALLET, terms())
+        await asyncio.sleep(0.01)
+        chain.add_block()
+        watchlist.notify()
+        await watchlist._task
+        await watchlist.close()
+        return watchlist.stats()
+
+    expired = asyncio.run(main(0, False))
+    assert (expired['sessions'], expired['expired'], expired['expected_deposits']) == (0, 1, 0)
+    kept = asyncio.run(main(60, False))
+    assert (kept['sessions'], kept['expired'], kept['rounds']) == (1, 0, 1)
+    subscribed = asyncio.run(main(0, True))
+    assert (subscribed['sessions'], subscribed['expired']) == (1, 0)
+
+
+def test_subscribers_only_get_the_latest_status():
+    chain = FakeChain()
+    watchlist = TradeWatchlist(chain.query, chain.sender, chain.tip, 60)
+    chain.senders = {'01' * 32: BUYER_STAKE, '02' * 32: SELLER_STAKE}
+
+    async def main():
+        key, queue = watchlist.subscribe(WALLET, terms())
+        await watchlist._task
+        initial = queue.get_nowait()
+        # Two blocks while the subscriber doesn't read
+        chain.add_block(ada_deposit('01'))
+        watchlist.notify()
+        await watchlist._task
+        chain.add_block(token_deposit('02'))
+        watchlist.notify()
+        await watchlist._task
+        latest = queue.get_nowait()
+        watchlist.unsubscribe(key, queue)
+        await watchlist.close()
+        return initial, latest, queue.empty()
+
+    initial, latest, empty = asyncio.run(main())
+    assert not initial['buyer_sent']
+    assert latest['buyer_sent'] and latest['seller_sent']
+    assert empty
+    assert watchlist.stats()['events'] == 2
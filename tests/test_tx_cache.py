@@ -0,0 +1,69 @@
+from tx_cache import TxContentCache
+
+
+def tx_hash(i):
+    return f'{i:064x}'
+
+
+def content(i):
+    return {'hash': tx_hash(i), 'inputs': [{'address': 'addr1sender', 'amount': []}], 'outputs': []}
+
+
+def test_admitted_once_deep_enough(tmp_path):
+    cache = TxContentCache(str(tmp_path / 'tx_cache.sqlite3'), 10, 10)
+    assert not cache.admit(tx_hash(1), content(1), 9)
+    assert cache.get(tx_hash(1)) is None
+    assert cache.admit(tx_hash(1), content(1), 10)
+    assert cache.get(tx_hash(1)) == content(1)
+    assert cache.stats()['stores'] == 1
+    cache.close()
+
+
+def test_remembered_height_dropped_on_admission():
+    cache = TxContentCache(None, 2, 10)
+    cache.remember_height(tx_hash(1), 500)
+    assert cache.height(tx_hash(1)) == 500
+    cache.admit(tx_hash(1), content(1), 10)
+    assert cache.height(tx_hash(1)) is None
+    for i in range(2, 5):
+        cache.remember_height(tx_hash(i), 500 + i)
+    # Bounded like the contents, oldest first
+    assert [cache.height(tx_hash(i)) for i in range(2, 5)] == [None, 503, 504]
+
+
+def test_hits_are_copies():
+    cache = TxContentCache(None, 10, 1)
+    cache.admit(tx_hash(1), content(1), 1)
+    cache.get(tx_hash(1))['inputs'].clear()
+    assert cache.get(tx_hash(1)) == content(1)
+
+
+def test_memory_tier_is_a_bounded_lru():
+    cache = TxContentCache(None, 2, 1)
+    cache.admit(tx_hash(1), content(1), 1)
+    cache.admit(tx_hash(2), content(2), 1)
+    assert cache.get(tx_hash(1)) is not None
+    cache.admit(tx_hash(3), content(3), 1)
+    assert cache.get(tx_hash(2)) is None
+    assert cache.get(tx_hash(1)) == content(1)
+    assert cache.get(tx_hash(3)) == content(3)
+    assert cache.stats()['entries'] == 2
+
+
+def test_evicted_and_restarted_contents_come_back_from_sqlite(tmp_path):
+    path = str(tmp_path / 'tx_cache.sqlite3')
+    cache = TxContentCache(path, 2, 1)
+    for i in range(1, 4):
+        cache.admit(tx_hash(i), content(i), 1)
+    # Evicted from memory, still on disk
+    assert cache.get(tx_hash(1)) == content(1)
+    assert cache.stats()['disk_hits'] == 1
+    cache.close()
+
+    reloaded = TxContentCache(path, 2, 1)
+    assert [reloaded.get(tx_hash(i)) for i in range(1, 4)] == [content(i) for i in range(1, 4)]
+    assert reloaded.get(tx_hash(3)) == content(3)
+    stats = reloaded.stats()
+    assert (stats['disk_hits'], stats['memory_hits'], stats['misses']) == (3, 1, 0)
+    assert reloaded.get(tx_hash(4)) is None
+    reloaded.close()
@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+from address import base_address
+from utxo import *
+
+WALLET = base_address(bytes([1]) * 28, bytes([101]) * 28, 'mainnet')
+OTHER = base_address(bytes([2]) * 28, bytes([102]) * 28, 'mainnet')
+HASH_A = '4e3a6e7fdcb0d0efa17bf79c13aed2b4cb9baf37fb1aa2e39553d5bd720c5c99'
+HASH_B = '9e1199a988ba72ffd6e9c269cadb3b53b5f360ff99f112d9b2ee30c4d74ad88b'
+DATUM = 'ffd6e9c269cadb3b53b5f360ff99f112d9b2ee30c4d74ad88b9e1199a988ba72'
+POLICY = 'ee' * 28
+OTHER_POLICY = 'dd' * 28
+
+# The same three outputs as `cardano-cli query utxo` prints them and as it writes them with --out-file: ADA only,
+# two tokens (one with an empty asset name) and ADA with a datum hash
+TABLE = f'''                           TxHash                                 TxIx        Amount
+--------------------------------------------------------------------------------------
+{HASH_A}     0        1500000 lovelace + TxOutDatumNone
+{HASH_A}     1        1344798 lovelace + 3 {POLICY}.4d494c4b + 1 {OTHER_POLICY} + TxOutDatumNone
+{HASH_B}     2        2000000 lovelace + TxOutDatumHash ScriptDataInAlonzoEra "{DATUM}"
+'''
+
+JSON = json.dumps({
+    f'{HASH_A}#0': {'address': WALLET, 'value': {'lovelace': 1500000}, 'datumhash': None},
+    f'{HASH_A}#1': {'address': WALLET, 'datumhash': None,
+                    'value': {'lovelace': 1344798, POLICY: {'4d494c4b': 3}, OTHER_POLICY: {'': 1}}},
+    f'{HASH_B}#2': {'address': OTHER, 'value': {'lovelace': 2000000}, 'datumhash': DATUM},
+}, indent=4)
+
+EXPECTED = [
+    UTxO(HASH_A, 0, 1500000, {}, None),
+    UTxO(HASH_A, 1, 1344798, {f'{POLICY}.4d494c4b': 3, OTHER_POLICY: 1}, None),
+    UTxO(HASH_B, 2, 2000000, {}, DATUM),
+]
+
+
+def test_table():
+    assert parse_utxo_table(TABLE) == EXPECTED
+    assert parse_utxo_table(TABLE.encode()) == EXPECTED
+
+
+def test_json():
+    assert parse_utxo_json(JSON) == EXPECTED
+    assert parse_utxo_json(JSON.encode()) == EXPECTED
+
+
+@pytest.mark.parametrize('raw', [TABLE, TABLE.encode(), JSON, JSON.encode()])
+def test_either_output(raw):
+    assert parse_utxo_output(raw) == EXPECTED
+
+
+def test_json_by_address():
+    assert parse_utxo_json_by_address(JSON, [WALLET, OTHER, 'addr1empty']) == {
+        WALLET: EXPECTED[:2], OTHER: EXPECTED[2:], 'addr1empty': []}
+
+
+def test_json_datum_of_older_cardano_cli():
+    raw = json.dumps({f'{HASH_B}#2': {'address': OTHER, 'value': {'lovelace': 2000000}, 'data': DATUM}})
+    assert parse_utxo_json(raw) == EXPECTED[2:]
+
+
+def test_empty_outputs():
+    assert parse_utxo_table(TABLE.splitlines()[0] + '\n' + TABLE.splitlines()[1]) == []
+    assert parse_utxo_json('{}') == []
+
+
+def test_repeated_unit_adds_up():
+    cells = [HASH_A, '0', '1500000', 'lovelace', '+', '2', f'{POLICY}.4d', '+', '3', f'{POLICY}.4d', '+',
+             'TxOutDatumNone']
+    assert parse_utxo_row(cells).assets == {f'{POLICY}.4d': 5}
+
+
+@pytest.mark.parametrize('utxo', EXPECTED)
+def test_row_round_trip(utxo):
+    assert parse_utxo_row(utxo.cells()) == utxo
+
+
+def test_ada_only():
+    assert [utxo.ada_only for utxo in EXPECTED] == [True, False, True]
+    assert EXPECTED[1].amounts() == {'lovelace': 1344798, f'{POLICY}.4d494c4b': 3, OTHER_POLICY: 1}
+    assert EXPECTED[1].value() == f'1344798+3 {POLICY}.4d494c4b+1 {OTHER_POLICY}'
+    assert EXPECTED[2].as_dict() == {'tx_hash': HASH_B, 'tx_index': '2', 'datum_hash': DATUM,
+                                     'amount': [{'unit': 'lovelace', 'quantity': '2000000'}]}
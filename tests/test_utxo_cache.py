@@ -0,0 +1,104 @@
+import time
+
+from utxo import UTxO
+from utxo_cache import *
+
+POINT = (100, 'aa' * 32)
+NEXT_POINT = (120, 'bb' * 32)
+
+
+def utxos(tx_hash, count=1, assets=0):
+    return [UTxO(tx_hash * 32, i, 1500000, {f'{"ee" * 28}.{j:02x}': 1 for j in range(assets)}, None)
+            for i in range(count)]
+
+
+def test_served_at_the_point_it_was_queried_at():
+    cache = UTxOCache(60, 10, 1 << 20)
+    cache.put('addr1', POINT, utxos('01'), cache.stamp())
+    assert cache.get('addr1', POINT) == utxos('01')
+    assert cache.get('addr1', NEXT_POINT) is None
+    assert cache.get('addr2', POINT) is None
+    assert (cache.stats()['hits'], cache.stats()['misses']) == (1, 2)
+
+
+def test_expires_after_the_ttl():
+    cache = UTxOCache(0.05, 10, 1 << 20)
+    cache.put('addr1', POINT, utxos('01'), cache.stamp())
+    time.sleep(0.06)
+    assert cache.get('addr1', POINT) is None
+
+
+def test_disabled():
+    cache = UTxOCache(0, 10, 1 << 20)
+    cache.put('addr1', POINT, utxos('01'), cache.stamp())
+    assert cache.get('addr1', POINT) is None
+    assert cache.stats()['stores'] == 0
+
+
+def test_query_overlapping_an_invalidation_is_not_stored():
+    cache = UTxOCache(60, 10, 1 << 20)
+    # A query starts, a transaction spending from the address is submitted before it answers
+    stamp = cache.stamp()
+    cache.invalidate(['addr1'])
+    cache.put('addr1', POINT, utxos('01'), stamp)
+    assert cache.get('addr1', POINT) is None
+    # Unrelated addresses are held back too, the stamp is global
+    cache.put('addr2', POINT, utxos('02'), stamp)
+    assert cache.get('addr2', POINT) is None
+    cache.put('addr1', POINT, utxos('03'), cache.stamp())
+    assert cache.get('addr1', POINT) == utxos('03')
+
+
+def test_invalidate_by_spent_txin():
+    cache = UTxOCache(60, 10, 1 << 20)
+    cache.put('addr1', POINT, utxos('01', 2), cache.stamp())
+    cache.put('addr2', POINT, utxos('02'), cache.stamp())
+    cache.invalidate(txins=[f'{"01" * 32}#1', f'{"ff" * 32}#0'])
+    assert cache.get('addr1', POINT) is None
+    assert cache.get('addr2', POINT) == utxos('02')
+    assert cache.stats()['invalidations'] == 1
+    # Its txins are forgotten with the entry
+    assert cache._owners == {f'{"02" * 32}#0': 'addr2'}
+
+
+def test_least_recently_used_is_evicted():
+    cache = UTxOCache(60, 2, 1 << 20)
+    cache.put('addr1', POINT, utxos('01'), cache.stamp())
+    cache.put('addr2', POINT, utxos('02'), cache.stamp())
+    assert cache.get('addr1', POINT) is not None
+    cache.put('addr3', POINT, utxos('03'), cache.stamp())
+    assert cache.get('addr2', POINT) is None
+    assert cache.get('addr1', POINT) is not None
+    assert cache.get('addr3', POINT) is not None
+    assert cache.stats()['evictions'] == 1
+
+
+def test_memory_cap():
+    # Estimated size of 10 utxos with 2 assets each
+    size = 400 + 10 * (450 + 2 * 250)
+    cache = UTxOCache(60, 100, 2 * size)
+    cache.put('addr1', POINT, utxos('01', 10, 2), cache.stamp())
+    cache.put('addr2', POINT, utxos('02', 10, 2), cache.stamp())
+    assert cache.stats()['estimated_bytes'] == 2 * size
+    cache.put('addr3', POINT, utxos('03', 10, 2), cache.stamp())
+    assert cache.get('addr1', POINT) is None
+    assert cache.stats()['estimated_bytes'] == 2 * size
+    # A wallet larger than the whole cap is never stored and evicts nothing
+    cache.put('addr4', POINT, utxos('04', 30, 2), cache.stamp())
+    assert cache.get('addr4', POINT) is None
+    assert cache.stats()['entries'] == 2
+
+
+def test_cleared_when_the_tip_moves():
+    cache = UTxOCache(60, 10, 1 << 20)
+    stamp = cache.stamp()
+    cache.put('addr1', POINT, utxos('01'), stamp)
+    # Tip watcher listener
+    cache.clear(NEXT_POINT)
+    assert cache.get('addr1', POINT) is None
+    assert cache.stats()['entries'] == 0
+    assert cache.stats()['estimated_bytes'] == 0
+    assert cache._owners == {}
+    # A query still running from before the tip moved is stored under its old point, never served at the new one
+    cache.put('addr2', POINT, utxos('02'), stamp)
+    assert cache.get('addr2', NEXT_POINT) is None
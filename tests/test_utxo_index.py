@@ -0,0 +1,73 @@
+import asyncio
+
+from address import base_address
+from chain_follower import ChainFollower
+from index_snapshot import write_snapshot
+from ouroboros import decode_block
+from standin_node import StandInLedger
+from utxo_index import UTxOIndex
+
+
+def address(i):
+    return base_address(bytes([i]) * 28, bytes([i + 100]) * 28, 'mainnet')
+
+
+def roll_forward(index, ledger):
+    ledger.roll_forward()
+    index.apply_block(*decode_block(ledger.blocks[-1]['cbor']))
+
+
+def test_snapshot_after_unwatching_an_address_with_spent_outputs(tmp_path):
+    wallet, buyer = address(1), address(2)
+    ledger = StandInLedger()
+    index = UTxOIndex(snapshot_path=str(tmp_path / 'index.snapshot'))
+    index.watch(wallet, fresh=True)
+    index.watch(buyer, fresh=True)
+    deposit = ledger.pay(wallet, 5000000)
+    roll_forward(index, ledger)
+    ledger.pay(buyer, 4800000, inputs=[deposit])
+    roll_forward(index, ledger)
+    assert index.get(wallet) == []
+    assert index.stats()['spent_kept'] == 1
+
+    # Settled: the wallet is dropped while its spent deposit is still inside the rollback window
+    index.unwatch(wallet)
+    assert index.stats()['spent_kept'] == 0
+    write_snapshot(index.snapshot(), index.snapshot_path)
+
+    restored = UTxOIndex(snapshot_path=index.snapshot_path)
+    assert restored.load_snapshot()
+    assert restored.point == index.point
+    assert list(restored.addresses) == [buyer]
+    assert restored.get(buyer) == index.get(buyer)
+
+
+def test_rollback_after_unwatch_leaves_the_address_out(tmp_path):
+    wallet, buyer = address(1), address(2)
+    ledger = StandInLedger()
+    index = UTxOIndex()
+    index.watch(wallet, fresh=True)
+    deposit = ledger.pay(wallet, 5000000)
+    roll_forward(index, ledger)
+    ledger.pay(buyer, 4800000, inputs=[deposit])
+    roll_forward(index, ledger)
+    index.unwatch(wallet)
+
+    ledger.rollback()
+    index.rollback(ledger.slot, ledger.block_hash.hex())
+    assert index.get(wallet) is None
+    assert index.snapshot()
+
+
+def test_follower_survives_a_snapshot_that_cannot_be_encoded(tmp_path):
+    index = UTxOIndex(snapshot_path=str(tmp_path / 'index.snapshot'))
+    index.points.append((20, '00' * 32, 1))
+
+    def broken():
+        raise KeyError('addr1')
+
+    index.snapshot = broken
+    follower = ChainFollower(None, index, 5, 60, snapshot_interval=1)
+    asyncio.run(follower._write_snapshot())
+    assert follower.snapshots == 0
+    assert not (tmp_path / 'index.snapshot').exists()
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import time
+
+from scheduler import *
+
+"""
+Chain tip followed in the background
+"""
+
+logger = logging.getLogger("default")
+
+
+class TipWatcher:
+    """
+    Polls the node tip and tells listeners when a new block lands
+    """
+
+    def __init__(self, query, interval, stale_after):
+        """
+        :param query: coroutine function returning the tip JSON of `cardano-cli query tip`
+        :param interval: seconds between polls, 0 disables the watcher
+        :param stale_after: seconds without a successful poll before the tip is no longer trusted
+        """
+        self.query = query
+        self.interval = interval
+        self.stale_after = stale_after
+        self.tip = None
+        # time.monotonic() of the last successful poll
+        self.updated = None
+        self._listeners = []
+        self._task = None
+        self.polls = 0
+        self.errors = 0
+        self.tip_changes = 0
+        self.last_error = None
+        self.last_poll_failed = False
+
+    def add_listener(self, callback):
+        # callback(point) runs in the event loop each time the tip moves
+        self._listeners.append(callback)
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    def start(self):
+        if self.interval <= 0 or self._task is not None:
+            return
+        self._task = asyncio.ensure_future(self._poll_loop())
+
+    async def close(self):
+        if self._task is not None:
+            await cancel_task(self._task)
+            self._task = None
+
+    @property
+    def point(self):
+        """
+        (slot, block hash) of the tip, None before the first poll or when polls have failed for stale_after seconds
+        """
+        if self.tip is None or time.monotonic() - self.updated > self.stale_after:
+            return None
+        return self.tip.get('slot'), self.tip.get('hash')
+
+    async def poll(self):
+        try:
+            tip = await self.query()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.errors += 1
+            self.last_error = str(e)
+            self.last_poll_failed = True
+            logger.warning('tip watcher: query failed: %s', e)
+            return
+        self.polls += 1
+        self.last_poll_failed = False
+        previous = self.point
+        self.tip = tip
+        self.updated = time.monotonic()
+        point = self.point
+        if point != previous:
+            self.tip_changes += 1
+            for callback in self._listeners:
+                try:
+                    callback(point)
+                except Exception as e:
+                    logger.error('tip watcher: listener failed: %s', e)
+
+    def age(self):
+        # Seconds since the last successful poll, None before the first one
+        return time.monotonic() - self.updated if self.updated is not None else None
+
+    def status(self):
+        """
+        Node status from the last poll, without waiting on the node
+        :return: {'status': 'online' | 'syncing' | 'offline', 'tip': tip JSON or None, 'age_seconds': float or None}
+                 'offline' when the node hasn't answered for stale_after seconds, 'syncing' when it is behind or a
+                 slow poll has let the snapshot go stale
+        """
+        age = self.age()
+        if age is None or age > self.stale_after:
+            status = 'offline' if age is None or self.last_poll_failed else 'syncing'
+        elif float(self.tip.get('syncProgress', 0)) < 100:
+            status = 'syncing'
+        else:
+            status = 'online'
+        return {'status': status, 'tip': self.tip, 'age_seconds': round(age, 3) if age is not None else None}
+
+    async def _poll_loop(self):
+        while True:
+            await self.poll()
+            await asyncio.sleep(self.interval)
+
+    def stats(self):
+        return {
+            'point': list(self.point) if self.point is not None else None,
+            'age_seconds': round(self.age(), 3) if self.updated is not None else None,
+            'interval': self.interval,
+            'polls': self.polls,
+            'errors': self.errors,
+            'tip_changes': self.tip_changes,
+            'last_error': self.last_error,
+        }
@@ -0,0 +1,373 @@
+import asyncio
+import json
+import logging
+import time
+
+from scheduler import *
+
+"""
+Server-side watchlist of active trades: every middle wallet being polled or subscribed to is evaluated once per new
+tip, and status polls are answered from the result
+"""
+
+logger = logging.getLogger("default")
+
+BUY = 'buy'
+SELL = 'sell'
+
+
+def listing_deposit(listing):
+    """
+    :param listing: buy_listing or sell_listing of a trade, {'unit': policy id + asset name hex or 'lovelace',
+                    'quantity': int or str}
+    :return: (unit as the UTxO assets spell it, quantity)
+    """
+    unit = listing['unit']
+    if len(unit) > 56:
+        unit = f'{unit[:56]}.{unit[56:]}'
+    return unit, int(listing['quantity'])
+
+
+def utxo_deposits(utxo):
+    """
+    (unit, quantity) pairs a utxo can settle, the keys is_buyer_utxo and is_seller_utxo match on
+    """
+    if utxo.ada_only:
+        return [('lovelace', utxo.lovelace)]
+    return list(utxo.assets.items())
+
+
+def _same_txins(utxos, other):
+    if utxos is None or other is None:
+        return utxos is other
+    return utxos.keys() == other.keys()
+
+
+class TradeSession:
+    """
+    One trade being watched: its terms, the utxos of its middle wallet and the deposit status computed from them
+    """
+
+    def __init__(self, key, address, terms):
+        """
+        :param key: (address, terms JSON)
+        :param address: middle wallet address
+        :param terms: request body of /v0/trade/status or /v1/trade/status plus 'version'
+        """
+        self.key = key
+        self.address = address
+        self.terms = terms
+        self.check_stake = terms.get('version') != 'v1'
+        self.deposits = {}
+        # The buyer pays ADA only, the seller never pays lovelace (see is_buyer_utxo and is_seller_utxo)
+        buy = listing_deposit(terms['buy'])
+        if buy[0] == 'lovelace':
+            self.deposits[BUY] = buy
+        sell = listing_deposit(terms['sell'])
+        if sell[0] != 'lovelace':
+            self.deposits[SELL] = sell
+        if self.check_stake:
+            self.stakes = {BUY: frozenset(stake['stake_address'] for stake in terms['buyer_stake_list']),
+                           SELL: frozenset(stake['stake_address'] for stake in terms['seller_stake_list'])}
+        self.subscribers = set()
+        self.lock = asyncio.Lock()
+        # txin -> UTxO of the middle wallet at the last evaluation, None before the first one
+        self.utxos = None
+        # txin -> (role, tx hash) of the utxos matching an expected deposit
+        self.matches = {}
+        # Same for outputs waiting in the mempool, None while there is no mempool view
+        self.pending = None
+        self.pending_matches = {}
+        # tx hash -> stake address of its sender, for matching utxos only
+        self.senders = {}
+        self.status = None
+        # Tip point, and mempool version with a mempool view, of the last evaluation
+        self.stamp = None
+        self.last_seen = time.monotonic()
+
+    def fresh(self, stamp):
+        return self.status is not None and stamp is not None and self.stamp == stamp
+
+    def _sent(self, matches):
+        sent = {BUY: False, SELL: False}
+        for role, tx_hash in matches.values():
+            if not self.check_stake or self.senders.get(tx_hash) in self.stakes[role]:
+                sent[role] = True
+        return sent
+
+    def compute_status(self):
+        sent = self._sent(self.matches)
+        status = {
+            'buyer_sent': sent[BUY],
+            'seller_sent': sent[SELL],
+            'utxos': [{'utxo': ' '.join(utxo.cells())} for utxo in self.utxos.values()]
+        }
+        if self.pending is not None:
+            # Deposits seen in the mempool, confirmed ones are left out
+            sent = self._sent(self.pending_matches)
+            status['pending'] = {
+                'buyer_sent': sent[BUY],
+                'seller_sent': sent[SELL],
+                'utxos': [{'utxo': ' '.join(utxo.cells())} for utxo in self.pending.values()]
+            }
+        return status
+
+    def publish(self, status):
+        self.status = status
+        for queue in self.subscribers:
+            # Each status is complete, a slow subscriber only needs the latest one
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(status)
+
+
+class TradeWatchlist:
+    """
+    Registry of active trade sessions. Each new tip runs one batched utxo query over their middle wallets; utxos seen
+    before are skipped and new ones are looked up in a hash index of expected (address, unit, quantity) deposits, so
+    only a deposit that can settle a trade costs a sender lookup. Status polls are a dictionary lookup while the
+    session is evaluated at the current tip. With a running mempool watcher, deposits waiting for a block are
+    reported as 'pending' as soon as the node sees them
+    """
+
+    def __init__(self, query, sender, tip, ttl, mempool=None):
+        """
+        :param query: coroutine function, list of addresses -> {address: list of UTxO}
+        :param sender: coroutine function tx hash -> stake address of its sender
+        :param tip: function returning the current tip point, None when unknown
+        :param ttl: seconds a session without subscribers stays after its last poll
+        :param mempool: MempoolWatcher, None for confirmed deposits only
+        """
+        self.query = query
+        self.sender = sender
+        self.tip = tip
+        self.ttl = ttl
+        self.mempool = mempool
+        # (address, terms JSON) -> TradeSession
+        self._sessions = {}
+        # (address, unit, quantity) -> {session key: role}
+        self._deposits = {}
+        self._task = None
+        self._dirty = False
+        self.rounds = 0
+        self.hits = 0
+        self.evaluations = 0
+        self.new_utxos = 0
+        self.sender_lookups = 0
+        self.events = 0
+        self.expired = 0
+        self.errors = 0
+
+    """
+    Sessions
+    """
+
+    def session(self, address, terms):
+        """
+        Register a trade or refresh its last poll time
+        :return: TradeSession
+        """
+        key = address, json.dumps(terms, sort_keys=True)
+        session = self._sessions.get(key)
+        if session is None:
+            session = self._sessions[key] = TradeSession(key, address, terms)
+            for role, (unit, quantity) in session.deposits.items():
+                self._deposits.setdefault((address, unit, quantity), {})[key] = role
+            if self.mempool is not None:
+                self.mempool.watch(address)
+        session.last_seen = time.monotonic()
+        return session
+
+    def _drop(self, session):
+        del self._sessions[session.key]
+        if self.mempool is not None:
+            self.mempool.unwatch(session.address)
+        for unit, quantity in session.deposits.values():
+            deposit = (session.address, unit, quantity)
+            sessions = self._deposits.get(deposit)
+            if sessions is not None:
+                sessions.pop(session.key, None)
+                if not sessions:
+                    del self._deposits[deposit]
+
+    def remove(self, address):
+        """
+        Forget the trades of a settled middle wallet, sessions with subscribers stay until they leave
+        """
+        for session in [session for session in self._sessions.values() if session.address == address]:
+            if not session.subscribers:
+                self._drop(session)
+
+    def _expire(self):
+        deadline = time.monotonic() - self.ttl
+        for session in [session for session in self._sessions.values()
+                        if not session.subscribers and session.last_seen < deadline]:
+            self._drop(session)
+            self.expired += 1
+
+    async def status(self, address, terms):
+        """
+        Deposit status of a trade, {'buyer_sent': bool, 'seller_sent': bool, 'utxos': [{'utxo': table row}]}
+        Cached while the tip doesn't move, otherwise the session is evaluated first
+        """
+        session = self.session(address, terms)
+        stamp = self._stamp()
+        if session.fresh(stamp):
+            self.hits += 1
+            return session.status
+        async with session.lock:
+            # Another poll or the per-tip round may have evaluated it meanwhile
+            if not session.fresh(stamp):
+                utxos = await self.query([address])
+                await self._evaluate(session, utxos.get(address, []), stamp)
+            else:
+                self.hits += 1
+        return session.status
+
+    def subscribe(self, address, terms):
+        """
+        :return: (key, asyncio.Queue of status dicts), the current status is queued as soon as it is known
+        """
+        session = self.session(address, terms)
+        queue = asyncio.Queue(maxsize=1)
+        session.subscribers.add(queue)
+        if session.status is not None:
+            queue.put_nowait(session.status)
+        else:
+            self.notify()
+        return session.key, queue
+
+    def unsubscribe(self, key, queue):
+        session = self._sessions.get(key)
+        if session is None:
+            return
+        session.subscribers.discard(queue)
+        session.last_seen = time.monotonic()
+
+    """
+    Evaluation
+    """
+
+    def _stamp(self):
+        point = self.tip()
+        if point is None:
+            return None
+        if self.mempool is not None and self.mempool.running:
+            return point, self.mempool.version
+        return point
+
+    def notify(self, point=None):
+        """
+        The tip moved or the mempool changed, tip watcher and mempool watcher listener
+        """
+        if not self._sessions:
+            return
+        self._dirty = True
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        # Notifications arriving during a round are folded into one more round
+        while self._dirty:
+            self._dirty = False
+            try:
+                await self._evaluate_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                logger.error('trade watchlist: %s', e)
+
+    async def _evaluate_all(self):
+        self._expire()
+        if not self._sessions:
+            return
+        self.rounds += 1
+        stamp = self._stamp()
+        sessions = list(self._sessions.values())
+        utxos = await self.query(list({session.address for session in sessions}))
+        await asyncio.gather(*(self._evaluate_locked(session, utxos.get(session.address, []), stamp)
+                               for session in sessions))
+
+    async def _evaluate_locked(self, session, utxo_list, stamp):
+        async with session.lock:
+            if session.fresh(stamp):
+                return
+            try:
+                await self._evaluate(session, utxo_list, stamp)
+            except Exception as e:
+                # Evaluated again on the next tip or poll
+                self.errors += 1
+                logger.warning('trade watchlist: %s: %s', session.address, e)
+
+    async def _evaluate(self, session, utxo_list, stamp):
+        utxos = {utxo.txin: utxo for utxo in utxo_list}
+        pending = None
+        if self.mempool is not None and self.mempool.running:
+            pending = {utxo.txin: utxo for utxo in self.mempool.pending(session.address) if utxo.txin not in utxos}
+        if session.utxos is not None and utxos.keys() == session.utxos.keys() and \
+                _same_txins(pending, session.pending):
+            session.stamp = stamp
+            return
+        self.evaluations += 1
+        previous = session.utxos or {}
+        new = [utxo for txin, utxo in utxos.items() if txin not in previous]
+        self.new_utxos += len(new)
+        matches = {txin: match for txin, match in session.matches.items() if txin in utxos}
+        # A deposit confirmed after it was pending was matched already
+        matches.update((txin, match) for txin, match in session.pending_matches.items() if txin in utxos)
+        matches.update(self._match(session, [utxo for utxo in new if utxo.txin not in matches]))
+        pending_matches = self._match(session, pending.values()) if pending else {}
+        if session.check_stake:
+            await self._lookup_senders(session, {tx_hash for _, tx_hash in matches.values()})
+            # Mempool transactions are unknown to Blockfrost, only the senders the mempool watcher resolved count
+            await self._lookup_senders(session, {tx_hash for _, tx_hash in pending_matches.values()
+                                                 if self.mempool.sender(tx_hash) is not None})
+        session.utxos = utxos
+        session.matches = matches
+        session.pending = pending
+        session.pending_matches = pending_matches
+        session.stamp = stamp
+        status = session.compute_status()
+        if status != session.status:
+            if session.status is not None:
+                self.events += 1
+            session.publish(status)
+
+    def _match(self, session, utxos):
+        # Utxos settling an expected deposit of the session, through the deposit index
+        matches = {}
+        for utxo in utxos:
+            for unit, quantity in utxo_deposits(utxo):
+                role = self._deposits.get((session.address, unit, quantity), {}).get(session.key)
+                if role is not None:
+                    matches[utxo.txin] = (role, utxo.tx_hash)
+        return matches
+
+    async def _lookup_senders(self, session, tx_hashes):
+        missing = [tx_hash for tx_hash in tx_hashes if tx_hash not in session.senders]
+        if not missing:
+            return
+        self.sender_lookups += len(missing)
+        stakes = await asyncio.gather(*(self.sender(tx_hash) for tx_hash in missing))
+        session.senders.update(zip(missing, stakes))
+
+    async def close(self):
+        if self._task is not None:
+            await cancel_task(self._task)
+            self._task = None
+
+    def stats(self):
+        return {
+            'sessions': len(self._sessions),
+            'subscribers': sum(len(session.subscribers) for session in self._sessions.values()),
+            'expected_deposits': len(self._deposits),
+            'rounds': self.rounds,
+            'cache_hits': self.hits,
+            'evaluations': self.evaluations,
+            'new_utxos': self.new_utxos,
+            'sender_lookups': self.sender_lookups,
+            'events': self.events,
+            'expired': self.expired,
+            'errors': self.errors,
+        }
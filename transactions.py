@@ -1,7 +1,7 @@
 from utils import *
 
 
-def send_lovelace(sender_address, signing_key_path, recipient_address, lovelace, sender_cover_fee=True):
+async def send_lovelace(sender_address, signing_key_path, recipient_address, lovelace, sender_cover_fee=True):
     # Tools: cardano-cli
     # Description: Send an amount of ADA from sender address to recipient_address
     #               with 2 modes which decide who will covers the network fee
@@ -21,33 +21,20 @@ def send_lovelace(sender_address, signing_key_path, recipient_address, lovelace,
 
     payment_address = sender_address
 
-    # Query UTXO and read the output
-    raw_utxo_table = None
-    if NETWORK == 'mainnet':
-        raw_utxo_table = subprocess.check_output([
-            CARDANO_CLI_PATH, 'query', 'utxo',
-            '--mainnet',
-            '--address', payment_address], env=my_env)
-    elif NETWORK == 'testnet':
-        raw_utxo_table = subprocess.check_output([
-            CARDANO_CLI_PATH, 'query', 'utxo',
-            '--testnet-magic', TESTNET_MAGIC,
-            '--address', payment_address], env=my_env)
-    # print(raw_utxo_table[2])
+    # Query UTXO
+    address_utxos = await query_utxos(payment_address)
 
     # Calculate total lovelace of the UTXO(s) inside the wallet address
-    utxo_table_rows = raw_utxo_table.strip().splitlines()
     sum_lovelace_utxo = 0
     utxo_count = 0
     utxo_list = []
-    for x in range(2, len(utxo_table_rows)):
-        cells = utxo_table_rows[x].split()
+    for utxo in address_utxos:
         # If utxo includes a token -> skip
-        if len(cells) > 6:
+        if not utxo.ada_only:
             continue
 
-        utxo_list.append(cells[:3])
-        sum_lovelace_utxo += int(cells[2])
+        utxo_list.append(utxo)
+        sum_lovelace_utxo += utxo.lovelace
         utxo_count += 1
         # Stop when txs' lovelace equals or exceeds the sending amount
         if sum_lovelace_utxo >= lovelace:
@@ -57,56 +44,45 @@ def send_lovelace(sender_address, signing_key_path, recipient_address, lovelace,
     if utxo_count == 0:
         raise ValueError("The address is empty.")
 
-    # Convert utf-8 to normal string
-    for utxo in utxo_list:
-        for i in range(len(utxo)):
-            utxo[i] = utxo[i].decode('utf-8')
-
     # Build the transaction draft
     _id = get_unique_id()
     draft_path = f'transactions/tx_{_id}.draft'
     tx_in = []
     for utxo in utxo_list:
-        tx_in += ['--tx-in', f'{utxo[0]}#{utxo[1]}']
+        tx_in += ['--tx-in', utxo.txin]
     net = None
     if NETWORK == 'mainnet':
         net = ['--mainnet']
     elif NETWORK == 'testnet':
         net = ['--testnet-magic', str(TESTNET_MAGIC)]
 
-    try:
-        if sender_cover_fee is True:
-            build_parameters = [CARDANO_CLI_PATH, 'transaction', 'build']
-            build_parameters += tx_in
-            build_parameters += ['--tx-out', f'{recipient_address}+{lovelace}', f'--change-address={payment_address}']
-            build_parameters += net
-            build_parameters += ['--out-file', draft_path,
-                                 '--alonzo-era']
-        else:
-            build_parameters = [CARDANO_CLI_PATH, 'transaction', 'build']
-            build_parameters += tx_in
-            build_parameters += ['--tx-out', f'{payment_address}+{sum_lovelace_utxo - lovelace}',
-                                 f'--change-address={recipient_address}']
-            build_parameters += net
-            build_parameters += ['--out-file', draft_path, '--alonzo-era']
-        subprocess.check_call(build_parameters, env=my_env)
-    except subprocess.CalledProcessError:
+    if sender_cover_fee is True:
+        build_parameters = [CARDANO_CLI_PATH, 'transaction', 'build']
+        build_parameters += tx_in
+        build_parameters += ['--tx-out', f'{recipient_address}+{lovelace}', f'--change-address={payment_address}']
+        build_parameters += net
+        build_parameters += ['--out-file', draft_path,
+                             '--alonzo-era']
+    else:
+        build_parameters = [CARDANO_CLI_PATH, 'transaction', 'build']
+        build_parameters += tx_in
+        build_parameters += ['--tx-out', f'{payment_address}+{sum_lovelace_utxo - lovelace}',
+                             f'--change-address={recipient_address}']
+        build_parameters += net
+        build_parameters += ['--out-file', draft_path, '--alonzo-era']
+    output = await coroutine_run_command(build_parameters, _env=my_env)
+    if type(output) is subprocess.CalledProcessError:
         return False
 
     # Sign the transaction draft
-    signed_path = f'transactions/tx_{_id}.signed'
-    sign_parameters = [CARDANO_CLI_PATH, 'transaction', 'sign',
-                       '--tx-body-file', draft_path,
-                       '--signing-key-file', signing_key_path]
-    sign_parameters += net
-    sign_parameters += ['--out-file', signed_path]
-    subprocess.check_call(sign_parameters, env=my_env)
+    signed_tx = await sign_transaction(draft_path, signing_key_path)
+    if type(signed_tx) is subprocess.CalledProcessError:
+        raise signed_tx
 
     # Submit the transaction
-    submit_parameters = [CARDANO_CLI_PATH, 'transaction', 'submit',
-                         '--tx-file', signed_path]
-    submit_parameters += net
-    result = subprocess.check_output(submit_parameters, env=my_env)
+    result = await submit_tx(signed_tx)
+    if type(result) is subprocess.CalledProcessError:
+        raise result
     print(f'Send {lovelace} lovelace\nFrom: {payment_address}\nTo: {recipient_address}\n' +
           f'Sender covers fee: {sender_cover_fee}')
     print(result.decode('utf-8'))
@@ -114,13 +90,12 @@ def send_lovelace(sender_address, signing_key_path, recipient_address, lovelace,
     # Clean transaction building info
     try:
         os.remove(draft_path)
-        os.remove(signed_path)
     except FileNotFoundError as e:
         print(f'send_lovelace: {e.errno}')
     return True
 
 
-def send_all_remaining_lovelace(sender_address, signing_key_path, recipient_address):
+async def send_all_remaining_lovelace(sender_address, signing_key_path, recipient_address):
     # Tools: cardano-cli
     # Description: Send all lovelace available in the sender address to recipient address.
     #              The recipient will cover network fee.
@@ -134,49 +109,31 @@ def send_all_remaining_lovelace(sender_address, signing_key_path, recipient_addr
 
     payment_address = sender_address
 
-    # Query UTXO and read the output
-    raw_utxo_table = None
-    if NETWORK == 'mainnet':
-        raw_utxo_table = subprocess.check_output([
-            CARDANO_CLI_PATH, 'query', 'utxo',
-            '--mainnet',
-            '--address', payment_address], env=my_env)
-    elif NETWORK == 'testnet':
-        raw_utxo_table = subprocess.check_output([
-            CARDANO_CLI_PATH, 'query', 'utxo',
-            '--testnet-magic', TESTNET_MAGIC,
-            '--address', payment_address], env=my_env)
-    # print(raw_utxo_table[2])
+    # Query UTXO
+    address_utxos = await query_utxos(payment_address)
 
     # Calculate total lovelace of the UTXO(s) inside the wallet address
-    utxo_table_rows = raw_utxo_table.strip().splitlines()
     sum_lovelace_utxo = 0
     utxo_count = 0
     utxo_list = []
-    for x in range(2, len(utxo_table_rows)):
-        cells = utxo_table_rows[x].split()
+    for utxo in address_utxos:
         # If utxo includes a token -> raise error and exit
-        if len(cells) > 6:
+        if not utxo.ada_only:
             raise ValueError("There's at least 1 token inside the wallet. The wallet should have lovelace only.")
-        utxo_list.append(cells[:3])
-        sum_lovelace_utxo += int(cells[2])
+        utxo_list.append(utxo)
+        sum_lovelace_utxo += utxo.lovelace
         utxo_count += 1
 
     # Return if wallet's empty
     if utxo_count == 0:
         raise ValueError("The address is empty.")
 
-    # Convert utf-8 to normal string
-    for utxo in utxo_list:
-        for i in range(len(utxo)):
-            utxo[i] = utxo[i].decode('utf-8')
-
     # Build the transaction draft
     _id = get_unique_id()
     draft_path = f'transactions/tx_{_id}.draft'
     tx_in = []
     for utxo in utxo_list:
-        tx_in += ['--tx-in', f'{utxo[0]}#{utxo[1]}']
+        tx_in += ['--tx-in', utxo.txin]
     net = None
     if NETWORK == 'mainnet':
         net = ['--mainnet']
@@ -189,22 +146,19 @@ def send_all_remaining_lovelace(sender_address, signing_key_path, recipient_addr
         f'--change-address={recipient_address}']
     build_parameters += net
     build_parameters += ['--out-file', draft_path, '--alonzo-era']
-    subprocess.check_call(build_parameters, env=my_env)
+    output = await coroutine_run_command(build_parameters, _env=my_env)
+    if type(output) is subprocess.CalledProcessError:
+        raise output
 
     # Sign the transaction draft
-    signed_path = f'transactions/tx_{_id}.signed'
-    sign_parameters = [CARDANO_CLI_PATH, 'transaction', 'sign',
-                       '--tx-body-file', draft_path,
-                       '--signing-key-file', signing_key_path]
-    sign_parameters += net
-    sign_parameters += ['--out-file', signed_path]
-    subprocess.check_call(sign_parameters, env=my_env)
+    signed_tx = await sign_transaction(draft_path, signing_key_path)
+    if type(signed_tx) is subprocess.CalledProcessError:
+        raise signed_tx
 
     # Submit the transaction
-    submit_parameters = [CARDANO_CLI_PATH, 'transaction', 'submit',
-                         '--tx-file', signed_path]
-    submit_parameters += net
-    result = subprocess.check_output(submit_parameters, env=my_env)
+    result = await submit_tx(signed_tx)
+    if type(result) is subprocess.CalledProcessError:
+        raise result
     print(f'Send {sum_lovelace_utxo} lovelace\nFrom: {payment_address}\nTo: {recipient_address}'
           + '\nSender covers fee: False')
     print(result.decode('utf-8'))
@@ -212,13 +166,12 @@ def send_all_remaining_lovelace(sender_address, signing_key_path, recipient_addr
     # Clean transaction building info
     try:
         os.remove(draft_path)
-        os.remove(signed_path)
     except FileNotFoundError as e:
         print(f'send_all_remaining_lovelace: {e.errno}')
     return True
 
 
-def refund_all_ada_utxos(payment_address, signing_key_path):
+async def refund_all_ada_utxos(payment_address, signing_key_path):
     # Description: Return all ADA utxos which have more than 2 ADA
     # Parameters:
     #           payment_address: payment address
@@ -229,33 +182,16 @@ def refund_all_ada_utxos(payment_address, signing_key_path):
     if not os.path.isdir('transactions'):
         os.makedirs('transactions')
 
-    # Query UTXO and read the output
-    raw_utxo_table = None
-    if NETWORK == 'mainnet':
-        raw_utxo_table = subprocess.check_output([
-            CARDANO_CLI_PATH, 'query', 'utxo',
-            '--mainnet',
-            '--address', payment_address], env=my_env)
-    elif NETWORK == 'testnet':
-        raw_utxo_table = subprocess.check_output([
-            CARDANO_CLI_PATH, 'query', 'utxo',
-            '--testnet-magic', TESTNET_MAGIC,
-            '--address', payment_address], env=my_env)
-    # print(raw_utxo_table[2])
+    # Query UTXO
+    address_utxos = await query_utxos(payment_address)
 
     utxo_list = []
     # Calculate total lovelace of the UTXO(s) inside the wallet address
-    utxo_table_rows = raw_utxo_table.strip().splitlines()
-    for x in range(2, len(utxo_table_rows)):
-        cells = utxo_table_rows[x].split()
+    for utxo in address_utxos:
         # If utxo includes a token or lovelace < 2 000 000 -> skip
-        if len(cells) > 6 or int(cells[2].decode('utf-8')) < 2000000:
+        if not utxo.ada_only or utxo.lovelace < 2000000:
             continue
-        utxo_list.append(cells[:3])
-
-    for utxo in utxo_list:
-        for i in range(len(utxo)):
-            utxo[i] = utxo[i].decode('utf-8')
+        utxo_list.append(utxo)
 
     if NETWORK == 'mainnet':
         net = ['--mainnet']
@@ -263,10 +199,9 @@ def refund_all_ada_utxos(payment_address, signing_key_path):
         net = ['--testnet-magic', str(TESTNET_MAGIC)]
 
     txid_list = []
-    signed_path = ''
     draft_path = ''
     for utxo in utxo_list:
-        tx = get_transaction_content(utxo[0])
+        tx = await get_transaction_content(utxo.tx_hash)
         sender_utxo_address = tx['inputs'][0]['address']
         print(sender_utxo_address)
 
@@ -274,57 +209,44 @@ def refund_all_ada_utxos(payment_address, signing_key_path):
         _id = get_unique_id()
         draft_path = f'transactions/tx_{_id}.draft'
         build_parameters = [CARDANO_CLI_PATH, 'transaction', 'build']
-        build_parameters += ['--tx-in', f'{utxo[0]}#{utxo[1]}']
+        build_parameters += ['--tx-in', utxo.txin]
         build_parameters += [f'--change-address={sender_utxo_address}']
         build_parameters += net
         build_parameters += ['--out-file', draft_path, '--alonzo-era']
-        try:
-            subprocess.check_call(build_parameters, env=my_env)
-        except subprocess.CalledProcessError:
+        output = await coroutine_run_command(build_parameters, _env=my_env)
+        if type(output) is subprocess.CalledProcessError:
             raise ValueError('refund_all_ada_utxos: Error in building transaction step')
 
         # Sign the transaction draft
-        signed_path = f'transactions/tx_{_id}.signed'
-        sign_parameters = [CARDANO_CLI_PATH, 'transaction', 'sign',
-                           '--tx-body-file', draft_path,
-                           '--signing-key-file', signing_key_path]
-        sign_parameters += net
-        sign_parameters += ['--out-file', signed_path]
-        try:
-            subprocess.check_call(sign_parameters, env=my_env)
-        except subprocess.CalledProcessError:
+        signed_tx = await sign_transaction(draft_path, signing_key_path)
+        if type(signed_tx) is subprocess.CalledProcessError:
             raise ValueError('refund_all_ada_utxos: Error in signing transaction step')
 
         # Submit the transaction
-        submit_parameters = [CARDANO_CLI_PATH, 'transaction', 'submit',
-                             '--tx-file', signed_path]
-        submit_parameters += net
-        try:
-            result = subprocess.check_output(submit_parameters, env=my_env)
-        except subprocess.CalledProcessError:
+        result = await submit_tx(signed_tx)
+        if type(result) is subprocess.CalledProcessError:
             raise ValueError('refund_all_ada_utxos: Error in submit transaction step')
 
-        print(f'Send {utxo[2]} lovelace\nFrom: {payment_address}\nTo: {sender_utxo_address}'
+        print(f'Send {utxo.lovelace} lovelace\nFrom: {payment_address}\nTo: {sender_utxo_address}'
               + '\nSender covers fee: False')
         print(result.decode('utf-8'))
 
         # Record the txid
-        txid_parameters = [CARDANO_CLI_PATH, 'transaction', 'txid', '--tx-file', signed_path]
-        txid_list.append(subprocess.check_output(txid_parameters, env=my_env))
+        txid = get_tx_id(signed_tx)
+        txid_list.append(txid)
 
     json_txid = []
     for txid in txid_list:
-        json_txid.append({'txid': txid.decode('utf-8').strip('\n')})
+        json_txid.append({'txid': txid})
 
     try:
-        os.remove(signed_path)
         os.remove(draft_path)
     except FileNotFoundError as e:
         print(f'refund_all_ada_utxos: {e.errno}')
     return json_txid
 
 
-def return_all_utxos(payment_address, signing_key_path):
+async def return_all_utxos(payment_address, signing_key_path):
     # Description: return all both ADA and non-ADA utxos in the payment address to its original owner
     # Requirement: unless the wallet has non-asset utxo containing equal or more than 2 ADA to cover network fee,
     #               the method will raise error
@@ -341,12 +263,12 @@ def return_all_utxos(payment_address, signing_key_path):
         net = ['--testnet-magic', str(TESTNET_MAGIC)]
 
     # Query utxo
-    utxo_list = query_utxos(payment_address)
+    utxo_list = await query_utxos(payment_address)
 
     # Find sender address
     from_address = [''] * len(utxo_list)
     for i, utxo in enumerate(utxo_list):
-        tx = get_transaction_content(utxo[0])
+        tx = await get_transaction_content(utxo.tx_hash)
         sender_utxo_address = tx['inputs'][0]['address']
         from_address[i] = sender_utxo_address
 
@@ -357,19 +279,15 @@ def return_all_utxos(payment_address, signing_key_path):
 
     # tx-in
     for utxo in utxo_list:
-        build_parameters += ['--tx-in', f'{utxo[0]}#{utxo[1]}']
+        build_parameters += ['--tx-in', utxo.txin]
 
     # tx-out
     cover_utxo_address = ''
     for i, utxo in enumerate(utxo_list):
-        if len(utxo) <= 6 and int(utxo[2]) >= 2000000 and cover_utxo_address == '':
+        if utxo.ada_only and utxo.lovelace >= 2000000 and cover_utxo_address == '':
             cover_utxo_address = from_address[i]
             continue
-        if len(utxo) <= 6:
-            build_parameters += ['--tx-out', f'{from_address[i]}+{utxo[2]}']
-        else:
-            build_parameters += ['--tx-out', f'{from_address[i]}+{utxo[2]}'
-                                             f'+{utxo[5]} {utxo[6]}']
+        build_parameters += ['--tx-out', f'{from_address[i]}+{utxo.value()}']
 
     # # Raise error if there's not enough fund to cover network fee
     # if cover_utxo_address == '':
@@ -386,44 +304,27 @@ def return_all_utxos(payment_address, signing_key_path):
 
     build_parameters += net
     build_parameters += ['--out-file', draft_path, '--alonzo-era']
-    try:
-        subprocess.check_call(build_parameters, env=my_env)
-    except subprocess.CalledProcessError:
+    output = await coroutine_run_command(build_parameters, _env=my_env)
+    if type(output) is subprocess.CalledProcessError:
         raise ValueError('refund_all_utxos: Error in building transaction')
 
     # Sign the transaction draft
-    signed_path = f'transactions/tx_{_id}.signed'
-    sign_parameters = [CARDANO_CLI_PATH, 'transaction', 'sign',
-                       '--tx-body-file', draft_path,
-                       '--signing-key-file', signing_key_path]
-    sign_parameters += net
-    sign_parameters += ['--out-file', signed_path]
-    try:
-        subprocess.check_call(sign_parameters, env=my_env)
-    except subprocess.CalledProcessError:
+    signed_tx = await sign_transaction(draft_path, signing_key_path)
+    if type(signed_tx) is subprocess.CalledProcessError:
         raise ValueError('refund_all_utxos: Error in signing transaction')
 
     # Submit the transaction
-    submit_parameters = [CARDANO_CLI_PATH, 'transaction', 'submit',
-                         '--tx-file', signed_path]
-    submit_parameters += net
-    try:
-        result = subprocess.check_output(submit_parameters, env=my_env)
-    except subprocess.CalledProcessError:
+    result = await submit_tx(signed_tx)
+    if type(result) is subprocess.CalledProcessError:
         raise ValueError('refund_all_utxos: Error at submit transaction step.')
     print(result.decode('utf-8'))
 
     # Record the txid
-    txid_parameters = [CARDANO_CLI_PATH, 'transaction', 'txid', '--tx-file', signed_path]
-    try:
-        txid = subprocess.check_output(txid_parameters, env=my_env)
-    except subprocess.CalledProcessError:
-        raise ValueError('refund_all_utxos: Error at getting outgoing txid')
-    txid = [{'txid': txid.decode('utf-8').strip('\n')}]
+    txid = get_tx_id(signed_tx)
+    txid = [{'txid': txid}]
 
     # Clean transaction files
     try:
-        os.remove(signed_path)
         os.remove(draft_path)
     except FileNotFoundError as e:
         print(f'refund_all_utxos: {e.errno}')
@@ -431,7 +332,7 @@ def return_all_utxos(payment_address, signing_key_path):
     return txid
 
 
-def return_all_registered_utxos(payment_address, signing_key_path, stake_list):
+async def return_all_registered_utxos(payment_address, signing_key_path, stake_list):
     # Description: return all registered utxos in the payment address to its original owner
     # Requirement: unless the wallet has non-asset utxo containing equal or more than 2 ADA to cover network fee,
     #               the method will raise error
@@ -448,15 +349,15 @@ def return_all_registered_utxos(payment_address, signing_key_path, stake_list):
         net = ['--testnet-magic', str(TESTNET_MAGIC)]
 
     # Query utxo
-    utxo_list = query_utxos(payment_address)
+    utxo_list = await query_utxos(payment_address)
 
     # Find sender address
     utxo_mark = [0] * len(utxo_list)
     from_address = [''] * len(utxo_list)
     for i, utxo in enumerate(utxo_list):
-        tx = get_transaction_content(utxo[0])
+        tx = await get_transaction_content(utxo.tx_hash)
         sender_utxo_address = tx['inputs'][0]['address']
-        sender_stake_address = get_stake_address(sender_utxo_address)
+        sender_stake_address = await get_stake_address(sender_utxo_address)
         if sender_stake_address in stake_list:
             utxo_mark[i] = 1
             from_address[i] = sender_utxo_address
@@ -470,21 +371,17 @@ def return_all_registered_utxos(payment_address, signing_key_path, stake_list):
     # tx-in
     for i, utxo in enumerate(utxo_list):
         if utxo_mark[i] == 1:
-            build_parameters += ['--tx-in', f'{utxo[0]}#{utxo[1]}']
+            build_parameters += ['--tx-in', utxo.txin]
 
     # tx-out
     cover_utxo_address = ''
     for i, utxo in enumerate(utxo_list):
         if utxo_mark[i] == 1:
             print(i)
-            if len(utxo) <= 6 and int(utxo[2]) >= 2000000 and cover_utxo_address == '':
+            if utxo.ada_only and utxo.lovelace >= 2000000 and cover_utxo_address == '':
                 cover_utxo_address = from_address[i]
                 continue
-            if len(utxo) <= 6:
-                build_parameters += ['--tx-out', f'{from_address[i]}+{utxo[2]}']
-            else:
-                build_parameters += ['--tx-out', f'{from_address[i]}+{utxo[2]}'
-                                                 f'+{utxo[5]} {utxo[6]}']
+            build_parameters += ['--tx-out', f'{from_address[i]}+{utxo.value()}']
     if cover_utxo_address == '':
         print('refund_all_utxos: Not enough fund to cover network fee.')
         return []
@@ -495,44 +392,27 @@ def return_all_registered_utxos(payment_address, signing_key_path, stake_list):
 
     build_parameters += net
     build_parameters += ['--out-file', draft_path, '--alonzo-era']
-    try:
-        subprocess.check_call(build_parameters, env=my_env)
-    except subprocess.CalledProcessError:
+    output = await coroutine_run_command(build_parameters, _env=my_env)
+    if type(output) is subprocess.CalledProcessError:
         raise ValueError('refund_all_registered_utxos: Error in building transaction')
 
     # Sign the transaction draft
-    signed_path = f'transactions/tx_{_id}.signed'
-    sign_parameters = [CARDANO_CLI_PATH, 'transaction', 'sign',
-                       '--tx-body-file', draft_path,
-                       '--signing-key-file', signing_key_path]
-    sign_parameters += net
-    sign_parameters += ['--out-file', signed_path]
-    try:
-        subprocess.check_call(sign_parameters, env=my_env)
-    except subprocess.CalledProcessError:
+    signed_tx = await sign_transaction(draft_path, signing_key_path)
+    if type(signed_tx) is subprocess.CalledProcessError:
         raise ValueError('refund_all_registered_utxos: Error in signing transaction')
 
     # Submit the transaction
-    submit_parameters = [CARDANO_CLI_PATH, 'transaction', 'submit',
-                         '--tx-file', signed_path]
-    submit_parameters += net
-    try:
-        result = subprocess.check_output(submit_parameters, env=my_env)
-    except subprocess.CalledProcessError:
+    result = await submit_tx(signed_tx)
+    if type(result) is subprocess.CalledProcessError:
         raise ValueError('refund_all_registered_utxos: Error at submit transaction step. Possibly wrong signing key')
     print(result.decode('utf-8'))
 
     # Record the txid
-    txid_parameters = [CARDANO_CLI_PATH, 'transaction', 'txid', '--tx-file', signed_path]
-    try:
-        txid = subprocess.check_output(txid_parameters, env=my_env)
-    except subprocess.CalledProcessError:
-        raise ValueError('refund_all_registered_utxos: Error at getting outgoing txid')
-    txid = [{'txid': txid.decode('utf-8').strip('\n')}]
+    txid = get_tx_id(signed_tx)
+    txid = [{'txid': txid}]
 
     # Clean transaction files
     try:
-        os.remove(signed_path)
         os.remove(draft_path)
     except FileNotFoundError as e:
         print(f'refund_all_registered_utxos: {e.errno}')
@@ -540,7 +420,7 @@ def return_all_registered_utxos(payment_address, signing_key_path, stake_list):
     return txid
 
 
-def get_transaction_body(sender_stake_address, package):
+async def get_transaction_body(sender_stake_address, package):
     """
     Send ADA from one address to multiple addresses in one transaction
     :param sender_stake_address:
@@ -563,7 +443,7 @@ def get_transaction_body(sender_stake_address, package):
         net = ['--testnet-magic', str(TESTNET_MAGIC)]
 
     # Create protocol.json
-    protocol_path = get_protocol_file_path()
+    protocol_path = await get_protocol_file_path()
 
     # Calculate total amount of ADA and assets needed to send
     package_balance = {}
@@ -585,7 +465,7 @@ def get_transaction_body(sender_stake_address, package):
         print(f'unit: {key}\nquantity: {package_balance[key]} ')
 
     # Check if the sender wallet has enough funds and assets to send
-    response_list = get_address_list_by_stake_address(sender_stake_address)
+    response_list = await get_address_list_by_stake_address(sender_stake_address)
     print(f'response_list: {response_list}')
     sender_address_list = []
     for address in response_list:
@@ -593,8 +473,8 @@ def get_transaction_body(sender_stake_address, package):
     sender_address = sender_address_list[0]
 
     utxo_list = []
-    for address in sender_address_list:
-        utxo_list += query_utxos(address)
+    for address_utxos in (await query_utxos_batch(sender_address_list)).values():
+        utxo_list += address_utxos
 
     sender_balance = {}
     for utxo in utxo_list:
@@ -625,7 +505,7 @@ def get_transaction_body(sender_stake_address, package):
                 'quantity': f'{amount[key]}'
             })
         tx_out = f"{p['address']}+{'+'.join(txout_records)}"
-        min_lovelace = calculate_min_required_utxo(tx_out)
+        min_lovelace = await calculate_min_required_utxo(tx_out)
         if int(min_lovelace) > 1000000:
             txout_records = []
             amount_records = []
@@ -668,8 +548,8 @@ def get_transaction_body(sender_stake_address, package):
         print(f'utxo: {utxo}')
         temp = add_utxo_to_dict(temp, utxo)
         mark_list[i] = 1
-        txin_list.append(f'{utxo[0]}#{utxo[1]}')
-        response['input'].append({'txhash': utxo[0], 'index': utxo[1]})
+        txin_list.append(utxo.txin)
+        response['input'].append({'txhash': utxo.tx_hash, 'index': str(utxo.index)})
         if check_enough_fund(temp, package_balance):
             # Calculate remaining asset/ADA for utxos marked
             change_list = temp.copy()
@@ -688,7 +568,7 @@ def get_transaction_body(sender_stake_address, package):
                     })
             tx_out = f"{sender_address}+{'+'.join(txout_records)}"
             if len(txout_records) > 0:
-                min_lovelace = calculate_min_required_utxo(tx_out)
+                min_lovelace = await calculate_min_required_utxo(tx_out)
             else:
                 min_lovelace = 0
             if 0 < min_lovelace <= change_list['lovelace']:
@@ -700,7 +580,7 @@ def get_transaction_body(sender_stake_address, package):
                 # })
                 # print(f'txin_list: {txin_list}')
                 # print(f'txout_list: {txout_list}')
-                fee = calculate_fee(txin_list, txout_list, protocol_path)
+                fee = await calculate_fee(txin_list, txout_list, protocol_path)
 
                 # If have enough ADA to cover fee -> proceed
                 if change_list['lovelace'] - fee >= min_lovelace:
@@ -740,94 +620,39 @@ def get_transaction_body(sender_stake_address, package):
     return response
 
 
-def sign_and_submit_transaction(draft_path, signing_key_path, _id):
-    net = None
-    if NETWORK == 'mainnet':
-        net = ['--mainnet']
-    elif NETWORK == 'testnet':
-        net = ['--testnet-magic', str(TESTNET_MAGIC)]
-
-    # Create transaction path
-    if not os.path.isdir('transactions'):
-        os.makedirs('transactions')
-
+async def sign_and_submit_transaction(draft_path, signing_key_path, _id):
     # Sign
-    signed_path = f'transactions/tx_{_id}.signed'
-    sign_parameters = [CARDANO_CLI_PATH, 'transaction', 'sign',
-                       '--tx-body-file', draft_path,
-                       '--signing-key-file', signing_key_path]
-    sign_parameters += net
-    sign_parameters += ['--out-file', signed_path]
-    try:
-        subprocess.check_call(sign_parameters, env=my_env)
-    except subprocess.CalledProcessError:
+    signed_tx = await sign_transaction(draft_path, signing_key_path)
+    if type(signed_tx) is subprocess.CalledProcessError:
         raise ValueError('sign_and_submit_transaction: Error in signing transaction')
 
     # Submit
-    submit_parameters = [CARDANO_CLI_PATH, 'transaction', 'submit',
-                         '--tx-file', signed_path]
-    submit_parameters += net
-
-    try:
-        result = subprocess.check_output(submit_parameters, env=my_env)
-    except subprocess.CalledProcessError:
+    result = await submit_tx(signed_tx)
+    if type(result) is subprocess.CalledProcessError:
         raise ValueError('sign_and_submit_transaction: Error at submit transaction step.')
     print(result.decode('utf-8'))
 
     # Record the txid
-    txid_parameters = [CARDANO_CLI_PATH, 'transaction', 'txid', '--tx-file', signed_path]
-    try:
-        txid = subprocess.check_output(txid_parameters, env=my_env)
-    except subprocess.CalledProcessError:
-        raise ValueError('sign_and_submit_transaction: Error at getting outgoing txid')
+    return get_tx_id(signed_tx)
 
-    # Clean files
-    try:
-        os.remove(signed_path)
-    except FileNotFoundError:
-        raise ValueError('sign_and_submit_transaction: File not found while cleaning files')
-    return txid.decode('utf-8').strip('\n')
 
+async def submit_transaction(signed_path, envelope=None):
+    # envelope: the signed text envelope when already in memory, submitted without reading signed_path
+    if envelope is None:
+        with open(signed_path, 'r') as file:
+            envelope = json.load(file)
 
-def submit_transaction(signed_path):
-    net = None
-    if NETWORK == 'mainnet':
-        net = ['--mainnet']
-    elif NETWORK == 'testnet':
-        net = ['--testnet-magic', str(TESTNET_MAGIC)]
-
-    submit_parameters = [CARDANO_CLI_PATH, 'transaction', 'submit',
-                         '--tx-file', signed_path]
-    submit_parameters += net
-
-    try:
-        result = subprocess.check_output(submit_parameters, env=my_env)
-    except subprocess.CalledProcessError as e:
+    result = await submit_tx(envelope, signed_path)
+    if type(result) is subprocess.CalledProcessError:
         raise ValueError('submit_transaction: Error when submit transaction')
         # return {'error': e.stderr}
     print(result.decode('utf-8'))
 
     # Record the txid
-    txid_parameters = [CARDANO_CLI_PATH, 'transaction', 'txid', '--tx-file', signed_path]
-    try:
-        txid = subprocess.check_output(txid_parameters, env=my_env)
-    except subprocess.CalledProcessError as e:
-        raise ValueError('submit_transaction: Error at getting transaction id')
-
-    return txid.decode('utf-8').strip('\n')
-
-
-def get_txid(signed_path):
-    net = None
-    if NETWORK == 'mainnet':
-        net = ['--mainnet']
-    elif NETWORK == 'testnet':
-        net = ['--testnet-magic', str(TESTNET_MAGIC)]
-
-    txid_parameters = [CARDANO_CLI_PATH, 'transaction', 'txid', '--tx-file', signed_path]
+    return get_tx_id(envelope)
 
-    txid = run_command(txid_parameters, my_env)
-    if type(txid) is subprocess.CalledProcessError:
-        raise txid
 
-    return txid.decode('utf-8').strip('\n')
+async def get_txid(signed_path):
+    with open(signed_path, 'r') as file:
+        envelope = json.load(file)
+    return get_tx_id(envelope)
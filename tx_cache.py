@@ -0,0 +1,115 @@
+import collections
+import json
+import sqlite3
+import threading
+
+"""
+Contents of confirmed transactions, which never change once a rollback can no longer drop them
+"""
+
+
+class TxContentCache:
+    """
+    LRU of transaction contents in memory in front of a SQLite file. Transactions are only admitted once they are
+    enough blocks deep, so an entry never has to be invalidated. Safe to use from executor threads
+    """
+
+    def __init__(self, path, max_entries, confirmations):
+        """
+        :param path: SQLite file, None keeps the memory tier only
+        :param max_entries: contents kept in memory, and block heights remembered for transactions not admitted yet
+        :param confirmations: blocks, counting its own, a transaction must be under before it is admitted
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.confirmations = confirmations
+        self._db = None
+        self._lock = threading.Lock()
+        # tx hash -> content JSON text, decoded on every hit so callers can't alter the cached copy
+        self._entries = collections.OrderedDict()
+        # tx hash -> block height, for transactions too recent to admit
+        self._heights = collections.OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def _database(self):
+        # Opened on first use, from whichever thread gets there first
+        if self._db is None and self.path is not None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            with self._db:
+                self._db.execute('CREATE TABLE IF NOT EXISTS txs (hash TEXT PRIMARY KEY, content TEXT NOT NULL)')
+        return self._db
+
+    def get(self, tx_hash):
+        """
+        :return: decoded content, None when the transaction isn't cached
+        """
+        with self._lock:
+            text = self._entries.get(tx_hash)
+            if text is not None:
+                self._entries.move_to_end(tx_hash)
+                self.memory_hits += 1
+            else:
+                db = self._database()
+                row = db.execute('SELECT content FROM txs WHERE hash = ?', (tx_hash,)).fetchone() if db else None
+                if row is None:
+                    self.misses += 1
+                    return None
+                text = row[0]
+                self._remember(tx_hash, text)
+                self.disk_hits += 1
+        return json.loads(text)
+
+    def admit(self, tx_hash, content, confirmations):
+        """
+        Keep the content of a transaction that is deep enough
+        :param confirmations: blocks the transaction is under, counting its own
+        :return: True when it was stored
+        """
+        if confirmations < self.confirmations:
+            return False
+        text = json.dumps(content)
+        with self._lock:
+            self._remember(tx_hash, text)
+            self._heights.pop(tx_hash, None)
+            db = self._database()
+            if db is not None:
+                with db:
+                    db.execute('INSERT OR REPLACE INTO txs VALUES (?, ?)', (tx_hash, text))
+            self.stores += 1
+        return True
+
+    def height(self, tx_hash):
+        with self._lock:
+            return self._heights.get(tx_hash)
+
+    def remember_height(self, tx_hash, block_height):
+        with self._lock:
+            self._heights[tx_hash] = block_height
+            while len(self._heights) > self.max_entries:
+                self._heights.popitem(last=False)
+
+    def _remember(self, tx_hash, text):
+        self._entries[tx_hash] = text
+        self._entries.move_to_end(tx_hash)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'pending_heights': len(self._heights),
+            'confirmations': self.confirmations,
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'stores': self.stores,
+        }
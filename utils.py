@@ -1,13 +1,27 @@
-import requests
 import subprocess
 import json
 import yaml
 import logging
 import time
+import collections
 from datetime import datetime
 from uuid import uuid4
 
 from enums import *
+from scheduler import *
+from ouroboros import *
+from utxo import *
+from signing import *
+from address import *
+from wallet_pool import *
+from tip_watcher import *
+from utxo_cache import *
+from watch_set import *
+from chain_follower import *
+from mempool_watcher import *
+from blockfrost import *
+from tx_cache import *
+from trade_watchlist import *
 import inspect
 import asyncio
 
@@ -38,15 +52,31 @@ def run_command(command, _env, timeout=None, stderr=subprocess.STDOUT):
     return output
 
 
-async def coroutine_run_command(command, _env, timeout=None, stderr=subprocess.STDOUT):
-    # TODO
+async def coroutine_run_command(command, _env, timeout=COMMAND_TIMEOUT, stderr=subprocess.STDOUT):
+    # Description: Non-blocking counterpart of run_command for the Quart handlers.
+    #               Output is captured the same way, a non-zero exit code is returned as
+    #               subprocess.CalledProcessError and a timeout kills the process and raises
+    #               subprocess.TimeoutExpired. Processes are started through the scheduler, which
+    #               bounds concurrency per command class and runs settlement calls first
     logger = logging.getLogger("default")
     func = inspect.currentframe().f_back.f_code
     logger.info("Caller: %s() - File: %s - LineNo: %s", func.co_name, func.co_filename, func.co_firstlineno)
     logger.info("Execute command: %s", command)
-    try:
-        output = await asyncio.create_subprocess_shell(command, env=_env, timeout=timeout, stderr=stderr)
-    except subprocess.CalledProcessError as exp:
+    async with scheduler.slot(command):
+        process = await asyncio.create_subprocess_exec(*command, env=_env,
+                                                       stdout=asyncio.subprocess.PIPE, stderr=stderr)
+        try:
+            output, error = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.communicate()
+            logger.error("Execution timeout after %s seconds: %s", timeout, command)
+            raise subprocess.TimeoutExpired(command, timeout)
+        except asyncio.CancelledError:
+            process.kill()
+            raise
+    if process.returncode != 0:
+        exp = subprocess.CalledProcessError(process.returncode, command, output=output, stderr=error)
         logger.error("Execution error: %s", exp.output)
         return exp
     logger.debug("Execution DONE!")
@@ -63,114 +93,227 @@ def get_unique_id():
     return event_id
 
 
-def query_utxos(address):
-    # Description: Return available utxos information in the address
-    start = time.time()
-    raw_utxo_table = None
-    # cardano-cli query utxo
-    if NETWORK == 'mainnet':
-        raw_utxo_table = run_command([CARDANO_CLI_PATH, 'query', 'utxo',
-                                      '--mainnet',
-                                      '--address', address], _env=my_env)
-    elif NETWORK == 'testnet':
-        raw_utxo_table = run_command([
-            CARDANO_CLI_PATH, 'query', 'utxo',
-            '--testnet-magic', TESTNET_MAGIC,
-            '--address', address], _env=my_env)
-    if type(raw_utxo_table) is subprocess.CalledProcessError:
-        pass
-        raise raw_utxo_table
-
-    # Get utxos
-    if type(raw_utxo_table) is subprocess.CalledProcessError:
-        raise raw_utxo_table
+query_flight = SingleFlight()
+utxo_cache = UTxOCache(UTXO_CACHE_TTL, UTXO_CACHE_MAX_ENTRIES, UTXO_CACHE_MAX_MB * 1024 * 1024)
 
-    utxo_list = []
-    utxo_table_rows = raw_utxo_table.strip().splitlines()
-    for x in range(2, len(utxo_table_rows)):
-        cells = utxo_table_rows[x].split()
-        for i in range(len(cells)):
-            cells[i] = cells[i].decode('utf-8').strip('"')
-        utxo_list.append(cells)
 
+async def query_utxos(address):
+    # Description: Return available utxos in the address as a list of UTxO
+    #               Reads from the node socket when NODE_CLIENT is 'native', otherwise (or when the
+    #               socket can't be used) through cardano-cli. Concurrent queries for the same
+    #               address share one call, and the result is reused until the tip watcher sees a new block
+    point = tip_watcher.point
+    stamp = utxo_cache.stamp()
+    if point is not None:
+        utxo_list = utxo_cache.get(address, point)
+        if utxo_list is not None:
+            return list(utxo_list)
+
+    start = time.time()
+    utxo_list = await _fetch_utxos(address)
     print(f'query_utxos {address}: {time.time() - start} seconds')
+    if point is not None:
+        utxo_cache.put(address, point, utxo_list, stamp)
+    # UTxO tuples are immutable, callers share them but each gets its own list
+    return list(utxo_list)
+
+
+chain_follower = ChainFollower(node_pool,
+                               UTxOIndex(None if CHAIN_INDEX_PATH == 'memory' else CHAIN_INDEX_PATH,
+                                         WatchSet(WATCH_BLOOM_BITS, WATCH_BLOOM_HASHES),
+                                         None if CHAIN_SNAPSHOT_PATH == 'off' else CHAIN_SNAPSHOT_PATH),
+                               CHAIN_FOLLOWER_RECONNECT, CHAIN_FOLLOWER_MAX_LAG, CHAIN_SNAPSHOT_INTERVAL)
+mempool_watcher = MempoolWatcher(node_pool, MEMPOOL_POLL_INTERVAL, CHAIN_FOLLOWER_RECONNECT)
+
+
+async def query_watched_utxos(address):
+    # Description: Return available utxos of a middle wallet polled by a status handler, as a list of UTxO
+    #               With CHAIN_FOLLOWER on, the address is watched from the first poll and answered from the
+    #               chain follower's index once it is seeded and the follower is at the tip, otherwise (and
+    #               meanwhile) through query_utxos
+    utxo_list = _indexed_utxos(address)
+    if utxo_list is not None:
+        return utxo_list
+    return await query_utxos(address)
+
+
+async def query_watched_utxos_batch(addresses):
+    # Description: query_watched_utxos of several middle wallets, the ones not answered by the index in one batch
+    # Return: {address: list of UTxO}
+    utxos = {}
+    missing = []
+    for address in addresses:
+        utxo_list = _indexed_utxos(address)
+        if utxo_list is not None:
+            utxos[address] = utxo_list
+        else:
+            missing.append(address)
+    if missing:
+        utxos.update(await query_utxos_batch(missing))
+    return utxos
+
+
+def _indexed_utxos(address):
+    if chain_follower.running and chain_follower.watch(address) and chain_follower.caught_up:
+        return chain_follower.index.get(address)
+    return None
+
+
+def watch_new_wallet(wallet):
+    # Description: Index a wallet handed out by /v0/createwallet, it holds nothing yet so no seed query is needed
+    # Parameters: wallet JSON string of create_wallet_address
+    if chain_follower.running:
+        chain_follower.watch(json.loads(wallet)['address'], fresh=True)
+
+
+def unwatch_settled_wallet(address):
+    # Description: Stop indexing a middle wallet once its settlement transaction is submitted, a later status poll
+    #               watches it again if it still matters
+    trade_watchlist.remove(address)
+    if chain_follower.running:
+        chain_follower.unwatch(address)
+
+
+async def _fetch_utxos(address):
+    utxo_list = None
+    if NODE_CLIENT == 'native':
+        try:
+            utxo_list = await query_flight.do(('node', NETWORK_MAGIC, address), lambda: node_query_utxos(address))
+        except NodeClientError as e:
+            logger.warning('query_utxos: node socket query failed, using cardano-cli: %s', e)
+
+    if utxo_list is None:
+        command = query_utxo_command(address)
+        utxo_list = await query_flight.do(tuple(command), lambda: _query_utxos(command))
     return utxo_list
 
 
-async def coroutine_query_utxos(address):
-    # TODO
-    # Description: Return available utxos information in the address
-    start = time.time()
-    raw_utxo_table = None
-    # cardano-cli query utxo
+def query_utxo_command(*addresses):
+    # Description: cardano-cli query utxo for one or more addresses, printing JSON to stdout unless
+    #               UTXO_OUTPUT is 'table'
+    command = None
     if NETWORK == 'mainnet':
-        raw_utxo_table = run_command([CARDANO_CLI_PATH, 'query', 'utxo',
-                                      '--mainnet',
-                                      '--address', address], _env=my_env)
+        command = [CARDANO_CLI_PATH, 'query', 'utxo',
+                   '--mainnet']
     elif NETWORK == 'testnet':
-        raw_utxo_table = run_command([
-            CARDANO_CLI_PATH, 'query', 'utxo',
-            '--testnet-magic', TESTNET_MAGIC,
-            '--address', address], _env=my_env)
-    if type(raw_utxo_table) is subprocess.CalledProcessError:
-        pass
-        raise raw_utxo_table
-
-    # Get utxos
-    if type(raw_utxo_table) is subprocess.CalledProcessError:
-        raise raw_utxo_table
+        command = [CARDANO_CLI_PATH, 'query', 'utxo',
+                   '--testnet-magic', TESTNET_MAGIC]
+    for address in addresses:
+        command += ['--address', address]
+    if UTXO_OUTPUT == 'json':
+        command += ['--out-file', '/dev/stdout']
+    return command
+
+
+async def _query_utxos(command):
+    raw_utxo_output = await coroutine_run_command(command, _env=my_env)
+    if type(raw_utxo_output) is subprocess.CalledProcessError:
+        raise raw_utxo_output
+    return parse_utxo_output(raw_utxo_output)
+
+
+async def query_utxos_batch(addresses):
+    # Description: Return available utxos of many addresses as {address: list of UTxO}
+    #               Addresses are queried UTXO_QUERY_BATCH at a time in one node round trip or one
+    #               cardano-cli call with repeated --address, then split back per address
+    start = time.monotonic()
+    addresses = list(dict.fromkeys(addresses))
+    point = tip_watcher.point
+    stamp = utxo_cache.stamp()
+    utxos = {}
+    if point is not None:
+        for address in addresses:
+            utxo_list = utxo_cache.get(address, point)
+            if utxo_list is not None:
+                utxos[address] = utxo_list
+
+    missing = [address for address in addresses if address not in utxos]
+    batches = [missing[i:i + UTXO_QUERY_BATCH] for i in range(0, len(missing), UTXO_QUERY_BATCH)]
+    for batch_utxos in await asyncio.gather(*(_query_utxos_batch(batch) for batch in batches)):
+        utxos.update(batch_utxos)
+        if point is not None:
+            for address, utxo_list in batch_utxos.items():
+                utxo_cache.put(address, point, utxo_list, stamp)
+    logger.debug('query_utxos_batch: %d addresses in %.3f seconds', len(addresses), time.monotonic() - start)
+    return {address: list(utxos[address]) for address in addresses}
+
+
+async def _query_utxos_batch(addresses):
+    if len(addresses) == 1:
+        return {addresses[0]: await _fetch_utxos(addresses[0])}
+
+    if NODE_CLIENT == 'native':
+        try:
+            return await query_flight.do(('node', NETWORK_MAGIC) + tuple(addresses),
+                                         lambda: node_query_utxos_batch(addresses))
+        except NodeClientError as e:
+            logger.warning('query_utxos_batch: node socket query failed, using cardano-cli: %s', e)
 
-    utxo_list = []
-    utxo_table_rows = raw_utxo_table.strip().splitlines()
-    for x in range(2, len(utxo_table_rows)):
-        cells = utxo_table_rows[x].split()
-        for i in range(len(cells)):
-            cells[i] = cells[i].decode('utf-8').strip('"')
-        utxo_list.append(cells)
+    if UTXO_OUTPUT != 'json':
+        # The text table doesn't say which address an output belongs to
+        utxo_lists = await asyncio.gather(*(query_utxos(address) for address in addresses))
+        return dict(zip(addresses, utxo_lists))
 
-    print(f'query_utxos {address}: {time.time() - start} seconds')
-    return utxo_list
+    command = query_utxo_command(*addresses)
 
+    async def run():
+        raw_utxo_output = await coroutine_run_command(command, _env=my_env)
+        if type(raw_utxo_output) is subprocess.CalledProcessError:
+            raise raw_utxo_output
+        return parse_utxo_json_by_address(raw_utxo_output, addresses)
 
-def query_utxos_by_stake_address(stake_address):
-    response_list = get_address_list_by_stake_address(stake_address)
+    return await query_flight.do(tuple(command), run)
+
+
+async def query_utxos_by_stake_address(stake_address):
+    response_list = await get_address_list_by_stake_address(stake_address)
     print(f'response_list: {response_list}')
     sender_address_list = []
     for address in response_list:
         sender_address_list.append(address['address'])
 
     utxo_list = []
-    for address in sender_address_list:
-        utxo_list += query_utxos(address)
+    for address_utxos in (await query_utxos_batch(sender_address_list)).values():
+        utxo_list += address_utxos
     return utxo_list
 
 
-def query_utxos_blockfrost(_address):
-    api_key = BLOCKFROST_API_KEY
-    headers = {'project_id': api_key}
+blockfrost_client = BlockfrostClient(NETWORK, BLOCKFROST_API_KEY, BLOCKFROST_POOL_SIZE, BLOCKFROST_TIMEOUT,
+                                     BLOCKFROST_PAGE_WINDOW,
+                                     RateLimiter(BLOCKFROST_RATE_LIMIT, BLOCKFROST_BURST, BLOCKFROST_MAX_WAIT)
+                                     if BLOCKFROST_RATE_LIMIT > 0 else None,
+                                     BLOCKFROST_RETRIES, BLOCKFROST_BACKOFF)
+# Contents of transactions deep enough that a rollback can't change them
+tx_cache = TxContentCache(None if TX_CACHE_PATH == 'memory' else TX_CACHE_PATH, TX_CACHE_SIZE, TX_CACHE_CONFIRMATIONS)
+
+
+async def query_utxos_blockfrost(_address):
     utxo_list = []
-    cnt = 1
-    while True:
-        url = f'https://cardano-{NETWORK}.blockfrost.io/api/v0/addresses/{_address}/utxos?page={cnt}'
-        response = requests.request('GET', url=url, headers=headers)
-        utxo_list += response.json()
-        print(response.json())
-        if 'error' in response.json():
+    async for _, page in blockfrost_client.pages(f'/addresses/{_address}/utxos'):
+        if 'error' in page:
             raise ValueError('query_utxos_blockfrost: Bad Request')
-        if len(response.json()) == 0:
-            break
-        cnt += 1
+        utxo_list += page
     print(f'query_utxos_blockfrost: {utxo_list}')
     return utxo_list
 
 
-def get_protocol_file_path():
+async def get_protocol_file_path():
     # Description: Make a protocol.json file
     # Return: file path of protocol file
 
     if not os.path.isdir('protocol'):
         os.makedirs('protocol')
 
+    protocol_path = f'protocol/protocol.json'
+    if NODE_CLIENT == 'native':
+        try:
+            protocol_parameters = await node_query_protocol_parameters()
+            with open(protocol_path, 'w') as file:
+                json.dump(protocol_parameters, file, indent=4)
+            return protocol_path
+        except NodeClientError as e:
+            logger.warning('get_protocol_file_path: node socket query failed, using cardano-cli: %s', e)
+
     # Choose network
     net = None
     if NETWORK == 'mainnet':
@@ -178,18 +321,169 @@ def get_protocol_file_path():
     elif NETWORK == 'testnet':
         net = ['--testnet-magic', str(TESTNET_MAGIC)]
 
-    protocol_path = f'protocol/protocol.json'
     protocol_parameters = [CARDANO_CLI_PATH, 'query', 'protocol-parameters']
     protocol_parameters += net
     protocol_parameters += ['--out-file', protocol_path]
 
-    output = run_command(protocol_parameters, _env=my_env)
+    output = await coroutine_run_command(protocol_parameters, _env=my_env)
     if type(output) is subprocess.CalledProcessError:
         raise output
     return protocol_path
 
 
-def calculate_min_required_utxo(tx_out, datum_hash=None):
+async def query_tip():
+    # Description: Return the node tip in the JSON format of `cardano-cli query tip`
+    #               Raise subprocess.CalledProcessError if the node can't be queried
+    if NODE_CLIENT == 'native':
+        try:
+            return await node_query_tip()
+        except NodeClientError as e:
+            logger.warning('query_tip: node socket query failed, using cardano-cli: %s', e)
+
+    tip_parameters = [CARDANO_CLI_PATH, 'query', 'tip']
+    if NETWORK == 'mainnet':
+        tip_parameters += ['--mainnet']
+    else:
+        tip_parameters += ['--testnet-magic', TESTNET_MAGIC]
+
+    output = await coroutine_run_command(tip_parameters, _env=my_env)
+    if type(output) is subprocess.CalledProcessError:
+        raise output
+    return json.loads(output.decode('utf-8'))
+
+
+tip_watcher = TipWatcher(query_tip, TIP_POLL_INTERVAL, TIP_STALE_AFTER)
+# Every cached utxo set is stale once a block lands
+tip_watcher.add_listener(utxo_cache.clear)
+
+
+async def sign_transaction(draft, signing_key):
+    # Description: Sign a transaction body in process, same output as `cardano-cli transaction sign`
+    #               draft is the path of the body written by `cardano-cli transaction build` or its text
+    #               envelope, signing_key the path of a signing key file or its JSON {'type', 'cborHex'}.
+    #               Bodies with script witnesses go through cardano-cli
+    # Return: signed text envelope, or subprocess.CalledProcessError if cardano-cli failed
+    if isinstance(draft, str):
+        with open(draft, 'r') as file:
+            draft = json.load(file)
+    if isinstance(signing_key, str):
+        key = read_signing_key(signing_key)
+    else:
+        key = load_signing_key(signing_key)
+    try:
+        return sign_tx(draft, [key])
+    except UnsupportedTransaction as e:
+        logger.warning('sign_transaction: signing with cardano-cli: %s', e)
+
+    net = None
+    if NETWORK == 'mainnet':
+        net = ['--mainnet']
+    elif NETWORK == 'testnet':
+        net = ['--testnet-magic', str(TESTNET_MAGIC)]
+
+    if not os.path.isdir('transactions'):
+        os.makedirs('transactions')
+    _id = get_unique_id()
+    draft_path = f'transactions/tx_{_id}.draft'
+    key_path = f'transactions/tx_{_id}.skey'
+    signed_path = f'transactions/tx_{_id}.signed'
+    with open(draft_path, 'w') as file:
+        json.dump(draft, file)
+    if isinstance(signing_key, str):
+        key_path = signing_key
+    else:
+        with open(key_path, 'w') as file:
+            json.dump(signing_key, file)
+    sign_parameters = [CARDANO_CLI_PATH, 'transaction', 'sign',
+                       '--tx-body-file', draft_path,
+                       '--signing-key-file', key_path]
+    sign_parameters += net
+    sign_parameters += ['--out-file', signed_path]
+    try:
+        output = await coroutine_run_command(sign_parameters, _env=my_env)
+        if type(output) is subprocess.CalledProcessError:
+            return output
+        with open(signed_path, 'r') as file:
+            return json.load(file)
+    finally:
+        for path in (draft_path, signed_path, key_path):
+            if path != signing_key and os.path.exists(path):
+                os.remove(path)
+
+
+def get_tx_id(envelope):
+    # Description: Transaction id of a signed (or unsigned) transaction text envelope,
+    #               same as `cardano-cli transaction txid`
+    return envelope_tx_id(envelope)
+
+
+submitted_response = b'Transaction successfully submitted.\n'
+
+
+async def submit_tx(envelope, signed_path=None):
+    # Description: Submit a signed transaction text envelope {'type': 'Tx AlonzoEra', 'cborHex': ...}
+    #               Goes through LocalTxSubmission when NODE_CLIENT is 'native', otherwise (or when the
+    #               socket can't be used) through `cardano-cli transaction submit` on signed_path,
+    #               which is written from the envelope if not given
+    # Return: cardano-cli style output bytes, or subprocess.CalledProcessError if cardano-cli failed
+    #               Raise TxSubmitRejected with the node's reason when the node refuses the transaction
+    try:
+        return await _submit_tx(envelope, signed_path)
+    finally:
+        # Accepted or not, cached utxos of the addresses the transaction spends from or pays to are suspect
+        invalidate_tx_utxos(envelope)
+
+
+def invalidate_tx_utxos(envelope):
+    # Description: Drop cached utxos of the addresses a transaction spends from or pays to
+    try:
+        tx = cbor.loads(bytes.fromhex(envelope['cborHex']))
+        body = tx if isinstance(tx, dict) else tx[0]
+        inputs = body[0].value if isinstance(body[0], CBORTag) else body[0]
+        txins = [f'{tx_hash.hex()}#{index}' for tx_hash, index in inputs]
+        addresses = [address_from_bytes(decode_tx_out(tx_out)[0]) for tx_out in body[1]]
+    except Exception as e:
+        # Can't tell which addresses it touches, forget everything
+        logger.warning('invalidate_tx_utxos: cannot decode transaction: %s', e)
+        utxo_cache.clear()
+        utxo_cache.invalidate()
+        return
+    utxo_cache.invalidate([address for address in addresses if address is not None], txins)
+
+
+async def _submit_tx(envelope, signed_path):
+    if NODE_CLIENT == 'native':
+        try:
+            await node_submit_tx(envelope['type'], bytes.fromhex(envelope['cborHex']))
+            return submitted_response
+        except NodeClientError as e:
+            logger.warning('submit_tx: node socket submit failed, using cardano-cli: %s', e)
+
+    net = None
+    if NETWORK == 'mainnet':
+        net = ['--mainnet']
+    elif NETWORK == 'testnet':
+        net = ['--testnet-magic', str(TESTNET_MAGIC)]
+
+    temporary_path = None
+    if signed_path is None:
+        if not os.path.isdir('transactions'):
+            os.makedirs('transactions')
+        temporary_path = signed_path = f'transactions/tx_{get_unique_id()}.signed'
+        with open(signed_path, 'w') as file:
+            json.dump(envelope, file)
+
+    submit_parameters = [CARDANO_CLI_PATH, 'transaction', 'submit',
+                         '--tx-file', signed_path]
+    submit_parameters += net
+    try:
+        return await coroutine_run_command(submit_parameters, _env=my_env)
+    finally:
+        if temporary_path is not None:
+            os.remove(temporary_path)
+
+
+async def calculate_min_required_utxo(tx_out, datum_hash=None):
     """
     Calculate the minimum required UTxO for a transaction
     :param tx_out:
@@ -203,7 +497,7 @@ def calculate_min_required_utxo(tx_out, datum_hash=None):
     if datum_hash is not None:
         build_parameters += ['--tx-out-datum-hash', datum_hash]
 
-    output = run_command(build_parameters, _env=my_env)
+    output = await coroutine_run_command(build_parameters, _env=my_env)
     if type(output) is subprocess.CalledProcessError:
         raise output
 
@@ -211,7 +505,7 @@ def calculate_min_required_utxo(tx_out, datum_hash=None):
     return int(output[1])
 
 
-def calculate_min_value(multi_asset_string):
+async def calculate_min_value(multi_asset_string):
     # Description: calculate minimum ADA value for multi-asset utxo
     # Parameters: ()
     #           multi_asset_string: a string format when sending out as utxo
@@ -220,10 +514,10 @@ def calculate_min_value(multi_asset_string):
     # Return: the amount of minimum ADA requirement in string
 
     min_value_parameters = [CARDANO_CLI_PATH, 'transaction', 'calculate-min-value']
-    min_value_parameters += ['--protocol-params-file', get_protocol_file_path()]
+    min_value_parameters += ['--protocol-params-file', await get_protocol_file_path()]
     min_value_parameters += ['--multi-asset', multi_asset_string]
 
-    min_value = run_command(min_value_parameters, _env=my_env)
+    min_value = await coroutine_run_command(min_value_parameters, _env=my_env)
     if type(min_value) is subprocess.CalledProcessError:
         raise min_value
 
@@ -234,154 +528,139 @@ def calculate_min_value(multi_asset_string):
 
 
 def create_wallet_address(network=NETWORK):
-    # Tools: cardano-cli
-    # Description: Create a new payment address, verification_key, signing_key and locate them in
-    #   payment.addr, payment.vkey, payment.skey
+    # Description: Create a new payment key pair and its base address, like `cardano-cli address key-gen`,
+    #   `cardano-cli stake-address key-gen` and `cardano-cli address build` would, without files
+    #   The stake key is not kept, as before
     # Parameters:
     #           network == mainnet or testnet
 
-    # Check if address folder exists
-    if not os.path.isdir('address'):
-        os.makedirs('address')
-    # Create non duplicated file each time this method called
-    while True:
-        _id = get_unique_id()
-        file_path = f'address/payment_{_id}.addr'
-        try:
-            with open(file_path) as _file:
-                _file.close()
-            _id += 1
-        except FileNotFoundError:
-            break
-
     # Create payment key pair
-    payment_verification_key_path = f"address/payment_{_id}.vkey"
-    payment_signing_key_path = f"address/payment_{_id}.skey"
-    output = run_command([
-        CARDANO_CLI_PATH, 'address', 'key-gen',
-        '--verification-key-file', payment_verification_key_path,
-        '--signing-key-file', payment_signing_key_path
-    ])
-
-    if type(output) is subprocess.CalledProcessError:
-        raise output
+    payment_signing_key = generate_signing_key()
 
     # Create stake key pair
-    stake_verification_key_path = f'address/stake_{_id}.vkey'
-    stake_signing_key_path = f'address/stake_{_id}.skey'
-    output = run_command([
-        CARDANO_CLI_PATH, 'stake-address', 'key-gen',
-        '--verification-key-file', stake_verification_key_path,
-        '--signing-key-file', stake_signing_key_path
-    ])
-    if type(output) is subprocess.CalledProcessError:
-        raise output
+    stake_signing_key = generate_signing_key()
 
     # Create payment address
-    payment_address_path = f'address/payment_{_id}.addr'
-    if network == 'testnet':
-        output = run_command([
-            CARDANO_CLI_PATH, 'address', 'build',
-            '--payment-verification-key-file', payment_verification_key_path,
-            '--stake-verification-key-file', stake_verification_key_path,
-            '--out-file', payment_address_path,
-            '--testnet-magic', TESTNET_MAGIC
-        ])
-        if type(output) is subprocess.CalledProcessError:
-            raise output
-
-    elif network == 'mainnet':
-        output = run_command([
-            CARDANO_CLI_PATH, 'address', 'build',
-            '--payment-verification-key-file', payment_verification_key_path,
-            '--stake-verification-key-file', stake_verification_key_path,
-            '--out-file', payment_address_path,
-            '--mainnet'
-        ])
-        if type(output) is subprocess.CalledProcessError:
-            raise output
-
-    # Create stake address
-    # stake_address_path = f'address/stake_{_id}.addr'
-    # if network == 'testnet':
-    #     output = run_command([
-    #         CARDANO_CLI_PATH, 'stake-address', 'build',
-    #         '--stake-verification-key-file', stake_verification_key_path,
-    #         '--out-file', stake_address_path,
-    #         '--testnet-magic', TESTNET_MAGIC
-    #     ])
-    # if type(output) is subprocess.CalledProcessError:
-    #     raise output
-    # elif network == 'mainnet':
-    #     output = run_command([
-    #         CARDANO_CLI_PATH, 'stake-address', 'build',
-    #         '--stake-verification-key-file', stake_verification_key_path,
-    #         '--out-file', stake_address_path,
-    #         '--mainnet'
-    #     ])
-    # if type(output) is subprocess.CalledProcessError:
-    #     raise output
-
-    with open(payment_address_path, 'r') as file:
-        payment_address = file.read()
-    with open(payment_verification_key_path, 'r') as file:
-        payment_verification_key = json.loads(file.read())
-    with open(payment_signing_key_path, 'r') as file:
-        payment_signing_key = json.loads(file.read())
+    payment_address = base_address(payment_signing_key.key_hash(), stake_signing_key.key_hash(), network)
+
     output = {
         'address': payment_address,
-        'verification_key': payment_verification_key,
-        'signing_key': payment_signing_key
+        'verification_key': key_envelope('PaymentVerificationKeyShelley_ed25519', 'Payment Verification Key',
+                                         payment_signing_key.verification_key),
+        'signing_key': key_envelope('PaymentSigningKeyShelley_ed25519', 'Payment Signing Key',
+                                    payment_signing_key.secret)
     }
-    try:
-        os.remove(payment_address_path)
-        os.remove(payment_verification_key_path)
-        os.remove(payment_signing_key_path)
-        os.remove(stake_signing_key_path)
-        os.remove(stake_verification_key_path)
-        # print(payment_address_path)
-    except FileNotFoundError as e:
-        print(f'create_wallet_address: {e.errno}')
-        raise ValueError(f'create_wallet_address: {e.errno}')
     return json.dumps(output)
 
 
-def get_stake_address(_address):
-    # Note: a brand-new payment address without any utxo won't have a stake_address
+wallet_pool = WalletPool(create_wallet_address, WALLET_POOL_SIZE, WALLET_POOL_LOW_WATER,
+                         WALLET_POOL_REFILL_CONCURRENCY, WALLET_POOL_BATCH, WALLET_BATCH_WORKERS)
+
+
+async def get_stake_address(_address):
+    # Note: Blockfrost doesn't know a brand-new pointer or enterprise address without any utxo
     # --------------------------------------------------------------------------------
     # Tools: blockfrost.io
     # Description: Find a stake address associated with _address
+    #               Base addresses carry their stake credential and are decoded locally, other addresses are looked up
+    #               on Blockfrost and the answer is cached
     # Parameters:
     #           _address: requested address
-    # Return: stake address
-
-    api_key = BLOCKFROST_API_KEY
-    headers = {'project_id': api_key}
-    url = f'https://cardano-{NETWORK}.blockfrost.io/api/v0/addresses/{_address}'
-    response = requests.request('GET', url=url, headers=headers)
-    # print(url)
-    # print(response.json())
-    if 'error' in response.json():
+    # Return: stake address, None for an address without one, 'error' when Blockfrost doesn't know the address
+
+    stake_address = base_stake_address(_address)
+    if stake_address is not None:
+        return stake_address
+    try:
+        return await blockfrost_stake_address(_address)
+    except LookupError:
         print('Stake address\'s not found')
         return 'error'
-    return response.json()['stake_address']
 
 
-def get_transaction_content(tx_hash):
+# Stake addresses Blockfrost resolved for pointer and enterprise addresses, they never change
+blockfrost_stake_addresses = collections.OrderedDict()
+
+
+async def blockfrost_stake_address(_address):
+    # Tools: blockfrost.io
+    # Description: Stake address of _address according to Blockfrost, cached in blockfrost_stake_addresses
+    #               Unknown addresses raise LookupError and aren't cached, they may show up on chain later
+    if _address in blockfrost_stake_addresses:
+        blockfrost_stake_addresses.move_to_end(_address)
+        return blockfrost_stake_addresses[_address]
+    address_info = await blockfrost_client.get(f'/addresses/{_address}')
+    if 'error' in address_info:
+        raise LookupError(address_info['error'])
+    blockfrost_stake_addresses[_address] = address_info['stake_address']
+    while len(blockfrost_stake_addresses) > STAKE_ADDRESS_CACHE_SIZE:
+        blockfrost_stake_addresses.popitem(last=False)
+    return address_info['stake_address']
+
+
+async def get_stake_addresses(addresses):
+    # Description: get_stake_address of several addresses, the Blockfrost lookups run in parallel
+    # Parameters:
+    #           addresses: list of addresses
+    # Return: list of stake addresses, in the order of addresses
+
+    return list(await asyncio.gather(*(get_stake_address(address) for address in addresses)))
+
+
+async def get_transaction_content(tx_hash):
     # Tools: blockfrost.io
     # Description: Extract info from tx_hash
     # Parameters:
     #           tx_hash: Hash of the requested transaction
-    # Return: Return the contents of a transaction
+    # Return: Return the contents of a transaction, raise BlockfrostError when Blockfrost can't give them
+    #               Served from tx_cache once the transaction is TX_CACHE_CONFIRMATIONS blocks deep
+
+    content = tx_cache.get(tx_hash)
+    if content is not None:
+        return content
+    content = await blockfrost_client.get(f'/txs/{tx_hash}/utxos')
+    if 'error' in content:
+        # Callers read the inputs and outputs, an error body would only fail later as a KeyError
+        raise BlockfrostError(content.get('status_code'), content)
+    tx_cache.admit(tx_hash, content, await transaction_confirmations(tx_hash))
+    return content
 
-    api_key = BLOCKFROST_API_KEY
-    headers = {'project_id': api_key}
-    url = f'https://cardano-{NETWORK}.blockfrost.io/api/v0/txs/{tx_hash}/utxos'
-    response = requests.request('GET', url=url, headers=headers)
-    return response.json()
+
+async def transaction_confirmations(tx_hash):
+    # Tools: blockfrost.io
+    # Description: Count the blocks a transaction is under, its own included, against the tip of the tip watcher.
+    #               The block height of a transaction is fetched once and remembered until it is deep enough.
+    # Parameters:
+    #           tx_hash: Hash of the transaction
+    # Return: Number of confirmations, 0 while the transaction or the tip is unknown
+
+    if tip_watcher.point is None or tip_watcher.tip.get('block') is None:
+        return 0
+    height = tx_cache.height(tx_hash)
+    if height is None:
+        height = (await get_specific_transaction(tx_hash)).get('block_height')
+        if height is None:
+            return 0
+        tx_cache.remember_height(tx_hash, height)
+    return tip_watcher.tip['block'] - height + 1
+
+
+async def get_sender_address(tx_hash):
+    # Tools: blockfrost.io
+    # Description: Find the address of the first input of a transaction, who sent its outputs
+    #               Transactions the mempool watcher saw were resolved against the node while they were pending,
+    #               so settling a trade right after its deposits confirm doesn't wait on Blockfrost
+    # Parameters:
+    #           tx_hash: Hash of the requested transaction
+    # Return: sender address
+    sender_address = mempool_watcher.sender(tx_hash)
+    if sender_address is not None:
+        return sender_address
+    tx = await get_transaction_content(tx_hash)
+    return tx['inputs'][0]['address']
 
 
-def get_transaction_history(_address):
+async def get_transaction_history(_address):
     # Tools: blockfrost.io
     # Description: Find transaction history of an address
     # Parameters:
@@ -390,21 +669,14 @@ def get_transaction_history(_address):
 
     # Get all utxos existed in this address throughout history (first 100 pages)
     utxo_list = []
-    for i in range(100):
-        i += 1
-        # Get utxos in each page, max 100
-        url = f'https://cardano-{NETWORK}.blockfrost.io/api/v0/addresses/{_address}/transactions?page={i}'
-        api_key = BLOCKFROST_API_KEY
-        headers = {'project_id': api_key}
-        response = requests.request('GET', url=url, headers=headers)
-        # print(len(response.json()))
-        if len(response.json()) == 0:
-            break
-        # print(response.json())
-        if response.status_code != 200:
+    # Get utxos in each page, max 100
+    async for status_code, page in blockfrost_client.pages(f'/addresses/{_address}/transactions', max_pages=100):
+        if status_code != 200:
             raise ValueError(f'get_transaction_history: the address does not exist or cannot be found.'
-                             f'\n{response.text}')
-        utxo_list = utxo_list + response.json()
+                             f'\n{json.dumps(page)}')
+        if len(page) == 0:
+            break
+        utxo_list = utxo_list + page
 
     # Expand utxo_list_bf into details:
     # contents = []
@@ -414,7 +686,7 @@ def get_transaction_history(_address):
     return utxo_list
 
 
-def list_assets_by_stake_address(_stake_address):
+async def list_assets_by_stake_address(_stake_address):
     # Tools: blockfrost.io
     # Description: Find list of assets associated with the stake address
     # Parameters:
@@ -426,17 +698,11 @@ def list_assets_by_stake_address(_stake_address):
     # [{'6b8d07d69639e9413dd637a1a815a7323c69c86abbafb66dbfdb1aa7': 3},
     #  {'b0d07d45fe9514f80213f4020e5a61241458be626841cde717cb38a76e7574636f696e': 5}]
 
-    i = 0
     asset_list = []
-    while True:
-        i += 1
-        url = f'https://cardano-{NETWORK}.blockfrost.io/api/v0/accounts/{_stake_address}/addresses/assets?page={i}'
-        api_key = BLOCKFROST_API_KEY
-        headers = {'project_id': api_key}
-        response = requests.request('GET', url=url, headers=headers)
-        if len(response.json()) == 0:
-            break
-        asset_list = asset_list + response.json()
+    async for _, page in blockfrost_client.pages(f'/accounts/{_stake_address}/addresses/assets'):
+        if 'error' in page:
+            raise ValueError(f'Error in list_assets_by_stake_address: {page["error"]}')
+        asset_list = asset_list + page
 
     # Test multiple assets by adding 'abcxyz'
     # asset_list.append({'unit': 'b0d07d45fe9514f80213f4020e5a61241458be626841cde717cb38a76e7574636f696e',
@@ -461,45 +727,35 @@ def list_assets_by_stake_address(_stake_address):
     return assets
 
 
-def get_asset(_asset):
+async def get_asset(_asset):
     # Tools: blockfrost.io
     # Description: Get detail of a specific asset
     # Parameters:
     #           _asset: asset id of an asset
     # Return: asset information - asset_policy id, asset name, metadata,...
 
-    api_key = BLOCKFROST_API_KEY
-    headers = {'project_id': api_key}
-    url = f'https://cardano-{NETWORK}.blockfrost.io/api/v0/assets/{_asset}'
-    response = requests.request('GET', url=url, headers=headers)
-    return response.json()
+    return await blockfrost_client.get(f'/assets/{_asset}')
 
 
-def get_assets_of_specific_policy(policy_id):
+async def get_assets_of_specific_policy(policy_id):
     """
     Get assets' asset_policy list of a specific asset_policy
     :param policy_id: asset_policy id of that asset_policy
     :return: list of assets' asset_policy
     """
-    cnt = 1
+    cnt = 0
     asset_list = []
-    sum = 0
-    while True:
-        url = f'https://cardano-{NETWORK}.blockfrost.io/api/v0/assets/policy/{policy_id}?page={cnt}'
-        api_key = BLOCKFROST_API_KEY
-        headers = {'project_id': api_key}
-        response = requests.request('GET', url=url, headers=headers)
-        sum += len(response.json())
-        if len(response.json()) == 0:
-            break
-        asset_list += response.json()
+    async for _, page in blockfrost_client.pages(f'/assets/policy/{policy_id}'):
+        if 'error' in page:
+            raise ValueError(f'Error in get_assets_of_specific_policy: {page["error"]}')
+        asset_list += page
         cnt += 1
     print(f'cnt = {cnt}')
-    print(f'sum = {sum}')
+    print(f'sum = {len(asset_list)}')
     return asset_list
 
 
-def address_of_asset(asset_policy):
+async def address_of_asset(asset_policy):
     """
     Get address holder(s) of a specific asset
     :param asset_policy: policy of an asset
@@ -507,24 +763,22 @@ def address_of_asset(asset_policy):
     """
 
     # TODO: add multi-page of addresses
-    url = f'https://cardano-{NETWORK}.blockfrost.io/api/v0/assets/{asset_policy}/addresses'
-    api_key = BLOCKFROST_API_KEY
-    headers = {'project_id': api_key}
-    response = requests.request('GET', url=url, headers=headers)
-    return response.json()
+    return await blockfrost_client.get(f'/assets/{asset_policy}/addresses')
 
 
-def address_list_of_specific_policy(policy_id):
+async def address_list_of_specific_policy(policy_id):
     """
     Get address list of a specific asset_policy
     :param policy_id: asset_policy id of the asset_policy
     :return: list of addresses containing assets of the asset_policy
     """
-    asset_list = get_assets_of_specific_policy(policy_id)
+    asset_list = await get_assets_of_specific_policy(policy_id)
     address_list = set()
     for asset in asset_list:
         asset_policy = asset['asset']
-        addresses = address_of_asset(asset_policy)
+        addresses = await address_of_asset(asset_policy)
+        if 'error' in addresses:
+            raise ValueError(f'Error in address_list_of_specific_policy: {addresses["error"]}')
         for address in addresses:
             # print(address['address'])
             address_list.add(address['address'])
@@ -532,7 +786,7 @@ def address_list_of_specific_policy(policy_id):
     return address_list
 
 
-def get_user_addresses(payment_address, verify_amount):
+async def get_user_addresses(payment_address, verify_amount):
     # Description: Find the stake_address of the sender's address which sends
     #               the verify_amount to the payment_address located in sender_address_path
     # Parameters: (string, int)
@@ -547,32 +801,15 @@ def get_user_addresses(payment_address, verify_amount):
     transaction_history = []
 
     # Query UTXO and read the output
-    raw_utxo_table = None
-    if NETWORK == 'mainnet':
-        raw_utxo_table = run_command([
-            CARDANO_CLI_PATH, 'query', 'utxo',
-            '--mainnet',
-            '--address', payment_address], _env=my_env)
-    elif NETWORK == 'testnet':
-        raw_utxo_table = run_command([
-            CARDANO_CLI_PATH, 'query', 'utxo',
-            '--testnet-magic', TESTNET_MAGIC,
-            '--address', payment_address], _env=my_env)
-    # print(raw_utxo_table[2])
-    if type(raw_utxo_table) is subprocess.CalledProcessError:
-        raise raw_utxo_table
+    utxo_list = await query_utxos(payment_address)
 
     found = False
-    # Calculate total lovelace of the UTXO(s) inside the wallet address
-    utxo_table_rows = raw_utxo_table.strip().splitlines()
-    for x in range(2, len(utxo_table_rows)):
-        cells = utxo_table_rows[x].split()
-
+    for utxo in utxo_list:
         # If utxo includes a token -> skip
-        if len(cells) > 6:
+        if not utxo.ada_only:
             continue
-        if cells[2].decode('utf-8') == str(verify_amount):
-            transaction_history.append(get_transaction_content(cells[0].decode('utf-8')))
+        if utxo.lovelace == int(verify_amount):
+            transaction_history.append(await get_transaction_content(utxo.tx_hash))
             found = True
             break
     # print(transaction_history)
@@ -588,38 +825,27 @@ def get_user_addresses(payment_address, verify_amount):
     # print(found)
 
     if found is True:
-        stake_address = get_stake_address(sender_utxo_address)
+        stake_address = await get_stake_address(sender_utxo_address)
 
     return stake_address, sender_utxo_address
 
 
-def get_address_list_by_stake_address(stake_address):
+async def get_address_list_by_stake_address(stake_address):
     """
     Get list of addresses associated with stake address
     :param stake_address: stake address
     :return: list of addresses
     """
-    cnt = 0
     response_list = []
-    while True:
-        cnt += 1
-        url = f'https://cardano-{NETWORK}.blockfrost.io/api/v0/accounts/{stake_address}/addresses?page={cnt}'
-        api_key = BLOCKFROST_API_KEY
-        # print(api_key)
-        # print(url)
-        headers = {'project_id': api_key}
-        response = requests.request('GET', url=url, headers=headers)
-        if 'error' in response.json():
-            raise ValueError(f'Error in get_address_list_by_stake_address: {response.json()["error"]}')
-        response_list += response.json()
-        # print(response.json())
-        if len(response.json()) == 0:
-            break
+    async for _, page in blockfrost_client.pages(f'/accounts/{stake_address}/addresses'):
+        if 'error' in page:
+            raise ValueError(f'Error in get_address_list_by_stake_address: {page["error"]}')
+        response_list += page
     print(len(response_list))
     return response_list
 
 
-def get_balance_by_stake_address(stake_address):
+async def get_balance_by_stake_address(stake_address):
     """
     Get total ADA and list of assets associated with stake_address
     :param stake_address: stake address
@@ -627,29 +853,16 @@ def get_balance_by_stake_address(stake_address):
     """
 
     # Get list of addresses
-    response_list = get_address_list_by_stake_address(stake_address)
+    response_list = await get_address_list_by_stake_address(stake_address)
     address_list = []
     for address in response_list:
         address_list.append(address['address'])
 
     # print(address_list)
     account = {}
-    for address in address_list:
-        utxo_list = query_utxos(address)
-        # print(utxo_list_bf)
+    for utxo_list in (await query_utxos_batch(address_list)).values():
         for utxo in utxo_list:
-            pairs = [(i + 2, i + 3) for i in range(0, len(utxo) - 3, 3)]
-            # print(len(utxo))
-            # print(pairs)
-            for pair in pairs:
-                unit_pos = pair[1]
-                quantity_pos = pair[0]
-                unit = utxo[unit_pos]
-                quantity = utxo[quantity_pos]
-                if unit in account:
-                    account[unit] += int(quantity)
-                else:
-                    account[unit] = int(quantity)
+            add_utxo_to_dict(account, utxo)
 
     # Change to json response format
     response = []
@@ -660,8 +873,8 @@ def get_balance_by_stake_address(stake_address):
             policy_id = components[0]
             if len(components) > 1:
                 asset_name = components[1]
-            temp = asset_name.encode('utf-8').hex()
-            policy = policy_id + temp
+            # from 1.32.1 query is hex name
+            policy = policy_id + asset_name
         else:
             policy = key
         response.append({'unit': policy, 'quantity': str(value)})
@@ -670,7 +883,17 @@ def get_balance_by_stake_address(stake_address):
     return response
 
 
-def check_buyer_and_seller(utxo_list, buyer_stake_list, seller_stake_list, buy_listing, sell_listing):
+def is_buyer_utxo(utxo, unit, quantity):
+    # The buyer's payment: an ADA-only utxo holding exactly the listed lovelace
+    return utxo.ada_only and unit == 'lovelace' and utxo.lovelace == int(quantity)
+
+
+def is_seller_utxo(utxo, unit, quantity):
+    # The seller's asset: a utxo holding the listed asset in the listed quantity, other assets may ride along
+    return utxo.assets.get(unit) == int(quantity)
+
+
+async def check_buyer_and_seller(utxo_list, buyer_stake_list, seller_stake_list, buy_listing, sell_listing):
     """
     Check if buyer has sent ADA and seller has sent asset(s)
     :param utxo_list:
@@ -707,26 +930,25 @@ def check_buyer_and_seller(utxo_list, buyer_stake_list, seller_stake_list, buy_l
 
     # Mark registered utxos, buyer and seller address
     for i, utxo in enumerate(utxo_list):
-        tx = get_transaction_content(utxo[0])
-        sender_utxo_address = tx['inputs'][0]['address']
-        sender_stake_address = get_stake_address(sender_utxo_address)
+        sender_utxo_address = await get_sender_address(utxo.tx_hash)
+        sender_stake_address = await get_stake_address(sender_utxo_address)
         if sender_stake_address in buyer_stake_list:
             utxo_mark[i] = 1
             from_address[i] = sender_utxo_address
-            if len(utxo) <= 6 and utxo[3] == buy_listing['unit'] and utxo[2] == buy_quantity:
+            if is_buyer_utxo(utxo, buy_listing['unit'], buy_quantity):
                 buyer_address = sender_utxo_address
-                ada_tx = utxo[0]
+                ada_tx = utxo.tx_hash
         if sender_stake_address in seller_stake_list:
             utxo_mark[i] = 1
             from_address[i] = sender_utxo_address
-            if len(utxo) == 9 and utxo[6] == sell_listing['unit'] and utxo[5] == sell_quantity:
+            if is_seller_utxo(utxo, sell_listing['unit'], sell_quantity):
                 seller_address = sender_utxo_address
-                asset_tx = utxo[0]
+                asset_tx = utxo.tx_hash
 
     return buyer_address, ada_tx, seller_address, asset_tx, utxo_mark, from_address
 
 
-def check_buyer_and_seller_without_stake_address(utxo_list, buy_listing, sell_listing):
+async def check_buyer_and_seller_without_stake_address(utxo_list, buy_listing, sell_listing):
     """
     Check if buyer has sent ADA and seller has sent asset(s), no restriction by stake address
     :param utxo_list:
@@ -763,26 +985,41 @@ def check_buyer_and_seller_without_stake_address(utxo_list, buy_listing, sell_li
 
     # Mark registered utxos, buyer and seller address
     for i, utxo in enumerate(utxo_list):
-        tx = get_transaction_content(utxo[0])
-        sender_utxo_address = tx['inputs'][0]['address']
+        sender_utxo_address = await get_sender_address(utxo.tx_hash)
         # sender_stake_address = get_stake_address(sender_utxo_address)
         # if sender_stake_address in buyer_stake_list:
         #     utxo_mark[i] = 1
         from_address[i] = sender_utxo_address
-        if len(utxo) <= 6 and utxo[3] == buy_listing['unit'] and utxo[2] == buy_quantity:
+        if is_buyer_utxo(utxo, buy_listing['unit'], buy_quantity):
             buyer_address = sender_utxo_address
-            ada_tx = utxo[0]
+            ada_tx = utxo.tx_hash
         # if sender_stake_address in seller_stake_list:
         #     utxo_mark[i] = 1
         # from_address[i] = sender_utxo_address
-        if len(utxo) == 9 and utxo[6] == sell_listing['unit'] and utxo[5] == sell_quantity:
+        if is_seller_utxo(utxo, sell_listing['unit'], sell_quantity):
             seller_address = sender_utxo_address
-            asset_tx = utxo[0]
+            asset_tx = utxo.tx_hash
 
     return buyer_address, ada_tx, seller_address, asset_tx, from_address
 
 
-def check_buyer_and_seller_blockfrost(utxo_list_bf, buyer_stake_list, seller_stake_list, buy_listing, sell_listing):
+async def get_sender_stake_address(tx_hash):
+    # Tools: blockfrost.io
+    # Description: Find the stake address of whoever sent a transaction, from its first input
+    # Parameters:
+    #           tx_hash: Hash of the requested transaction
+    # Return: stake address, 'error' when the sender has none
+    return await get_stake_address(await get_sender_address(tx_hash))
+
+
+trade_watchlist = TradeWatchlist(query_watched_utxos_batch, get_sender_stake_address, lambda: tip_watcher.point,
+                                 TRADE_SESSION_TTL, mempool_watcher)
+tip_watcher.add_listener(trade_watchlist.notify)
+mempool_watcher.add_listener(trade_watchlist.notify)
+
+
+async def check_buyer_and_seller_blockfrost(utxo_list_bf, buyer_stake_list, seller_stake_list, buy_listing,
+                                            sell_listing):
     """
     Check if buyer has sent ADA and seller has sent asset(s)
     :param utxo_list_bf:
@@ -819,9 +1056,9 @@ def check_buyer_and_seller_blockfrost(utxo_list_bf, buyer_stake_list, seller_sta
 
     # Mark registered utxos, buyer and seller address
     for i, utxo in enumerate(utxo_list_bf):
-        tx = get_transaction_content(utxo['tx_hash'])
+        tx = await get_transaction_content(utxo['tx_hash'])
         sender_utxo_address = tx['inputs'][0]['address']
-        sender_stake_address = get_stake_address(sender_utxo_address)
+        sender_stake_address = await get_stake_address(sender_utxo_address)
         if sender_stake_address in buyer_stake_list:
             utxo_mark[i] = 1
             from_address[i] = sender_utxo_address
@@ -849,7 +1086,7 @@ def check_buyer_and_seller_blockfrost(utxo_list_bf, buyer_stake_list, seller_sta
     return buyer_address, ada_tx, seller_address, asset_tx, utxo_mark, from_address
 
 
-def check_buyer_and_seller_blockfrost_without_stake_address(utxo_list_bf, buy_listing, sell_listing):
+async def check_buyer_and_seller_blockfrost_without_stake_address(utxo_list_bf, buy_listing, sell_listing):
     """
     Check if buyer has sent ADA and seller has sent asset(s)
     :param utxo_list_bf:
@@ -875,7 +1112,7 @@ def check_buyer_and_seller_blockfrost_without_stake_address(utxo_list_bf, buy_li
 
     # Mark registered utxos, buyer and seller address
     for i, utxo in enumerate(utxo_list_bf):
-        tx = get_transaction_content(utxo['tx_hash'])
+        tx = await get_transaction_content(utxo['tx_hash'])
         sender_utxo_address = tx['inputs'][0]['address']
         # sender_stake_address = get_stake_address(sender_utxo_address)
         # if sender_stake_address in buyer_stake_list:
@@ -906,29 +1143,22 @@ def check_buyer_and_seller_blockfrost_without_stake_address(utxo_list_bf, buy_li
 
 
 def add_utxo_to_dict(_dict, utxo):
-    pairs = [(i + 2, i + 3) for i in range(0, len(utxo) - 3, 3)]
-    for pair in pairs:
-        unit_pos = pair[1]
-        quantity_pos = pair[0]
-        unit = utxo[unit_pos]
-        quantity = utxo[quantity_pos]
-        if quantity == 'TxOutDatumHash':
-            break
+    for unit, quantity in utxo.amounts().items():
         if unit in _dict:
-            _dict[unit] += int(quantity)
+            _dict[unit] += quantity
         else:
-            _dict[unit] = int(quantity)
+            _dict[unit] = quantity
     return _dict
 
 
-def to_tx_out(recipient_address, utxo):
+async def to_tx_out(recipient_address, utxo):
     _list = {}
     _list = add_utxo_to_dict(_list, utxo)
 
     # Calculate minimum lovelace required for utxo
     txout_records = [f'{_list[key]} {key}' for key in _list if _list[key] > 0]
     tx_out = f"{recipient_address}+{'+'.join(txout_records)}"
-    min_lovelace = calculate_min_required_utxo(tx_out)
+    min_lovelace = await calculate_min_required_utxo(tx_out)
     _list['lovelace'] = int(min_lovelace)
 
     # Add minimum lovelace
@@ -937,7 +1167,7 @@ def to_tx_out(recipient_address, utxo):
     return tx_out
 
 
-def calculate_fee(txin_list, txout_list, protocol_path):
+async def calculate_fee(txin_list, txout_list, protocol_path):
     # Choose network
     net = None
     if NETWORK == 'mainnet':
@@ -964,7 +1194,7 @@ def calculate_fee(txin_list, txout_list, protocol_path):
     draft_path = f'transactions/tx_{_id}.draft'
     build_parameters += ['--out-file', draft_path, '--alonzo-era']
 
-    output = run_command(build_parameters, _env=my_env)
+    output = await coroutine_run_command(build_parameters, _env=my_env)
     if type(output) is subprocess.CalledProcessError:
         raise output
 
@@ -977,7 +1207,7 @@ def calculate_fee(txin_list, txout_list, protocol_path):
     build_parameters += net
     build_parameters += ['--protocol-params-file', protocol_path]
 
-    output = run_command(build_parameters, _env=my_env)
+    output = await coroutine_run_command(build_parameters, _env=my_env)
     if type(output) is subprocess.CalledProcessError:
         raise output
     # Clean draft file
@@ -1012,7 +1242,7 @@ def check_enough_fund(sender_balance, package_balance):
     return True
 
 
-def address_key_hash(verification_key):
+async def address_key_hash(verification_key):
     """
     Get hash of an address key
     :param verification_key:
@@ -1024,7 +1254,7 @@ def address_key_hash(verification_key):
         json.dump(verification_key, file)
     parameter = [CARDANO_CLI_PATH, 'address', 'key-hash', '--payment-verification-key-file', verification_key_file_path]
 
-    key_hash = run_command(parameter, _env=my_env)
+    key_hash = await coroutine_run_command(parameter, _env=my_env)
     if type(key_hash) is subprocess.CalledProcessError:
         raise key_hash
     key_hash = key_hash.decode('utf-8').strip('\n')
@@ -1038,7 +1268,7 @@ def address_key_hash(verification_key):
     return key_hash
 
 
-def hash_script_data(datum_json_file_path):
+async def hash_script_data(datum_json_file_path):
     """
     Calculate the hash of script data
     :param datum_json_file_path:
@@ -1046,28 +1276,28 @@ def hash_script_data(datum_json_file_path):
     """
     parameter = [CARDANO_CLI_PATH, 'transaction', 'hash-script-data', '--script-data-file', datum_json_file_path]
 
-    datum_hash = run_command(parameter, _env=my_env)
+    datum_hash = await coroutine_run_command(parameter, _env=my_env)
     if type(datum_hash) is subprocess.CalledProcessError:
         raise datum_hash
     datum_hash = datum_hash.decode('utf-8').strip('\n')
     return datum_hash
 
 
-def hash_script_data_from_json(datum_json):
+async def hash_script_data_from_json(datum_json):
     """
     Calculate the hash of script data
     :param datum_json:
     :return: datum_hash
     """
     parameter = [CARDANO_CLI_PATH, 'transaction', 'hash-script-data', '--script-data-value', datum_json]
-    datum_hash = run_command(parameter, _env=my_env)
+    datum_hash = await coroutine_run_command(parameter, _env=my_env)
     if type(datum_hash) is subprocess.CalledProcessError:
         raise datum_hash
     datum_hash = datum_hash.decode('utf-8').strip('\n')
     return datum_hash
 
 
-def get_script_address(script_file_path):
+async def get_script_address(script_file_path):
     """
     Get a script address from .plutus file
     :param script_file_path:
@@ -1082,7 +1312,7 @@ def get_script_address(script_file_path):
 
     parameters = [CARDANO_CLI_PATH, 'address', 'build', '--payment-script-file', script_file_path]
     parameters += net
-    output = run_command(parameters, _env=my_env)
+    output = await coroutine_run_command(parameters, _env=my_env)
     if type(output) is subprocess.CalledProcessError:
         raise output
     script_address = output.decode('utf-8').strip('\n')
@@ -1106,18 +1336,14 @@ def combine_dict_package(package_1, package_2):
     return b
 
 
-def get_specific_transaction(txid):
-    api_key = BLOCKFROST_API_KEY
-    headers = {'project_id': api_key}
-    url = f'https://cardano-{NETWORK}.blockfrost.io/api/v0/txs/{txid}'
-    response = requests.request('GET', url=url, headers=headers)
-    return response.json()
+async def get_specific_transaction(txid):
+    return await blockfrost_client.get(f'/txs/{txid}')
 
 
 if __name__ == '__main__':
     # TEST
     # stake_address = 'stake1uywz35vm9jyjzshs0trxnapmdpp6khscn68c7s0w8fqdlksrv4qgg'
     # print(get_balance_by_stake_address(stake_address))
-    print(address_key_hash({"type": "PaymentVerificationKeyShelley_ed25519", "description": "Payment Verification Key",
-                            "cborHex": "582072db109047ece86a7167c6329ceaf558bfc4c4c49997d718674d30dd1ca08857"}))
+    print(asyncio.run(address_key_hash({"type": "PaymentVerificationKeyShelley_ed25519", "description": "Payment Verification Key",
+                            "cborHex": "582072db109047ece86a7167c6329ceaf558bfc4c4c49997d718674d30dd1ca08857"})))
     pass
@@ -0,0 +1,147 @@
+import collections
+import json
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    # orjson is optional, it parses large wallets several times faster
+    _json_loads = json.loads
+
+"""
+UTxO model shared by the node client, cardano-cli parsing and the handlers
+"""
+
+
+class UTxO(collections.namedtuple('UTxO', ['tx_hash', 'index', 'lovelace', 'assets', 'datum_hash'])):
+    """
+    One unspent output
+    tx_hash: hex string
+    index: int
+    lovelace: int
+    assets: {unit: quantity}, unit is 'policy id.asset name hex' as cardano-cli prints it, or the policy id
+            alone for an empty asset name. Shared between callers, never mutated
+    datum_hash: hex string or None
+    """
+    __slots__ = ()
+
+    @property
+    def txin(self):
+        return f'{self.tx_hash}#{self.index}'
+
+    @property
+    def ada_only(self):
+        return not self.assets
+
+    def amounts(self):
+        # {'lovelace': lovelace, unit: quantity, ...}
+        amounts = {'lovelace': self.lovelace}
+        amounts.update(self.assets)
+        return amounts
+
+    def value(self):
+        # Value part of a cardano-cli --tx-out, e.g. '2000000+1 policy.4e4654'
+        return '+'.join([str(self.lovelace)] + [f'{quantity} {unit}' for unit, quantity in self.assets.items()])
+
+    def amount_list(self):
+        return [{'unit': unit, 'quantity': str(quantity)} for unit, quantity in self.amounts().items()]
+
+    def cells(self):
+        # Row of the `cardano-cli query utxo` table, split on whitespace
+        cells = [self.tx_hash, str(self.index), str(self.lovelace), 'lovelace']
+        for unit, quantity in self.assets.items():
+            cells += ['+', str(quantity), unit]
+        if self.datum_hash is not None:
+            cells += ['+', 'TxOutDatumHash', 'ScriptDataInAlonzoEra', self.datum_hash]
+        else:
+            cells += ['+', 'TxOutDatumNone']
+        return cells
+
+    def as_dict(self):
+        # Response format of the utxos endpoints
+        return {'tx_hash': self.tx_hash, 'tx_index': str(self.index), 'amount': self.amount_list(),
+                'datum_hash': self.datum_hash}
+
+
+def asset_unit(policy_id, asset_name):
+    return f'{policy_id}.{asset_name}' if asset_name else policy_id
+
+
+def parse_utxo_row(cells):
+    """
+    Parse one row of the `cardano-cli query utxo` table
+    :param cells: row split on whitespace, e.g. [hash, '0', '1500000', 'lovelace', '+', '1', 'policy.4e4654',
+                  '+', 'TxOutDatumNone']
+    :return: UTxO
+    """
+    assets = {}
+    datum_hash = None
+    i = 4
+    while i + 1 < len(cells) and cells[i] == '+':
+        quantity = cells[i + 1]
+        if quantity.startswith('TxOutDatum'):
+            if quantity == 'TxOutDatumHash':
+                datum_hash = cells[-1].strip('"')
+            break
+        unit = cells[i + 2]
+        assets[unit] = assets.get(unit, 0) + int(quantity)
+        i += 3
+    return UTxO(cells[0], int(cells[1]), int(cells[2]), assets, datum_hash)
+
+
+def _utxo_from_json(txin, output):
+    tx_hash, _, index = txin.partition('#')
+    value = output['value']
+    assets = {}
+    if len(value) > 1:
+        assets = {asset_unit(policy_id, asset_name): quantity
+                  for policy_id, policy_assets in value.items() if policy_id != 'lovelace'
+                  for asset_name, quantity in policy_assets.items()}
+    # 'datumhash' since cardano-cli 1.33, 'data' before
+    datum_hash = output.get('datumhash') or output.get('data')
+    return UTxO(tx_hash, int(index), value.get('lovelace', 0), assets, datum_hash)
+
+
+def parse_utxo_json(raw_utxo_json):
+    """
+    Parse the output of `cardano-cli query utxo --out-file`
+    :param raw_utxo_json: bytes or str, {'hash#index': {'address': ..., 'value': {'lovelace': 1500000,
+                          'policy id': {'asset name hex': 1}}, 'datumhash': ...}}
+    :return: list of UTxO
+    """
+    return [_utxo_from_json(txin, output) for txin, output in _json_loads(raw_utxo_json).items()]
+
+
+def parse_utxo_json_by_address(raw_utxo_json, addresses):
+    """
+    Parse the output of `cardano-cli query utxo --out-file` run with several --address
+    :param addresses: queried addresses, each gets a list even when it holds no utxo
+    :return: {address: list of UTxO}
+    """
+    utxos = {address: [] for address in addresses}
+    for txin, output in _json_loads(raw_utxo_json).items():
+        utxos.setdefault(output['address'], []).append(_utxo_from_json(txin, output))
+    return utxos
+
+
+def parse_utxo_table(raw_utxo_table):
+    """
+    Parse the text table `cardano-cli query utxo` prints without --out-file
+    :param raw_utxo_table: bytes or str
+    :return: list of UTxO
+    """
+    if isinstance(raw_utxo_table, bytes):
+        raw_utxo_table = raw_utxo_table.decode('utf-8')
+    rows = raw_utxo_table.strip().splitlines()
+    return [parse_utxo_row(row.split()) for row in rows[2:]]
+
+
+def parse_utxo_output(raw_output):
+    """
+    Parse `cardano-cli query utxo` output in either format, whatever the installed cardano-cli printed
+    :param raw_output: bytes or str
+    :return: list of UTxO
+    """
+    if raw_output.lstrip()[:1] in (b'{', '{'):
+        return parse_utxo_json(raw_output)
+    return parse_utxo_table(raw_output)
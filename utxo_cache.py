@@ -0,0 +1,125 @@
+import collections
+import time
+
+"""
+UTxOs of recently queried addresses, valid until the chain tip moves
+"""
+
+# Rough CPython footprint of a cache entry, a UTxO and one of its assets
+_ENTRY_BYTES = 400
+_UTXO_BYTES = 450
+_ASSET_BYTES = 250
+
+
+def _estimate_size(utxo_list):
+    return _ENTRY_BYTES + sum(_UTXO_BYTES + _ASSET_BYTES * len(utxo.assets) for utxo in utxo_list)
+
+
+class UTxOCache:
+    """
+    LRU of {address: UTxOs} keyed by the chain point they were queried at
+    """
+
+    def __init__(self, ttl, max_entries, max_bytes):
+        """
+        :param ttl: seconds an entry is served even if the tip hasn't moved, 0 disables the cache
+        :param max_entries: addresses kept
+        :param max_bytes: approximate memory cap of the kept UTxOs
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # address -> (point, time.monotonic() when stored, utxo list, estimated size)
+        self._entries = collections.OrderedDict()
+        # tx hash#index -> address holding it, to find the entries a submitted transaction spends
+        self._owners = {}
+        self._bytes = 0
+        # Bumped by every invalidation, queries that overlap one aren't stored
+        self._stamp = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_entries > 0
+
+    def stamp(self):
+        # Take before querying, pass to put()
+        return self._stamp
+
+    def get(self, address, point):
+        """
+        Cached UTxOs of the address queried at this chain point, None when missing, expired or older
+        """
+        entry = self._entries.get(address)
+        if entry is None or entry[0] != point or time.monotonic() - entry[1] > self.ttl:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(address)
+        self.hits += 1
+        return entry[2]
+
+    def put(self, address, point, utxo_list, stamp):
+        """
+        Store the UTxOs of an address queried at a chain point
+        :param stamp: stamp() taken before the query, nothing is stored if an invalidation happened since
+        """
+        if not self.enabled or stamp != self._stamp:
+            return
+        size = _estimate_size(utxo_list)
+        if size > self.max_bytes:
+            return
+        self._drop(address)
+        self._entries[address] = (point, time.monotonic(), utxo_list, size)
+        self._bytes += size
+        for utxo in utxo_list:
+            self._owners[utxo.txin] = address
+        self.stores += 1
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def invalidate(self, addresses=(), txins=()):
+        """
+        Drop the entries of these addresses and of the addresses holding these tx hash#index
+        """
+        self._stamp += 1
+        for txin in txins:
+            address = self._owners.get(txin)
+            if address is not None:
+                self.invalidations += self._drop(address)
+        for address in addresses:
+            self.invalidations += self._drop(address)
+
+    def clear(self, point=None):
+        # The tip moved, every entry is stale
+        self._entries.clear()
+        self._owners.clear()
+        self._bytes = 0
+
+    def _drop(self, address):
+        entry = self._entries.pop(address, None)
+        if entry is None:
+            return 0
+        self._bytes -= entry[3]
+        for utxo in entry[2]:
+            if self._owners.get(utxo.txin) == address:
+                del self._owners[utxo.txin]
+        return 1
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'estimated_bytes': self._bytes,
+            'ttl': self.ttl,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'stores': self.stores,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
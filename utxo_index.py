@@ -0,0 +1,409 @@
+import collections
+import json
+import logging
+import sqlite3
+
+import bech32
+from index_snapshot import *
+from ouroboros import *
+from watch_set import *
+
+"""
+UTxOs of watched addresses, kept up to date block by block by the chain follower
+"""
+
+logger = logging.getLogger("default")
+
+# Spent outputs are kept this many slots to undo rollbacks, k / f on mainnet (2160 blocks, 12 hours)
+ROLLBACK_SLOTS = 43200
+# Recent block points offered to the node when the follower reconnects
+RECENT_POINTS = 50
+# Slot an address generated by us is complete from
+FRESH = -1
+
+
+class UTxOIndex:
+    """
+    In-memory UTxO set of watched addresses, written through to SQLite when a path is given
+    """
+
+    def __init__(self, path=None, watch_set=None, snapshot_path=None):
+        """
+        :param path: SQLite file, None keeps the index in memory only
+        :param watch_set: WatchSet the block outputs are tested against, a plain one by default
+        :param snapshot_path: binary snapshot loaded by open() ahead of the SQLite rows, None disables snapshots
+        """
+        self.path = path
+        self.snapshot_path = snapshot_path
+        self._db = None
+        # address -> slot its utxos are complete from, None until seeded from a state query
+        self.addresses = {}
+        # address bytes -> address
+        self._by_bytes = {}
+        # Payment credentials of the watched addresses
+        self.watch_set = watch_set if watch_set is not None else WatchSet()
+        # address -> {txin: (UTxO, slot created)}
+        self._utxos = {}
+        # txin -> address
+        self._owners = {}
+        # txin -> (address, UTxO, slot created, slot spent), kept ROLLBACK_SLOTS to undo rollbacks
+        self._spent = {}
+        # (slot, block hash hex, block number) of the last blocks applied
+        self.points = collections.deque(maxlen=RECENT_POINTS)
+        # txin -> slot of every input spent since a seed query was started at _seed_slot
+        self._spent_since = None
+        self._seed_slot = None
+        self.blocks = 0
+        self.rollbacks = 0
+
+    @property
+    def point(self):
+        # (slot, block hash hex) the index is at, None before the first block
+        if not self.points:
+            return None
+        slot, block_hash, _ = self.points[-1]
+        return slot, block_hash
+
+    """
+    Watched addresses
+    """
+
+    def watch(self, address, fresh=False):
+        """
+        Start indexing an address
+        :param fresh: the address was just generated and can't hold utxos yet, so it's complete right away.
+                      Otherwise its current utxos come from the next seed query
+        :return: False for addresses that can't be indexed (Byron)
+        """
+        if address in self.addresses:
+            return True
+        since = FRESH if fresh else None
+        if not self._track(address, since):
+            return False
+        if self._db is not None:
+            with self._db:
+                self._db.execute('INSERT OR REPLACE INTO addresses VALUES (?, ?)', (address, since))
+        return True
+
+    def _track(self, address, since, address_bytes=None):
+        if address_bytes is None:
+            try:
+                address_bytes = bech32.decode(address)[1]
+            except bech32.Bech32Error:
+                return False
+        if address_bytes not in self._by_bytes and not self.watch_set.add(address_bytes):
+            return False
+        self.addresses[address] = since
+        self._by_bytes[address_bytes] = address
+        self._utxos.setdefault(address, {})
+        return True
+
+    def unwatch(self, address):
+        """
+        Stop indexing an address, e.g. a middle wallet whose trade is settled
+        """
+        if address not in self.addresses:
+            return
+        del self.addresses[address]
+        address_bytes = bech32.decode(address)[1]
+        del self._by_bytes[address_bytes]
+        self.watch_set.discard(address_bytes)
+        for txin in self._utxos.pop(address):
+            del self._owners[txin]
+        # Its spent outputs too, a rollback can't bring back utxos of an address that isn't watched
+        for txin in [txin for txin, entry in self._spent.items() if entry[0] == address]:
+            del self._spent[txin]
+        if self._db is not None:
+            with self._db:
+                self._db.execute('DELETE FROM addresses WHERE address = ?', (address,))
+                self._db.execute('DELETE FROM utxos WHERE address = ?', (address,))
+
+    def get(self, address):
+        """
+        UTxOs of a watched address in `cardano-cli query utxo` order, None while it isn't complete
+        """
+        if self.addresses.get(address) is None:
+            return None
+        return [utxo for utxo, _ in sorted(self._utxos[address].values(), key=lambda item: item[0][:2])]
+
+    def pending(self):
+        return [address for address, since in self.addresses.items() if since is None]
+
+    def begin_seed(self):
+        """
+        Start seeding the addresses that aren't complete, inputs spent from now on are journaled
+        :return: (point to query the addresses at, addresses) or (None, []) when there is nothing to do
+        """
+        addresses = self.pending()
+        if not addresses or self.point is None:
+            return None, []
+        self._seed_slot = self.point[0]
+        self._spent_since = {}
+        return self.point, addresses
+
+    def finish_seed(self, utxos):
+        """
+        Merge a state query made at the point given by begin_seed()
+        :param utxos: {address: list of UTxO}
+        :return: False when a rollback past the seed point made the query useless
+        """
+        spent_since = self._spent_since
+        self._spent_since = None
+        if spent_since is None:
+            return False
+        seeded = []
+        for address, utxo_list in utxos.items():
+            if address not in self.addresses or self.addresses[address] is not None:
+                continue
+            for utxo in utxo_list:
+                if utxo.txin not in spent_since and utxo.txin not in self._owners:
+                    self._add(address, utxo, self._seed_slot)
+            self.addresses[address] = self._seed_slot
+            seeded.append(address)
+        if self._db is not None:
+            with self._db:
+                self._db.executemany('UPDATE addresses SET since = ? WHERE address = ?',
+                                     [(self._seed_slot, address) for address in seeded])
+                self._db.executemany('INSERT OR REPLACE INTO utxos VALUES (?, ?, ?, ?, NULL)',
+                                     [self._row(address, utxo, slot) for address in seeded
+                                      for utxo, slot in self._utxos[address].values()])
+        return True
+
+    """
+    Chain updates
+    """
+
+    def apply_block(self, slot, block_no, block_hash, txs):
+        """
+        :param txs: [(tx id hex, raw tx body, valid)] as decode_block returns them
+        """
+        created = []
+        spent = []
+        for tx_id, body, valid in txs:
+            # Inputs only matter when they can spend an indexed output or must be journaled for a seed
+            inputs, outputs = scan_tx(body, valid, self.watch_set, bool(self._owners) or self._spent_since is not None)
+            for txin in inputs:
+                if self._spent_since is not None:
+                    self._spent_since[txin] = slot
+                address = self._owners.pop(txin, None)
+                if address is None:
+                    continue
+                utxo, created_slot = self._utxos[address].pop(txin)
+                self._spent[txin] = (address, utxo, created_slot, slot)
+                spent.append(txin)
+            for index, tx_out, address_bytes in outputs:
+                # Same payment credential, maybe another stake part
+                address = self._by_bytes.get(address_bytes)
+                if address is None:
+                    continue
+                _, lovelace, assets, datum_hash, _ = decode_tx_out(tx_out)
+                units = {asset_unit(policy, name): quantity for (policy, name), quantity in assets.items()}
+                utxo = UTxO(tx_id, index, lovelace, units, datum_hash)
+                self._add(address, utxo, slot)
+                created.append((address, utxo))
+        self.points.append((slot, block_hash, block_no))
+        self.blocks += 1
+
+        # Spent outputs past the rollback horizon are gone for good, checked every 100 blocks
+        horizon = slot - ROLLBACK_SLOTS
+        expired = []
+        if self.blocks % 100 == 0:
+            expired = [txin for txin, entry in self._spent.items() if entry[3] < horizon]
+        for txin in expired:
+            del self._spent[txin]
+
+        if self._db is not None:
+            with self._db:
+                self._db.executemany('INSERT OR REPLACE INTO utxos VALUES (?, ?, ?, ?, NULL)',
+                                     [self._row(address, utxo, slot) for address, utxo in created])
+                self._db.executemany('UPDATE utxos SET spent_slot = ? WHERE txin = ?',
+                                     [(slot, txin) for txin in spent])
+                self._db.execute('INSERT OR REPLACE INTO points VALUES (?, ?, ?)', (slot, block_hash, block_no))
+                self._db.execute('DELETE FROM points WHERE slot < ?', (self.points[0][0],))
+                if expired:
+                    self._db.execute('DELETE FROM utxos WHERE spent_slot < ?', (horizon,))
+
+    def rollback(self, slot, block_hash):
+        """
+        Undo every block after the point (slot, block hash hex), slot None is the origin
+        """
+        self.rollbacks += 1
+        slot = -1 if slot is None else slot
+        while self.points and self.points[-1][0] > slot:
+            self.points.pop()
+        if slot >= 0 and not self.points:
+            self.points.append((slot, block_hash, None))
+
+        for address_utxos in self._utxos.values():
+            for txin in [txin for txin, (_, created_slot) in address_utxos.items() if created_slot > slot]:
+                del address_utxos[txin]
+                del self._owners[txin]
+        for txin in [txin for txin, entry in self._spent.items() if entry[3] > slot]:
+            address, utxo, created_slot, _ = self._spent.pop(txin)
+            if created_slot <= slot and address in self._utxos:
+                self._add(address, utxo, created_slot)
+
+        # A state query seeded these addresses on blocks that no longer exist
+        unseeded = [address for address, since in self.addresses.items() if since is not None and since > slot]
+        for address in unseeded:
+            for txin in self._utxos[address]:
+                del self._owners[txin]
+            self._utxos[address] = {}
+            self.addresses[address] = None
+        if self._spent_since is not None:
+            if slot < self._seed_slot:
+                self._spent_since = None
+            else:
+                self._spent_since = {txin: spent_slot for txin, spent_slot in self._spent_since.items()
+                                     if spent_slot <= slot}
+
+        if self._db is not None:
+            with self._db:
+                self._db.execute('DELETE FROM utxos WHERE slot > ?', (slot,))
+                self._db.execute('UPDATE utxos SET spent_slot = NULL WHERE spent_slot > ?', (slot,))
+                self._db.executemany('DELETE FROM utxos WHERE address = ?', [(address,) for address in unseeded])
+                self._db.execute('UPDATE addresses SET since = NULL WHERE since > ?', (slot,))
+                self._db.execute('DELETE FROM points WHERE slot > ?', (slot,))
+                if self.points:
+                    self._db.execute('INSERT OR REPLACE INTO points VALUES (?, ?, ?)', self.points[-1])
+
+    def reset(self):
+        """
+        The follower lost its place on the chain: forget every utxo and seed all addresses again
+        """
+        self._utxos = {address: {} for address in self.addresses}
+        self._owners = {}
+        self._spent = {}
+        self.points.clear()
+        self._spent_since = None
+        for address in self.addresses:
+            self.addresses[address] = None
+        if self._db is not None:
+            with self._db:
+                self._db.execute('DELETE FROM utxos')
+                self._db.execute('DELETE FROM points')
+                self._db.execute('UPDATE addresses SET since = NULL')
+
+    def _add(self, address, utxo, slot):
+        self._utxos[address][utxo.txin] = (utxo, slot)
+        self._owners[utxo.txin] = address
+
+    """
+    SQLite
+    """
+
+    @staticmethod
+    def _row(address, utxo, slot):
+        return utxo.txin, address, json.dumps(list(utxo)), slot
+
+    def open(self):
+        """
+        Load what a previous run indexed: the snapshot when it is as recent as the SQLite file, otherwise the SQLite
+        rows
+        """
+        if self._db is not None:
+            return
+        # Addresses watched before the index was opened
+        watched = dict(self.addresses)
+        restored = self.load_snapshot()
+        if self.path is None:
+            for address, since in watched.items():
+                if address not in self.addresses:
+                    self._track(address, since)
+            return
+        self._db = sqlite3.connect(self.path)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS points '
+                             '(slot INTEGER PRIMARY KEY, hash TEXT NOT NULL, block_no INTEGER)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS addresses (address TEXT PRIMARY KEY, since INTEGER)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS utxos (txin TEXT PRIMARY KEY, address TEXT NOT NULL, '
+                             'utxo TEXT NOT NULL, slot INTEGER NOT NULL, spent_slot INTEGER)')
+            self._db.executemany('INSERT OR IGNORE INTO addresses VALUES (?, ?)', list(watched.items()))
+        addresses = dict(self._db.execute('SELECT address, since FROM addresses'))
+        last_point = self._db.execute('SELECT slot, hash FROM points ORDER BY slot DESC LIMIT 1').fetchone()
+        # Blocks, seeds and unwatches all show in the points or the addresses, when both match the utxos do too
+        if restored and last_point == self.point and addresses == self.addresses:
+            logger.info('utxo index: restored from the snapshot at %s', self.point)
+            return
+        self._clear()
+        for address, since in addresses.items():
+            self._track(address, since)
+        for row in self._db.execute('SELECT slot, hash, block_no FROM points ORDER BY slot'):
+            self.points.append(tuple(row))
+        for txin, address, utxo, slot, spent_slot in self._db.execute('SELECT * FROM utxos'):
+            utxo = UTxO(*json.loads(utxo))
+            if spent_slot is None:
+                self._add(address, utxo, slot)
+            else:
+                self._spent[txin] = (address, utxo, slot, spent_slot)
+
+    def _clear(self):
+        self.addresses = {}
+        self._by_bytes = {}
+        self.watch_set.clear()
+        self._utxos = {}
+        self._owners = {}
+        self._spent = {}
+        self.points.clear()
+
+    """
+    Snapshot
+    """
+
+    def snapshot(self):
+        """
+        Encode the index for write_snapshot(), in the event loop so that no block is half applied
+        :return: bytes
+        """
+        utxos = [(address, utxo, slot, None) for address, address_utxos in self._utxos.items()
+                 for utxo, slot in address_utxos.values()]
+        # Spent outputs make the snapshot safe to restore before a rollback
+        utxos += [(address, utxo, created, spent) for address, utxo, created, spent in self._spent.values()]
+        addresses = [(address, address_bytes, self.addresses[address])
+                     for address_bytes, address in self._by_bytes.items()]
+        return encode_snapshot(list(self.points), addresses, utxos)
+
+    def load_snapshot(self):
+        """
+        Replace the index content with the snapshot file
+        :return: False when there is no usable snapshot
+        """
+        if self.snapshot_path is None:
+            return False
+        try:
+            snapshot = read_snapshot(self.snapshot_path)
+        except (SnapshotError, OSError) as e:
+            logger.warning('utxo index: ignoring snapshot %s: %s', self.snapshot_path, e)
+            return False
+        if snapshot is None:
+            return False
+        with snapshot:
+            self._clear()
+            self.points.extend(snapshot.points)
+            for address, address_bytes, since in snapshot.addresses():
+                self._track(address, since, address_bytes)
+            for address, utxo, created, spent in snapshot.utxos():
+                if spent is None:
+                    self._add(address, utxo, created)
+                else:
+                    self._spent[utxo.txin] = (address, utxo, created, spent)
+        return True
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def stats(self):
+        point = self.point
+        return {
+            'addresses': len(self.addresses),
+            'watch_set': self.watch_set.stats(),
+            'pending': len(self.pending()),
+            'utxos': len(self._owners),
+            'spent_kept': len(self._spent),
+            'point': list(point) if point is not None else None,
+            'blocks': self.blocks,
+            'rollbacks': self.rollbacks,
+            'sqlite': self.path,
+        }
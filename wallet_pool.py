@@ -0,0 +1,177 @@
+import asyncio
+import collections
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from scheduler import *
+
+"""
+Pre-generated middle wallets
+"""
+
+logger = logging.getLogger("default")
+
+
+def _generate_batch(generate, count):
+    # Runs in a worker process
+    return [generate() for _ in range(count)]
+
+
+class WalletPool:
+    """
+    Ready wallets filled in the background, handed out in O(1) and generated on the refill workers when the pool is
+    empty
+    """
+
+    def __init__(self, generate, size, low_water, concurrency, batch, batch_workers):
+        """
+        :param generate: picklable function without arguments returning a wallet, e.g. create_wallet_address
+        :param size: wallets kept ready, 0 disables the pool
+        :param low_water: refill starts when fewer wallets are left
+        :param concurrency: worker processes generating wallets during a refill
+        :param batch: wallets generated per worker job
+        :param batch_workers: worker processes shared by bulk requests (stream)
+        """
+        self.generate = generate
+        self.size = size
+        self.low_water = min(low_water, size)
+        self.concurrency = max(concurrency, 1)
+        self.batch = max(batch, 1)
+        self.batch_workers = max(batch_workers, 1)
+        self._batch_executor = None
+        self._wallets = collections.deque()
+        self._wake = None
+        self._task = None
+        self._executor = None
+        self._refilling = False
+        self.popped = 0
+        self.inline = 0
+        self.generated = 0
+        self.refills = 0
+        self.refill_errors = 0
+        self.last_refill_seconds = 0.0
+        self.last_refill_rate = 0.0
+        self.streamed = 0
+
+    def start(self):
+        if self.size <= 0 or self._task is not None:
+            return
+        self._wake = asyncio.Event()
+        self._executor = ProcessPoolExecutor(max_workers=self.concurrency)
+        self._task = asyncio.ensure_future(self._refill_loop())
+        self._wake.set()
+
+    async def close(self):
+        if self._task is not None:
+            await cancel_task(self._task)
+            self._task = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._batch_executor is not None:
+            self._batch_executor.shutdown(wait=False, cancel_futures=True)
+            self._batch_executor = None
+
+    async def pop(self):
+        """
+        A ready wallet, or a freshly generated one when the pool is empty
+        """
+        if self._wallets:
+            wallet = self._wallets.popleft()
+            self.popped += 1
+        else:
+            # Key generation is CPU bound, it runs on a worker process rather than the event loop
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.concurrency)
+            wallet = await asyncio.get_running_loop().run_in_executor(self._executor, self.generate)
+            self.inline += 1
+        if self._wake is not None and len(self._wallets) < self.low_water:
+            self._wake.set()
+        return wallet
+
+    async def stream(self, count):
+        """
+        Generate wallets in parallel on the bulk worker processes, without touching the ready pool
+        :param count: number of wallets
+        :return: async iterator of wallets, in completion order
+        """
+        loop = asyncio.get_running_loop()
+        if self._batch_executor is None:
+            self._batch_executor = ProcessPoolExecutor(max_workers=self.batch_workers)
+        pending = set()
+        remaining = count
+        try:
+            while remaining or pending:
+                # Keep every worker busy with one job queued behind it
+                while remaining and len(pending) < self.batch_workers * 2:
+                    size = min(self.batch, remaining)
+                    remaining -= size
+                    pending.add(loop.run_in_executor(self._batch_executor, _generate_batch, self.generate, size))
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    for wallet in future.result():
+                        self.streamed += 1
+                        yield wallet
+        finally:
+            # The client went away
+            for future in pending:
+                future.cancel()
+
+    async def _refill_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            self._refilling = True
+            start = time.monotonic()
+            produced = 0
+            try:
+                while len(self._wallets) < self.size:
+                    missing = self.size - len(self._wallets)
+                    counts = []
+                    while missing > 0 and len(counts) < self.concurrency:
+                        counts.append(min(self.batch, missing))
+                        missing -= counts[-1]
+                    batches = await asyncio.gather(*(loop.run_in_executor(self._executor, _generate_batch,
+                                                                          self.generate, count)
+                                                     for count in counts))
+                    for wallets in batches:
+                        self._wallets.extend(wallets)
+                        produced += len(wallets)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Pops on an empty pool generate one wallet each, try again on the next pop below the low-water mark
+                self.refill_errors += 1
+                logger.error('wallet pool: refill failed: %s', e)
+                # A crashed worker breaks the executor for good
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = ProcessPoolExecutor(max_workers=self.concurrency)
+            self._refilling = False
+            if produced == 0:
+                # Woken again while the previous refill topped the pool up
+                continue
+            elapsed = time.monotonic() - start
+            self.generated += produced
+            self.refills += 1
+            self.last_refill_seconds = elapsed
+            self.last_refill_rate = produced / elapsed
+
+    def stats(self):
+        return {
+            'depth': len(self._wallets),
+            'size': self.size,
+            'low_water': self.low_water,
+            'refill_concurrency': self.concurrency,
+            'refilling': self._refilling,
+            'popped': self.popped,
+            'inline': self.inline,
+            'generated': self.generated,
+            'refills': self.refills,
+            'refill_errors': self.refill_errors,
+            'last_refill_seconds': round(self.last_refill_seconds, 3),
+            'last_refill_wallets_per_second': round(self.last_refill_rate, 1),
+            'batch_workers': self.batch_workers,
+            'streamed': self.streamed,
+        }
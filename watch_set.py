@@ -0,0 +1,172 @@
+import cbor
+
+"""
+Payment credentials of watched addresses, matched against raw transaction outputs
+"""
+
+# Bytes of a payment credential (blake2b-224 of a key or a script)
+CREDENTIAL_SIZE = 28
+
+
+def payment_credential(address_bytes):
+    """
+    Payment credential of a Shelley base, pointer or enterprise address
+    :param address_bytes: raw address, header byte first
+    :return: 28 bytes, None for Byron and reward addresses
+    """
+    if len(address_bytes) < 1 + CREDENTIAL_SIZE or address_bytes[0] >> 4 > 7:
+        return None
+    return bytes(address_bytes[1:1 + CREDENTIAL_SIZE])
+
+
+class WatchSet:
+    """
+    Exact set of watched payment credentials, optionally behind a counting Bloom filter. Outputs are tested on the
+    raw CBOR of a transaction body, only the ones paying a watched credential are decoded
+    """
+
+    def __init__(self, bloom_bits=0, bloom_hashes=3):
+        """
+        :param bloom_bits: counters of the Bloom filter checked before the exact set, 0 disables it
+        :param bloom_hashes: counters set per credential, at most 7 (they are read off the credential itself)
+        """
+        # credential -> count of watched addresses sharing it
+        self._credentials = {}
+        self.bloom_hashes = max(1, min(bloom_hashes, CREDENTIAL_SIZE // 4))
+        self._bloom = bytearray(bloom_bits) if bloom_bits > 0 else None
+        self.scanned = 0
+        self.matched = 0
+        self.false_positives = 0
+
+    def __len__(self):
+        return len(self._credentials)
+
+    def __contains__(self, credential):
+        if self._bloom is not None and not self._bloom_test(credential):
+            return False
+        if credential in self._credentials:
+            return True
+        if self._bloom is not None:
+            self.false_positives += 1
+        return False
+
+    def add(self, address_bytes):
+        """
+        Watch the payment credential of an address
+        :return: False for addresses without one
+        """
+        credential = payment_credential(address_bytes)
+        if credential is None:
+            return False
+        count = self._credentials.get(credential, 0)
+        self._credentials[credential] = count + 1
+        if count == 0 and self._bloom is not None:
+            for position in self._bloom_positions(credential):
+                # Saturated counters are never decremented, the filter only gets less selective
+                if self._bloom[position] < 255:
+                    self._bloom[position] += 1
+        return True
+
+    def discard(self, address_bytes):
+        credential = payment_credential(address_bytes)
+        count = self._credentials.get(credential)
+        if count is None:
+            return
+        if count > 1:
+            self._credentials[credential] = count - 1
+            return
+        del self._credentials[credential]
+        if self._bloom is not None:
+            for position in self._bloom_positions(credential):
+                if 0 < self._bloom[position] < 255:
+                    self._bloom[position] -= 1
+
+    def clear(self):
+        self._credentials.clear()
+        if self._bloom is not None:
+            self._bloom = bytearray(len(self._bloom))
+
+    def _bloom_positions(self, credential):
+        # Credentials are hashes already, their bytes serve as the Bloom hash functions
+        size = len(self._bloom)
+        return [int.from_bytes(credential[i:i + 4], 'little') % size for i in range(0, self.bloom_hashes * 4, 4)]
+
+    def _bloom_test(self, credential):
+        bloom = self._bloom
+        size = len(bloom)
+        for i in range(0, self.bloom_hashes * 4, 4):
+            if not bloom[int.from_bytes(credential[i:i + 4], 'little') % size]:
+                return False
+        return True
+
+    """
+    Raw transaction outputs
+    """
+
+    def match_output(self, data, start, end):
+        """
+        Test the transaction output data[start:end] without decoding it
+        :return: the address bytes when its payment credential is watched, otherwise None
+        """
+        data, address_start, address_end = _address_span(data, start, end)
+        if address_end - address_start < 1 + CREDENTIAL_SIZE or data[address_start] >> 4 > 7:
+            return None
+        if data[address_start + 1:address_start + 1 + CREDENTIAL_SIZE] not in self:
+            return None
+        return data[address_start:address_end]
+
+    def scan_outputs(self, data, offset):
+        """
+        Outputs of the raw CBOR array of transaction outputs at offset paying a watched credential
+        :return: (list of (output index, start, end, address bytes), count of outputs, offset after the array)
+        """
+        _, _, count, offset = cbor.read_head(data, offset)
+        matches = []
+        index = 0
+        while count is None or index < count:
+            if count is None and data[offset] == 0xff:
+                offset += 1
+                break
+            end = cbor.skip(data, offset)
+            if self._credentials:
+                address_bytes = self.match_output(data, offset, end)
+                if address_bytes is not None:
+                    matches.append((index, offset, end, address_bytes))
+            offset = end
+            index += 1
+        self.scanned += index
+        self.matched += len(matches)
+        return matches, index, offset
+
+    def stats(self):
+        return {
+            'credentials': len(self._credentials),
+            'bloom_bits': len(self._bloom) if self._bloom is not None else 0,
+            'scanned_outputs': self.scanned,
+            'matched_outputs': self.matched,
+            'bloom_false_positives': self.false_positives,
+        }
+
+
+def _address_span(data, start, end):
+    # (buffer, start, end) of the address bytes of a raw output, [address, value, ...] until Alonzo and
+    # {0: address, ...} since Babbage. Node-encoded outputs have the address first, anything else is decoded
+    initial = data[start]
+    if initial >> 5 == 4 and (initial & 0x1f) < 24 or initial == 0x9f:
+        offset = start + 1
+    elif (initial >> 5 == 5 and (initial & 0x1f) < 24 or initial == 0xbf) and data[start + 1] == 0:
+        offset = start + 2
+    else:
+        return _decoded_address_span(data, start, end)
+    initial = data[offset]
+    if 0x40 <= initial < 0x58:
+        return data, offset + 1, offset + 1 + initial - 0x40
+    if initial == 0x58:
+        return data, offset + 2, offset + 2 + data[offset + 1]
+    return _decoded_address_span(data, start, end)
+
+
+def _decoded_address_span(data, start, end):
+    # Address bytes of an unusually encoded output, as a buffer of their own
+    address_bytes = cbor.loads(data[start:end])[0]
+    return address_bytes, 0, len(address_bytes)